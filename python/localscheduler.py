@@ -37,6 +37,7 @@ import subprocess
 import process
 import socket
 import copy
+import threading
 
 class VizProcess(process.Process):
     	def __init__(self, proc):
@@ -113,6 +114,10 @@ class LocalReservation(launcher.Launcher):
 				self.sched.deallocate(self)
 		self.sched = None
 
+	def detach(self):
+		# There's nothing outside us to keep; this is the same as deallocate
+		self.deallocate()
+
 	def run(self, args, node, inFile=None, outFile=None, errFile=None, launcherEnv=None):
 		if node not in ["localhost"]:
 			if node != socket.gethostname():
@@ -137,10 +142,20 @@ class LocalReservation(launcher.Launcher):
 		if domNode.nodeName != LocalReservation.rootNodeName:
 			raise ValueError, "Failed to deserialize LocalReservation. Programmatic Error"
 
+	def toDict(self):
+		return { 'class' : LocalReservation.rootNodeName }
+
+	def fromDict(self, d):
+		if d.get('class') != LocalReservation.rootNodeName:
+			raise ValueError, "Failed to deserialize LocalReservation. Programmatic Error"
+
 class LocalScheduler(scheduler.Scheduler):
 
 	def __init__(self, nodeList, params):
 		self.allocations = []
+		# allocate and deallocate may be called from the SSM's allocation
+		# workers, as well as from its main loop
+		self.allocationsLock = threading.Lock()
         	self.nodeList = nodeList # FIXME: we could validate if we can resolve these names
 		if len(nodeList)==0:
 			raise ValueError, "I need one or more nodes to manage, you gave me none!"
@@ -155,15 +170,43 @@ class LocalScheduler(scheduler.Scheduler):
 			if nodeName not in self.nodeList:
 				raise ValueError, "Node '%s' is not managed by this Local Scheduler"%(nodeName)
 		alloc = LocalReservation(self)
+		self.allocationsLock.acquire()
 		self.allocations.append(alloc)
+		self.allocationsLock.release()
 		return alloc
 
+	def reclaim(self, requests):
+		"""
+		Take back the reservations of allocations made by an earlier run of
+		the SSM. requests is a list of [launcherInfo, nodeList, uid], where
+		launcherInfo is from the toDict method of the reservation. There's
+		nothing to check with us, so every reservation is taken back.
+		"""
+		ret = []
+		for launcherInfo, nodeList, uid in requests:
+			if launcherInfo.get('class') != LocalReservation.rootNodeName:
+				ret.append(None)
+				continue
+			alloc = LocalReservation(self)
+			self.allocationsLock.acquire()
+			self.allocations.append(alloc)
+			self.allocationsLock.release()
+			ret.append(alloc)
+		return ret
+
 	def getUnusableNodes(self):
 		return []
 
+	def invalidateNodeState(self):
+		pass
+
 	def deallocate(self, allocObj):
-		for idx in range(len(self.allocations)):
-			if allocObj is self.allocations[idx]:
-				self.allocations.pop(idx)
-				return
+		self.allocationsLock.acquire()
+		try:
+			for idx in range(len(self.allocations)):
+				if allocObj is self.allocations[idx]:
+					self.allocations.pop(idx)
+					return
+		finally:
+			self.allocationsLock.release()
 		print "No such allocation was allocated by the Local Scheduler"
@@ -48,16 +48,21 @@ class Allocation:
 		self.allocatedResources = None
 		self.launcherList = None
 		self.user = None
+		self.node2launcher = None
 
-	def __init__(self, launcherList, allocatedResources, user):
+	def __init__(self, launcherList, allocatedResources, user, node2launcher=None):
 		"""
 		launcher => the real allocation from the scheduler. This encapsulates all resources included in
 		the allocation.
 		allocatedResources => the resources allocated for this.
+		node2launcher => the launcher for each node having schedulable resources.
 		"""
 		self.launcherList = launcherList
 		self.allocatedResources = allocatedResources
 		self.user = user
+		if node2launcher is None:
+			node2launcher = {}
+		self.node2launcher = node2launcher
 
 	def getUser(self):
 		return self.user
@@ -87,12 +92,54 @@ class Allocation:
 		# Clear all internal variables to indicate that we are'nt valid
 		self.__clearAll()
 
+	def detach(self):
+		"""
+		Forget the allocation without giving back its nodes. The scheduler
+		jobs outlive us, so that the allocation can be restored later by
+		Metascheduler.restoreAllocations().
+		"""
+		if self.launcherList is not None:
+			for launcher in self.launcherList:
+				launcher.detach()
+		self.__clearAll()
+
 	def getResources(self):
 		"""
 		Get the list of resources associated with this allocation.
 		"""
 		return self.allocatedResources
 
+	def toDict(self):
+		"""
+		Return a dictionary representation of this allocation, from which
+		Metascheduler.restoreAllocations() can recreate it.
+		"""
+		resources = []
+		for item in self.allocatedResources:
+			if isinstance(item, list):
+				resources.append(map(lambda x: x.toDict(), item))
+			else:
+				resources.append(item.toDict())
+		launchers = []
+		for launcher in self.launcherList:
+			nodes = filter(lambda x: self.node2launcher[x] is launcher, self.node2launcher.keys())
+			launchers.append({ 'nodes' : sorted(nodes), 'launcher' : launcher.toDict() })
+		return { 'user' : self.user, 'resources' : resources, 'launchers' : launchers }
+
+class PendingAllocation:
+	"""
+	Resources reserved by Metascheduler.reserve(), whose nodes are yet to be
+	allocated from the schedulers.
+	"""
+	def __init__(self, requestedResources, indexOfExpandedInFinal, allocatedResources, undoLog, userInfo):
+		self.requestedResources = requestedResources
+		self.indexOfExpandedInFinal = indexOfExpandedInFinal
+		self.allocatedResources = allocatedResources
+		self.undoLog = undoLog
+		self.userInfo = userInfo
+		self.launcherList = None
+		self.node2launcher = None
+
 class Metascheduler:
 	def __init__(self, allNodes, schedList):
 		self.allocations = []
@@ -119,6 +166,84 @@ class Metascheduler:
 		self.nodeMap = nodeMap
 		self.nodeWeightWhenFree = nodeWeightWhenFree
 
+		# Free resources, indexed by host name and then by resource class.
+		# This is kept up to date as resources are allocated and freed, so
+		# we don't need to look at every resource on every allocation
+		self.freeIndex = {}
+		for nodeName in nodeMap:
+			self.freeIndex[nodeName] = {}
+		for res in vizResourceList:
+			self.__updateFreeIndex(res)
+
+		# Bumped whenever the allocation state of a resource on a node
+		# changes, indexed by host name
+		self.nodeGeneration = {}
+		for nodeName in nodeMap:
+			self.nodeGeneration[nodeName] = 0
+
+	def __updateFreeIndex(self, res):
+		"""
+		Add res to the index of free resources if it is free, else remove it.
+		"""
+		nodeIndex = self.freeIndex.setdefault(res.getHostName(), {})
+		classIndex = nodeIndex.setdefault(res.rootNodeName, {})
+		if res.isFree():
+			classIndex[res.hashKey()] = res
+		else:
+			classIndex.pop(res.hashKey(), None)
+
+	def __resourceChanged(self, res):
+		"""
+		Called whenever the allocation state of res changes.
+		"""
+		self.__updateFreeIndex(res)
+		nodeName = res.getHostName()
+		self.nodeGeneration[nodeName] = self.nodeGeneration.get(nodeName, 0)+1
+
+	def getNodeGeneration(self, nodeName):
+		"""
+		Returns a number which changes whenever the allocation state of a
+		resource on the node changes. Callers can use this to find out if
+		what they derived from that state is still good.
+		"""
+		return self.nodeGeneration.get(nodeName, 0)
+
+	def resourceModified(self, res):
+		"""
+		Tell the metascheduler that res was changed by the caller, e.g. when
+		the configuration of an X server is updated. This changes the
+		generation of its node, like a change in its allocation state.
+		"""
+		self.__resourceChanged(res)
+
+	def __getFreeResources(self, nodeName):
+		"""
+		Returns a list of the free resources on a node.
+		"""
+		ret = []
+		for classIndex in self.freeIndex[nodeName].values():
+			ret += classIndex.values()
+		return ret
+
+	def __allocateFrom(self, ob, res, userInfo, undoLog):
+		"""
+		Allocate res out of ob, which is one of the resources we manage. The
+		allocation is recorded in undoLog, so it can be rolled back.
+		"""
+		ob.doAllocate(res, userInfo)
+		undoLog.append([ob, res, userInfo])
+		self.__resourceChanged(ob)
+
+	def __rollback(self, undoLog, savePoint=0):
+		"""
+		Undo the allocations recorded in undoLog after savePoint, the latest
+		one first.
+		"""
+		while len(undoLog)>savePoint:
+			ob, res, userInfo = undoLog.pop()
+			ob.deallocate(res, userInfo)
+			self.__resourceChanged(ob)
+
 	"""
 	Allocate the list of requested resources. 
 	Nodes are picked only from the includeNodeList. If includeNodeList is empty,
@@ -127,6 +252,23 @@ class Metascheduler:
 	The requested resources must be VizResource objects, or inherited classes
 	"""
 	def allocate(self, requestedResources, userInfo, includeNodeList):
+		pending = self.reserve(requestedResources, userInfo, includeNodeList)
+		try:
+			self.allocateNodes(pending)
+		except:
+			self.cancel(pending)
+			raise
+		return self.finishAllocation(pending)
+
+	"""
+	First step of an allocation. Matches the requested resources to free
+	resources, and marks them as allocated, so that no other request can get
+	them. Nothing is asked of the schedulers yet.
+
+	Returns a PendingAllocation, which must be passed to allocateNodes() and
+	then to finishAllocation(), or to cancel().
+	"""
+	def reserve(self, requestedResources, userInfo, includeNodeList):
 		# validate input argument
 		if not isinstance(requestedResources, list):
 			raise ValueError, "Bad value: allocate only deals with lists"
@@ -151,8 +293,6 @@ class Metascheduler:
 					raise ValueError, "Bad Value: Only VizResource objects, VizResourceAggregate objects or derived objects are accepted"
 	
 
-		allAreAvailable = True
-		nodesToAlloc = {}
 
 		# requestedResources is a list of requests
 		# Each item in the list may be
@@ -287,27 +427,136 @@ class Metascheduler:
 				raise vsapi.VizError(vsapi.VizError.RESOURCE_BUSY, "Resource %s is not sharable and hence cannot be allocated for shared access."%(resKey))
 	
 		# FIXME: we could check if this request can ever be satisfied. Implement this later
-		
-		#
-		# Create a hash of free resources. We'll allocate out of these
-		# hash is indexed by host name
+
+		# Resources are allocated as they are matched to the request. All
+		# the allocations are recorded in undoLog, and are rolled back if
+		# the request can't be satisfied.
+		undoLog = []
+		try:
+			allocatedResources = self.__matchRequest(expandedResourceList, resReqByDOF, userInfo, includeNodeList, unusableNodes, undoLog)
+		except:
+			self.__rollback(undoLog)
+			raise
+
+		return PendingAllocation(requestedResources, indexOfExpandedInFinal, allocatedResources, undoLog, userInfo)
+
+	def allocateNodes(self, pending):
+		"""
+		Second step of an allocation. Allocates the nodes of a PendingAllocation
+		from their schedulers. The schedulers may take a while to do this.
+
+		This doesn't look at or change anything else in the Metascheduler, so it
+		may be called from a thread other than the one making the other calls.
+		"""
+		pending.launcherList, pending.node2launcher = self.__allocateNodes(pending.allocatedResources, pending.userInfo)
+
+	def cancel(self, pending):
+		"""
+		Give up on a PendingAllocation. The reserved resources are freed, and
+		the nodes are given back to their schedulers.
+		"""
+		if pending.launcherList is not None:
+			for launcher in pending.launcherList:
+				launcher.deallocate()
+			pending.launcherList = None
+		self.__rollback(pending.undoLog)
+
+	def finishAllocation(self, pending):
+		"""
+		Last step of an allocation. Returns the Allocation corresponding to a
+		PendingAllocation whose nodes have been allocated.
+		"""
+		requestedResources = pending.requestedResources
+		indexOfExpandedInFinal = pending.indexOfExpandedInFinal
+		allocatedResources = pending.allocatedResources
+		node2launcher = pending.node2launcher
+
+		# This is where we put back what we allocated into
+		# something that corresponds to the original request
 		#
-		freeResources = {}
-		for resKey in self.infoTable:
-			ob = self.infoTable[resKey]
-			obNodeName = ob.getHostName()
-			# Skip resources on unusable nodes
-			if obNodeName in unusableNodes:
+		# The key thing here is to convert lists back to resource groups
+		finalResources = []
+		for itemIndex in range(len(requestedResources)):
+			if isinstance(requestedResources[itemIndex], list):
+				wasAggregate = False
+				wasList = True
+				resListList = [ allocatedResources[indexOfExpandedInFinal[itemIndex]] ] # list of VizResources
+			elif isinstance(requestedResources[itemIndex], vsapi.VizNode): # and (len(requestedResources[itemIndex].getResources())==0): # Whole node alloc
+				wasAggregate = True
+				wasList = False
+				resListList = [ allocatedResources[indexOfExpandedInFinal[itemIndex]] ]
+			elif isinstance(requestedResources[itemIndex], vsapi.VizResourceAggregate):
+				wasAggregate = True
+				wasList = False
+				resListList = map(lambda x:allocatedResources[x], indexOfExpandedInFinal[itemIndex]) # list of lists OR VizResources
+			else:
+				wasAggregate = False
+				wasList = False
+				resList = allocatedResources[itemIndex]
+				resListList = [ allocatedResources[indexOfExpandedInFinal[itemIndex]] ] # single VizResource
+
+			subAlloc = []
+			for innerList in resListList:
+				subSubAlloc = []
+				if not isinstance(innerList, list):
+					innerList = [innerList]
+				for ob in innerList:
+					subSubSubAlloc = []
+					if isinstance(ob, list):
+						resList = ob
+					else:
+						resList = [ob]
+
+					for res in resList:
+						# the resource has been marked as being in use already
+						searchKey = res.hashKey()
+
+						# make a copy of the original object corresponding to this resource
+						# XXX: this will make the object have "instantaneous" shared info that
+						# is not dynamically allocated
+						newRes = copy.deepcopy(self.infoTable[searchKey])
+
+						# Create a schedulable only if the new item is a schedulable one
+						if newRes.isSchedulable():
+							newRes.setSchedulable(vsapi.Schedulable(node2launcher[newRes.getHostName()], newRes.getHostName()))
+	
+						subSubSubAlloc.append(newRes)
+
+					if not isinstance(ob, list):
+						subSubSubAlloc = subSubSubAlloc[0]
+					subSubAlloc.append(subSubSubAlloc)
+				subAlloc.append(subSubAlloc)
+
+			if wasList:
+				finalResources.append(subAlloc[0])
+			elif wasAggregate:
+				allocItem = copy.deepcopy(requestedResources[itemIndex]) #duplicate the aggregate group object
+				allocItem.setResources(subAlloc)
+				finalResources.append(allocItem)
+			else:
+				finalResources.append(subAlloc[0][0])
+
+		newAlloc = Allocation(pending.launcherList, finalResources, pending.userInfo['uid'], node2launcher)
+
+		self.allocations.append(newAlloc)
+		return newAlloc
+
+	def __matchRequest(self, expandedResourceList, resReqByDOF, userInfo, includeNodeList, unusableNodes, undoLog):
+		"""
+		Match the expanded resource request to free resources, allocating them
+		as we go. Returns the allocated resources, one item for each item in
+		expandedResourceList.
+		"""
+		# The nodes we can allocate from
+		candidateNodes = []
+		for nodeName in self.freeIndex:
+			# Skip unusable nodes
+			if nodeName in unusableNodes:
 				continue
-			# Skip resources not in the include list
-			if (len(includeNodeList)>0) and (obNodeName not in includeNodeList):
+			# Skip nodes not in the include list
+			if (len(includeNodeList)>0) and (nodeName not in includeNodeList):
 				continue
-			if not freeResources.has_key(obNodeName):
-				freeResources[obNodeName] = {}
-			if self.infoTable[resKey].isFree():
-				# Create a copy of the free resources. If we fail allocation,
-				# then our internal table will still be consistent!
-				freeResources[obNodeName][resKey] = copy.deepcopy(ob)
+			candidateNodes.append(nodeName)
 
 		# create an empty list for all allocations.
 		# this has 1 spot for every requirement
@@ -315,37 +564,26 @@ class Metascheduler:
 		allocatedResources = [None]*len(expandedResourceList)
 
 		# allocate all DOF=0 items
-		# Note that this not make them unavailable yet
 		for reqDesc in resReqByDOF[0]:
 			reqIndex = reqDesc['reqIndex']
 			allocatedRes = reqDesc['requirement']
 			allocatedResources[reqIndex] = allocatedRes
 
-		# remove all fixed (i.e. DOF=0) VizResources 
-		# from the availability pool.
+		# allocate all fixed (i.e. DOF=0) VizResources, taking them out
+		# of the availability pool.
 		# however, we keep them in the lists at the some position
 		# we'll skip over them while allocating, so there will be no problems
 		for dof in resReqByDOF:
 			for reqDesc in resReqByDOF[dof]:
 				resToAlloc = reqDesc['requirement']
-				if isinstance(resToAlloc, list):
-					for res in resToAlloc:
-						if res.getAllocationDOF()==0:
-							resKey = res.hashKey()
-							resHost = res.getHostName()
-							# Allocate out of the existing item
-							freeResources[resHost][resKey].doAllocate(res, userInfo['uid'])
-							if not freeResources[resHost][resKey].isFree():
-								freeResources[resHost].pop(resKey)
-				else:
-					res = resToAlloc
+				if not isinstance(resToAlloc, list):
+					resToAlloc = [resToAlloc]
+				for res in resToAlloc:
 					if res.getAllocationDOF()==0:
 						resKey = res.hashKey()
-						resHost = res.getHostName()
-						# Allocate out of the existing item
-						freeResources[resHost][resKey].doAllocate(res, userInfo['uid'])
-						if not freeResources[resHost][resKey].isFree():
-							freeResources[resHost].pop(resKey)
+						if not self.infoTable[resKey].canAllocate(res):
+							raise vsapi.VizError(vsapi.VizError.RESOURCE_BUSY, "Resource %s can't be allocated for you as many times as requested."%(resKey))
+						self.__allocateFrom(self.infoTable[resKey], res, userInfo['uid'], undoLog)
 				
 		#
 		# The real allocation logic starts from here ...
@@ -368,7 +606,7 @@ class Metascheduler:
 		#  - Get all VizResource lists for DOF = 1. These resources have only indices
 		#    Sort them by number of resources in each list, with the maximum 
 		#    coming first. This is the "requirement list"
-		#  - Create another list of available resources per node, copying freeResources
+		#  - Create another list of available resources per node, from the free index
 		#    This is the "availability list", and will have max number of items 
 		#    equal to number of nodes
 		#  - Create a per node list of DOF=2 requirements
@@ -413,11 +651,8 @@ class Metascheduler:
 		# create a list, with each element saying what resources are free on a particular node
 		# note that availResources has references to the objects
 		availResources = []
-		for node in freeResources:
-			freeRes  = []
-			for resKey in freeResources[node]:
-				freeRes.append(freeResources[node][resKey])
-			availResources.append([node, freeRes])
+		for node in candidateNodes:
+			availResources.append([node, self.__getFreeResources(node)])
 
 		# sort with maximal number of resources per requirement coming first
 		reqDescList = resReqByDOF[1]
@@ -451,13 +686,19 @@ class Metascheduler:
 				# Note: adding the nodeName to all these reqs makes all reqs fully resolved
 				# they're all DOF=1 (index is specified). Adding hostname makes them DOF=0
 				reqWithThisHostName = self.__copyWithThisNodeName(resToBeAllocated, nodeName)
-				allocThese, remainingAvail = self.__resourceMatchDOF0(reqWithThisHostName, nodeFreeRes, userInfo['uid'])
+				savePoint = len(undoLog)
+				allocThese, remainingAvail = self.__resourceMatchDOF0(reqWithThisHostName, nodeFreeRes, userInfo['uid'], undoLog)
 				if allocThese is None:
 					continue
 
 				if dof2ReqsByNode.has_key(nodeName):
-					satisfied, remaining = self.__resourceMatchDOF2(dof2ReqsByNode[nodeName], remainingAvail, userInfo['uid'])
+					# Only check if the DOF=2 requirements can still be met.
+					# They get allocated in Step 3
+					checkPoint = len(undoLog)
+					satisfied, remaining = self.__resourceMatchDOF2(dof2ReqsByNode[nodeName], remainingAvail, userInfo['uid'], undoLog)
+					self.__rollback(undoLog, checkPoint)
 					if satisfied is None:
+						self.__rollback(undoLog, savePoint)
 						continue
 
 				# we've satisfied this requirement here
@@ -480,8 +721,6 @@ class Metascheduler:
 			# put the allocated resources in their final place
 			allocatedResources[reqDesc['reqIndex']] = resFinalSelected
 
-
-
 		#
 		# Step 3
 		#
@@ -516,7 +755,7 @@ class Metascheduler:
 			# be picked up first
 			nodeFreeRes.sort(lambda x,y:x.getAllocationWeight()-y.getAllocationWeight())
 		
-			allocThese, remainingAvail = self.__resourceMatchDOF2(resToBeAllocated, nodeFreeRes, userInfo['uid'])
+			allocThese, remainingAvail = self.__resourceMatchDOF2(resToBeAllocated, nodeFreeRes, userInfo['uid'], undoLog)
 			if allocThese is None:
 				# This shouldn't happen at all. If it does, it's a bug in our algorithm
 				raise vsapi.VizError(vsapi.VizError.INTERNAL_ERROR, "Couldn't allocate a DOF=2 requirement. Please check your resource list")
@@ -564,7 +803,7 @@ class Metascheduler:
 					nodeFreeRes = nodeAvail[1]
 					# Note: adding the nodeName to all these reqs converts these DOF=3 requests turn into DOF=2
 					reqWithThisHostName = self.__copyWithThisNodeName(resToBeAllocated, nodeName)
-					allocThese, remainingAvail = self.__resourceMatchDOF2(reqWithThisHostName, nodeFreeRes, userInfo['uid'])
+					allocThese, remainingAvail = self.__resourceMatchDOF2(reqWithThisHostName, nodeFreeRes, userInfo['uid'], undoLog)
 					if allocThese is None:
 						continue
 
@@ -624,7 +863,9 @@ class Metascheduler:
 						didSatisfy = True
 
 					if didSatisfy:
-						# Remove all resources from the avail list, since we've allocated them
+						# Allocate all the resources, and remove them from the avail list
+						for res in resFinalSelected:
+							self.__allocateFrom(self.infoTable[res.hashKey()], res, userInfo['uid'], undoLog)
 						nodeAvail[1] = []
 						break
 					
@@ -652,7 +893,10 @@ class Metascheduler:
 		#pprint(availResources)
 		#print '---------------------------------------------'
 
-		# Mark the resource
+		# Check what we allocated. Requests which were fixed to a resource
+		# without being allocated out of it are allocated now. (The DOF=2
+		# check in Step 2 sets the index of the requests it looks at.)
+		allocatedReqs = set(map(lambda x: id(x[1]), undoLog))
 		for innerList in allocatedResources:
 			if not isinstance(innerList, list):
 				innerList = [innerList]
@@ -663,16 +907,33 @@ class Metascheduler:
 				searchKey = res.hashKey()
 				if not self.infoTable.has_key(searchKey):
 					raise vsapi.VizError(vsapi.VizError.BAD_RESOURCE, "I dont manage the resource : %s. So can't allocate that"%(searchKey))
+
+				if id(res) in allocatedReqs:
+					continue
 	
 				if not self.infoTable[searchKey].isFree():
 					raise vsapi.VizError(vsapi.VizError.RESOURCE_BUSY, "Programming Error - allocated resource (%s) is not free ? This is not supposed to happen! Allocator bug most likely"%(searchKey))
 
+				self.__allocateFrom(self.infoTable[searchKey], res, userInfo['uid'], undoLog)
+
+		return allocatedResources
+
+	def __allocateNodes(self, allocatedResources, userInfo):
+		"""
+		Allocate the nodes having the schedulable resources in allocatedResources
+		from their schedulers. Returns [launcherList, node2launcher].
+		"""
+		nodesToAlloc = {}
+		for innerList in allocatedResources:
+			if not isinstance(innerList, list):
+				innerList = [innerList]
+			for res in innerList:
 				# Append this to the node list only if it is schedulable.
 				if res.isSchedulable():
 					nodesToAlloc[res.getHostName()] = None
 
 		# convert dictionary to list
-	   	nodesToAlloc = nodesToAlloc.keys()
+		nodesToAlloc = nodesToAlloc.keys()
 
 		# these nodes may be managed by one or more schedulers
 		# so we'll have to partition this 
@@ -687,81 +948,17 @@ class Metascheduler:
 			# call the scheduler only if there is a need to allocate any
 			# scheduled resources
 			if len(matchNodes)>0:
-				thisLauncher = sched.allocate(userInfo['uid'], userInfo['gid'], matchNodes)
+				try:
+					thisLauncher = sched.allocate(userInfo['uid'], userInfo['gid'], matchNodes)
+				except:
+					# Give back what the other schedulers gave us
+					for launcher in launcherList:
+						launcher.deallocate()
+					raise
 				launcherList.append(thisLauncher)
 				for nodeName in matchNodes:
 					node2launcher[nodeName] = thisLauncher
-
-		# This is where we put back what we allocated into
-		# something that corresponds to the original request
-		#
-		# The key thing here is to convert lists back to resource groups
-		finalResources = []
-		for itemIndex in range(len(requestedResources)):
-			if isinstance(requestedResources[itemIndex], list):
-				wasAggregate = False
-				wasList = True
-				resListList = [ allocatedResources[indexOfExpandedInFinal[itemIndex]] ] # list of VizResources
-			elif isinstance(requestedResources[itemIndex], vsapi.VizNode): # and (len(requestedResources[itemIndex].getResources())==0): # Whole node alloc
-				wasAggregate = True
-				wasList = False
-				resListList = [ allocatedResources[indexOfExpandedInFinal[itemIndex]] ]
-			elif isinstance(requestedResources[itemIndex], vsapi.VizResourceAggregate):
-				wasAggregate = True
-				wasList = False
-				resListList = map(lambda x:allocatedResources[x], indexOfExpandedInFinal[itemIndex]) # list of lists OR VizResources
-			else:
-				wasAggregate = False
-				wasList = False
-				resList = allocatedResources[itemIndex]
-				resListList = [ allocatedResources[indexOfExpandedInFinal[itemIndex]] ] # single VizResource
-
-			subAlloc = []
-			for innerList in resListList:
-				subSubAlloc = []
-				if not isinstance(innerList, list):
-					innerList = [innerList]
-				for ob in innerList:
-					subSubSubAlloc = []
-					if isinstance(ob, list):
-						resList = ob
-					else:
-						resList = [ob]
-
-					for res in resList:
-						# mark this resource as being in use
-						searchKey = res.hashKey()
-						self.infoTable[searchKey].doAllocate(res, userInfo['uid'])
-
-						# make a copy of the original object corresponding to this resource
-						# XXX: this will make the object have "instantaneous" shared info that
-						# is not dynamically allocated
-						newRes = copy.deepcopy(self.infoTable[searchKey])
-
-						# Create a schedulable only if the new item is a schedulable one
-						if newRes.isSchedulable():
-							newRes.setSchedulable(vsapi.Schedulable(node2launcher[newRes.getHostName()], newRes.getHostName()))
-	
-						subSubSubAlloc.append(newRes)
-
-					if not isinstance(ob, list):
-						subSubSubAlloc = subSubSubAlloc[0]
-					subSubAlloc.append(subSubSubAlloc)
-				subAlloc.append(subSubAlloc)
-
-			if wasList:
-				finalResources.append(subAlloc[0])
-			elif wasAggregate:
-				allocItem = copy.deepcopy(requestedResources[itemIndex]) #duplicate the aggregate group object
-				allocItem.setResources(subAlloc)
-				finalResources.append(allocItem)
-			else:
-				finalResources.append(subAlloc[0][0])
-
-		newAlloc = Allocation(launcherList, finalResources, userInfo['uid'])
-
-		self.allocations.append(newAlloc)
-		return newAlloc
+		return [launcherList, node2launcher]
 
 	def __classifyRes(self, resRequired):
 		resFinalSelected = []
@@ -782,30 +979,35 @@ class Metascheduler:
 	def __copyWithThisNodeName(self, resList, nodeName):
 		out = []
 		for res in resList:
-			newRes = copy.deepcopy(res)
+			# Matching only changes the hostname and index of the copy, so
+			# a shallow copy is enough
+			newRes = copy.copy(res)
 			newRes.setHostName(nodeName)
 			out.append(newRes)
 		return out
 
-	def __resourceMatchDOF2(self, reqList, availList, userInfo):
+	def __resourceMatchDOF2(self, reqList, availList, userInfo, undoLog):
 		"""
 		Match a list of VizResources (reqList) to available resources on a node(avail).
 		The hostnames of all resources in reqList must match the hostname of availList.
 		NOTE: One or more items in reqList may have index specified.
+		The matched resources are allocated, and the allocations are recorded in
+		undoLog. If the match fails, these allocations are undone.
 		"""
+		savePoint = len(undoLog)
 
 		# separate the DOF=0 from the DOF=2
 		resFinalAllocated, resToBeMatched, resTBMIndexMap = self.__classifyRes(reqList)
 
 		# match DOF=0
 		dof0only = filter(lambda x: x is not None,resFinalAllocated)
-		dof0match, remaining = self.__resourceMatchDOF0(dof0only, availList, userInfo)
+		dof0match, remaining = self.__resourceMatchDOF0(dof0only, availList, userInfo, undoLog)
 
 		# if we can't match the DOF=0, then we've failed
 		if dof0match == None:
 			return [None, None]
 
-		# NOTE: remaining is already a copy of availList, not a reference, so any
+		# NOTE: remaining is a new list, not a reference to availList, so any
 		# failures in the rest of the function will not impact the original list
 
 		# NOTE: dof0match will be the same as dof0only on success
@@ -841,6 +1043,7 @@ class Metascheduler:
 				if isinstance(res, resClass):
 					ar = availRes[resClass.rootNodeName]
 					if len(ar)==0:
+						self.__rollback(undoLog, savePoint)
 						return [None, None] # Not possible to match request with available resources
 
 					# look in the available resources of this type
@@ -851,13 +1054,14 @@ class Metascheduler:
 							match = res
 							res.setHostName(possibleMatch.getHostName())
 							res.setIndex(possibleMatch.getIndex())
-							possibleMatch.doAllocate(res, userInfo)
+							self.__allocateFrom(possibleMatch, res, userInfo, undoLog)
 							# post allocation, if the object is not free then remove it from the
 							# free list
 							if not possibleMatch.isFree():
 								ar.pop(mi)
 							break
 					if match is None: # Not possible to match request with available resources
+						self.__rollback(undoLog, savePoint)
 						return [None, None]
 						
 			if match is None:
@@ -878,17 +1082,19 @@ class Metascheduler:
 
 		return [resFinalAllocated, allFree]
 
-	def __resourceMatchDOF0(self, reqList, availList, userInfo):
+	def __resourceMatchDOF0(self, reqList, availList, userInfo, undoLog):
 		"""
 		Match a list of VizResource requirements (req) to available resources on a node(avail).
 		All resources are fully specified. So this is just a dual loop
+		The matched resources are allocated, and the allocations are recorded
+		in undoLog.
 		Returns [matched, remaining] if all reqs were in avail
-		else returns [None, availList]
+		else undoes the allocations and returns [None, availList]
 		"""
 		matched = []
-		# make a complete copy of the available objects. In case
-		# of failures, we will just return the original list
-		remaining = copy.deepcopy(availList) 
+		savePoint = len(undoLog)
+		# In case of failures, we will just return the original list
+		remaining = copy.copy(availList)
 		for req in reqList:
 			foundIt = False
 			for avail in remaining:
@@ -896,7 +1102,7 @@ class Metascheduler:
 					req.setHostName(avail.getHostName())
 					req.setIndex(avail.getIndex())
 					matched.append(req)
-					avail.doAllocate(req, userInfo)
+					self.__allocateFrom(avail, req, userInfo, undoLog)
 					# remove from availability list only if it is not free as a result of allocation
 					if not avail.isFree(): 
 						remaining.remove(avail)
@@ -904,6 +1110,7 @@ class Metascheduler:
 					break
 			# If one item fails matching, then it's failure overall
 			if foundIt == False:
+				self.__rollback(undoLog, savePoint)
 				return [None, availList]
 
 		return [matched, remaining]
@@ -980,7 +1187,22 @@ class Metascheduler:
 		# if we came till here, then all is fine.
 
 		# get resources that were allocated, and mark them as free
-		allocatedResources = allocObj.getResources()
+		for res in self.__getAllocatedResources(allocObj.getResources()):
+			# update availability of this resource
+			searchKey = res.hashKey()
+			self.infoTable[searchKey].deallocate(res, allocObj.getUser())
+			self.__resourceChanged(self.infoTable[searchKey])
+
+		# deallocate the object - this frees up the scheduler, etc
+		allocObj.deallocate()
+		self.allocations.remove(allocObj)
+
+	def __getAllocatedResources(self, allocatedResources):
+		"""
+		Returns a flat list of the resources in the final resources of an
+		allocation. Lists and resource groups are expanded.
+		"""
+		ret = []
 		for item in allocatedResources:
 			if isinstance(item, list):
 				realResList = item
@@ -991,13 +1213,138 @@ class Metascheduler:
 
 			for itemRes in realResList:
 				if isinstance(itemRes,list):
-					resList = itemRes
+					ret += itemRes
 				else:
-					resList = [itemRes]
-				for res in resList:
-					# update availability of this resource
-					searchKey = res.hashKey()
-					self.infoTable[searchKey].deallocate(res, allocObj.getUser())
+					ret.append(itemRes)
+		return ret
 
-		# deallocate the object - this frees up the scheduler, etc
-		allocObj.deallocate()
+	def detach(self):
+		"""
+		Forget all the allocations without giving back their resources. Their
+		scheduler jobs are left running. Used when the SSM exits, leaving its
+		allocations to be restored when it starts again.
+		"""
+		for allocObj in self.allocations:
+			allocObj.detach()
+		self.allocations = []
+
+	def restoreAllocations(self, savedAllocations):
+		"""
+		Recreate allocations from the dictionaries returned by their toDict
+		method, e.g. by an earlier run of the SSM. Their resources are marked
+		as allocated again, and the schedulers are asked to take back their
+		nodes; a scheduler may find that a job has gone away meanwhile.
+
+		Returns a list with a [allocObj, errorMessage] for each saved
+		allocation. allocObj is None if the allocation could not be restored,
+		and errorMessage says why.
+		"""
+		results = []
+		undoLogs = []
+		reclaimRequests = {} # scheduler -> list of [allocation index, launcher index, request]
+		for saved in savedAllocations:
+			undoLog = []
+			try:
+				allocObj, launcherRequests = self.__reserveSavedAllocation(saved, undoLog)
+			except (ValueError, KeyError, TypeError, vsapi.VizError), e:
+				self.__rollback(undoLog)
+				results.append([None, str(e)])
+				undoLogs.append(None)
+				continue
+			for launcherIndex in range(len(launcherRequests)):
+				sched, request = launcherRequests[launcherIndex]
+				reclaimRequests.setdefault(sched, []).append([len(results), launcherIndex, request])
+			allocObj.launcherList = [None]*len(launcherRequests)
+			results.append([allocObj, None])
+			undoLogs.append(undoLog)
+
+		# Ask each scheduler about all its jobs at once; asking SLURM about
+		# them one by one would be slow
+		for sched in reclaimRequests:
+			requests = reclaimRequests[sched]
+			launchers = sched.reclaim(map(lambda x: x[2], requests))
+			for i in range(len(requests)):
+				allocIndex, launcherIndex, request = requests[i]
+				allocObj = results[allocIndex][0]
+				if launchers[i] is None:
+					results[allocIndex][1] = "The scheduler no longer has the nodes %s"%(",".join(request[1]))
+				allocObj.launcherList[launcherIndex] = launchers[i]
+
+		for i in range(len(results)):
+			allocObj, errorMessage = results[i]
+			if allocObj is None:
+				continue
+			if errorMessage is not None:
+				# Give back the nodes we did get; the allocation is no use
+				# without all of them
+				for launcher in allocObj.launcherList:
+					if launcher is not None:
+						launcher.deallocate()
+				self.__rollback(undoLogs[i])
+				results[i][0] = None
+				continue
+			node2launcher = {}
+			for j in range(len(allocObj.launcherList)):
+				for nodeName in savedAllocations[i]['launchers'][j]['nodes']:
+					node2launcher[nodeName] = allocObj.launcherList[j]
+			allocObj.node2launcher = node2launcher
+			for res in self.__getAllocatedResources(allocObj.getResources()):
+				if res.isSchedulable():
+					res.setSchedulable(vsapi.Schedulable(node2launcher[res.getHostName()], res.getHostName()))
+			self.allocations.append(allocObj)
+		return results
+
+	def __reserveSavedAllocation(self, saved, undoLog):
+		"""
+		Mark the resources of a saved allocation as allocated. Returns the
+		Allocation, without its launchers, and the [scheduler, request] to
+		reclaim each launcher with.
+		"""
+		user = saved['user']
+		finalResources = []
+		for value in saved['resources']:
+			if isinstance(value, list):
+				finalResources.append(map(lambda x: vsapi.deserializeVizResourceFromDict(x), value))
+			else:
+				finalResources.append(vsapi.deserializeVizResourceFromDict(value, [vsapi.GPU, vsapi.Server, vsapi.SLI, vsapi.Keyboard, vsapi.Mouse, vsapi.ResourceGroup, vsapi.VizNode]))
+
+		for res in self.__getAllocatedResources(finalResources):
+			searchKey = res.hashKey()
+			if not self.infoTable.has_key(searchKey):
+				raise ValueError, "%s is no longer managed by us"%(searchKey)
+			if not self.infoTable[searchKey].canAllocate(res):
+				raise ValueError, "%s is in use"%(searchKey)
+			self.__allocateFrom(self.infoTable[searchKey], res, user, undoLog)
+
+		launcherRequests = []
+		for item in saved['launchers']:
+			nodes = item['nodes']
+			matchScheds = filter(lambda x: len(filter(lambda y: y not in x.getNodeNames(), nodes))==0, self.schedList)
+			if len(matchScheds)==0:
+				raise ValueError, "No scheduler manages the nodes %s"%(",".join(nodes))
+			launcherRequests.append([matchScheds[0], [item['launcher'], nodes, user]])
+
+		return [Allocation(None, finalResources, user), launcherRequests]
+
+	def invalidateNodeState(self):
+		"""
+		Asks all the schedulers to forget whatever they know about the state
+		of their nodes. Schedulers which cache node state will fetch it again
+		on the next allocation.
+		"""
+		for sched in self.schedList:
+			sched.invalidateNodeState()
+
+	def setAllocationBias(self, resKey, bias):
+		"""
+		Change the allocation bias of one of the resources we manage. Raises
+		KeyError if we don't manage a resource with this key.
+		"""
+		res = self.infoTable[resKey]
+		# The weight of a node when it is free is used to find out whether
+		# a whole node is free, so it must follow the bias
+		nodeName = res.getHostName()
+		self.nodeWeightWhenFree[nodeName] -= res.getAllocationWeight()
+		res.setAllocationBias(bias)
+		self.nodeWeightWhenFree[nodeName] += res.getAllocationWeight()
+		self.__resourceChanged(res)
@@ -0,0 +1,96 @@
+# VizStack - A Framework to manage visualization resources
+
+# Copyright (C) 2009-2010 Hewlett-Packard
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# Session tokens let a client which has already authenticated with munge
+# make more connections to the SSM without munge. A token names the uid,
+# gid and host of the client, and when the token expires. It is signed using
+# a key which only the SSM knows, so the SSM needn't remember the tokens it
+# has issued.
+#
+
+import hmac
+import base64
+import os
+import time
+
+# Tokens are signed using HMAC-SHA256. hashlib is present in Python 2.5
+# onwards; older Pythons use HMAC-SHA1 from the sha module.
+try:
+	import hashlib
+	digestMethod = hashlib.sha256
+except ImportError:
+	import sha
+	digestMethod = sha
+
+KEY_SIZE = 32
+
+def createKey():
+	"""
+	Returns a new random signing key.
+	"""
+	return os.urandom(KEY_SIZE)
+
+def __sign(key, payload):
+	return hmac.new(key, payload, digestMethod).hexdigest()
+
+def __sameString(a, b):
+	# Compare in constant time, so that the time taken doesn't tell how
+	# much of a signature is right
+	if len(a) != len(b):
+		return False
+	result = 0
+	for i in range(len(a)):
+		result |= ord(a[i]) ^ ord(b[i])
+	return result == 0
+
+def createToken(key, userInfo, host, lifetime, curTime=None):
+	"""
+	Create a token for the user in userInfo ({'uid':..., 'gid':...}),
+	connecting from host. The token is valid for lifetime seconds.
+	"""
+	if curTime is None:
+		curTime = time.time()
+	# The nonce keeps tokens made at the same time apart
+	payload = '%d %d %s %d %s'%(userInfo['uid'], userInfo['gid'], host, int(curTime+lifetime), base64.b16encode(os.urandom(8)))
+	return '%s.%s'%(base64.urlsafe_b64encode(payload), __sign(key, payload))
+
+def checkToken(key, token, host, curTime=None):
+	"""
+	Check a token presented by a client connecting from host. Returns the
+	userInfo of the user the token was made for. Raises ValueError if the
+	token is bad, was made for another host, or has expired.
+	"""
+	if curTime is None:
+		curTime = time.time()
+	try:
+		# tokens from XML messages are unicode
+		encodedPayload, signature = str(token).split('.')
+		payload = base64.urlsafe_b64decode(encodedPayload)
+	except (ValueError, TypeError), e:
+		raise ValueError, "Badly formed token"
+	if not __sameString(signature, __sign(key, payload)):
+		raise ValueError, "Bad token signature"
+
+	# The signature is good, so the payload is what we made
+	uid, gid, tokenHost, expiry, nonce = payload.split(' ')
+	if tokenHost != host:
+		raise ValueError, "Token was issued to another host"
+	if curTime >= int(expiry):
+		raise ValueError, "Token has expired"
+	return { 'uid' : int(uid), 'gid' : int(gid) }
@@ -50,6 +50,21 @@ class SLURMLauncher(launcher.Launcher):
         self.nodeList = None
         self.scheduler = None
 
+    def toDict(self):
+        return { 'class' : SLURMLauncher.rootNodeName, 'schedId' : self.schedId }
+
+    def fromDict(self, d):
+        if d.get('class') != SLURMLauncher.rootNodeName:
+            raise ValueError, "Failed to deserialize SLURMLauncher. Programmatic error"
+
+        try:
+            self.schedId = int(d['schedId'])
+        except (KeyError, TypeError, ValueError), e:
+            raise ValueError, "Failed to deserialize SLURMLauncher. Invalid scheduler ID '%s'"%(d.get('schedId'))
+
+        self.nodeList = None
+        self.scheduler = None
+
     def __init__(self, schedId=None, nodeList=None, scheduler=None):
         self.__isCopy = False
         self.schedId = schedId
@@ -122,12 +137,14 @@ class SLURMLauncher(launcher.Launcher):
         # Deallocate this SLURM Job
         # Note that this will kill all the job steps associated with the job
         try:
+            startTime = time.time()
             p = subprocess.Popen(["scancel", str(self.schedId)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
         except OSError, e:
             raise SLURMError(e.__str__)
 
         # Let the command finish. We ignore any reported errors and expect SLURM to do the proper cleanup.
         p.communicate()
+        slurmscheduler.commandFinished("scancel", startTime)
 
         if self.scheduler is not None:
             self.scheduler.deallocate(self)
@@ -135,3 +152,14 @@ class SLURMLauncher(launcher.Launcher):
 
         self.schedId = None
 
+    def detach(self):
+        """
+        Forget this job without cancelling it. The job can be taken back
+        later using SLURMScheduler.reclaim().
+        """
+        if self.scheduler is not None:
+            self.scheduler.deallocate(self)
+            self.scheduler = None
+        # The destructor won't cancel the job now
+        self.nodeList = None
+
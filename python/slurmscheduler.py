@@ -27,6 +27,8 @@ import time
 import slurmlauncher
 import re
 import vsutil
+import threading
+import weakref
 
 class SLURMError(Exception):
     def __init__(self, msg):
@@ -34,29 +36,108 @@ class SLURMError(Exception):
     def __str__(self):
         return self.msg
 
+# Default number of seconds for which sinfo's view of the nodes is reused
+DEFAULT_CACHE_TTL = 10
+
+# Node states which make a node unusable for us
+UNUSABLE_NODE_STATES = ["drained", "down", "down*", "drained*"]
+
+# Called with the name of each SLURM command we run, and the seconds it took.
+# See setCommandTimer()
+_commandTimer = None
+
+def setCommandTimer(callback):
+    """
+    Have callback(command, seconds) called each time a SLURM command (salloc,
+    sinfo, squeue or scancel) finishes. The SSM uses this to keep track of
+    how long SLURM takes. The callback may be called from any thread. Pass
+    None to stop this.
+    """
+    global _commandTimer
+    _commandTimer = callback
+
+def commandFinished(command, startTime):
+    """
+    Report that a SLURM command, started at startTime, finished.
+    """
+    callback = _commandTimer
+    if callback is not None:
+        callback(command, time.time()-startTime)
+
+def _refreshNodeState(schedRef, wakeup, ttl):
+    """
+    Body of the thread that keeps a SLURMScheduler's node state fresh.
+    The thread holds only a weak reference to the scheduler, and exits
+    once the scheduler goes away.
+    """
+    while 1:
+        wakeup.wait(ttl)
+        wakeup.clear()
+        sched = schedRef()
+        if sched is None:
+            return
+        try:
+            sched.refreshNodeState()
+        except SLURMError, e:
+            # Keep the last snapshot; we'll try again after ttl
+            pass
+        del sched
+
 class SLURMScheduler(scheduler.Scheduler):
     def __init__(self, nodeList, params):
         if len(nodeList)==0:
             raise ValueError, "I need one or more nodes to manage, you gave me none!"
 	self.allocationInfo = {}
-        self.launcher = None
-        # FIXME: check if "params" is a valid name for a SLURM partition
-	# Also check if the partition name is valid
-        if params != "":
-            self.partition = ["-p",params]
+
+        # params is the name of a SLURM partition, optionally followed by
+        # settings of the form name=value. Only "cache_ttl" is understood
+        # now : the number of seconds for which the state of the nodes is
+        # cached. Using 0 runs sinfo on every allocation.
+        # FIXME: check if the partition name is valid
+        partition = None
+        self.cacheTTL = DEFAULT_CACHE_TTL
+        for item in params.split():
+            if '=' not in item:
+                if partition is not None:
+                    raise ValueError, "Only one SLURM partition may be specified. Incorrect value '%s'"%(params)
+                partition = item
+                continue
+            name, value = item.split('=', 1)
+            if name != "cache_ttl":
+                raise ValueError, "Unknown SLURM scheduler parameter '%s'"%(name)
+            try:
+                self.cacheTTL = float(value)
+            except ValueError, e:
+                raise ValueError, "Bad value '%s' for cache_ttl. Expecting a number of seconds"%(value)
+            if self.cacheTTL < 0:
+                raise ValueError, "cache_ttl can't be negative"
+        if partition is not None:
+            self.partition = ["-p",partition]
         else:
             self.partition = []
 
         self.nodeList = nodeList
 
+        # sinfo's view of the nodes, as a list of [state, nodeList].
+        # The snapshot is replaced, never modified, so readers can use
+        # it without holding the lock.
+        self.nodeStateLock = threading.Lock()
+        self.nodeState = None
+        self.nodeStateGen = 0
+        self.refreshThread = None
+        self.refreshWakeup = threading.Event()
+
         # check if SLURM considers these to be valid node(s)
-        schedNodeList = self.__getAllNodes()
+        try:
+            schedNodeList = self.__getAllNodes(self.refreshNodeState())
+        except SLURMError, e:
+            raise ValueError, "Unable to get the state of the nodes from SLURM : %s"%(str(e))
         for nodeName in self.nodeList:
             if nodeName not in schedNodeList:
                 if len(self.partition)==0:
                     raise ValueError, "Node '%s' is not managed by SLURM"%(nodeName)
                 else:
-                    raise ValueError, "Node '%s' is NOT available in SLURM partition '%s'. Please check that both the node name and the partition name match your SLURM configuration."%(nodeName, params)
+                    raise ValueError, "Node '%s' is NOT available in SLURM partition '%s'. Please check that both the node name and the partition name match your SLURM configuration."%(nodeName, partition)
 
     def getNodeNames(self):
         return self.nodeList
@@ -93,11 +174,15 @@ class SLURMScheduler(scheduler.Scheduler):
         nodestr = self.condense(res_list)
         try:
             # combine stderr with stdout
+            startTime = time.time()
             p = subprocess.Popen(["salloc"]+["--uid=%d"%(userId), "-d 4", "--no-shell", "-I"] + self.partition + [ "-w", nodestr], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
             messages = p.communicate()[0]
         except OSError,e :
             raise SLURMError(repr(e))
+        commandFinished("salloc", startTime)
         if(p.returncode == 1):
+            # The nodes may have gone down since we last looked
+            self.invalidateNodeState()
             raise SLURMError(messages)
 
         schedId = int(messages.replace("salloc: Granted job allocation ",""))
@@ -105,11 +190,13 @@ class SLURMScheduler(scheduler.Scheduler):
         if schedId == None:
             raise ValueError, "Invalid allocation id"%(schedId)
         
-        self.launcher = slurmlauncher.SLURMLauncher(schedId, res_list, self)
+        # This runs on the SSM's allocation workers, so nothing about this
+        # allocation may be kept in a shared attribute
+        jobLauncher = slurmlauncher.SLURMLauncher(schedId, res_list, self)
         # Remember that we made this allocation.
         # This will come in handy during scheduler cleanup.
-	self.allocationInfo[schedId] = self.launcher
-        return self.launcher
+	self.allocationInfo[schedId] = jobLauncher
+        return jobLauncher
 
     def deallocate(self, allocObj):
         if allocObj.__class__ is not slurmlauncher.SLURMLauncher:
@@ -121,6 +208,53 @@ class SLURMScheduler(scheduler.Scheduler):
         # we're no longer tracking this...
         self.allocationInfo.pop(schedId)
 
+    def reclaim(self, requests):
+        """
+        Take back the jobs of allocations made by an earlier run of the SSM.
+        requests is a list of [launcherInfo, nodeList, uid], where launcherInfo
+        is from SLURMLauncher.toDict. Returns a list with the SLURMLauncher
+        for each request, or None if SLURM no longer has the job.
+
+        All the jobs are checked with one run of squeue. Raises SLURMError
+        if squeue fails; we can't tell which jobs are alive then.
+        """
+        liveJobs = self.__getRunningJobs()
+        ret = []
+        for launcherInfo, nodeList, uid in requests:
+            try:
+                schedId = int(launcherInfo['schedId'])
+            except (KeyError, TypeError, ValueError), e:
+                ret.append(None)
+                continue
+            if (launcherInfo.get('class') != slurmlauncher.SLURMLauncher.rootNodeName) or (not liveJobs.has_key(schedId)):
+                ret.append(None)
+                continue
+            launcher = slurmlauncher.SLURMLauncher(schedId, nodeList, self)
+            self.allocationInfo[schedId] = launcher
+            ret.append(launcher)
+        return ret
+
+    def __getRunningJobs(self):
+        """
+        Returns the IDs of the running SLURM jobs, as the keys of a dictionary.
+        """
+        try:
+            startTime = time.time()
+            p = subprocess.Popen(["squeue", "-h", "-t", "RUNNING", "-o", "%i"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = p.communicate()
+        except OSError, e:
+            raise SLURMError(repr(e))
+        commandFinished("squeue", startTime)
+        if(p.returncode != 0):
+            raise SLURMError(err)
+        jobs = {}
+        for line in out.split():
+            try:
+                jobs[int(line)] = None
+            except ValueError, e:
+                pass # not a job ID
+        return jobs
+
     def expandHosts(self, slurmOutput):
         if not ('[' in slurmOutput):
             return [slurmOutput]
@@ -162,19 +296,79 @@ class SLURMScheduler(scheduler.Scheduler):
                 result.append(el)
         return result
     
-    def __getAllNodes(self):
+    def __runSinfo(self):
+        """
+        Runs sinfo, returning a list of [state, nodeList] for the nodes
+        in our partition.
+        """
         try:
+            startTime = time.time()
             p = subprocess.Popen(["sinfo", "-h" ] + self.partition + [ "-o", "%T %N"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = p.communicate()
         except OSError, e:
-            raise slurmscheduler.SLURMError(repr(e))
-        if(p.returncode == 1):
-            raise slurmscheduler.SLURMError(p.communicate()[1])
-        jobList = p.communicate()[0].rstrip().split("\n")
-        allNodes = []
-        for x in jobList:
+            raise SLURMError(repr(e))
+        commandFinished("sinfo", startTime)
+        if(p.returncode != 0):
+            raise SLURMError(err)
+        nodeState = []
+        for x in out.rstrip().split("\n"):
             if len(x)>0:
-                allNodes = allNodes + vsutil.expandNodes(x.split(" ")[1])
-        allNodes = self.__flatten(allNodes)
+                state, nodes = x.split(" ")[:2]
+                nodeState.append([state, vsutil.expandNodes(nodes)])
+        return nodeState
+
+    def refreshNodeState(self):
+        """
+        Runs sinfo and replaces the cached node state with what it reports.
+        Raises SLURMError if sinfo fails.
+        """
+        self.nodeStateLock.acquire()
+        gen = self.nodeStateGen
+        self.nodeStateLock.release()
+
+        nodeState = self.__runSinfo()
+
+        self.nodeStateLock.acquire()
+        # If we were invalidated while sinfo ran, then what we have
+        # may already be out of date
+        if gen == self.nodeStateGen:
+            self.nodeState = nodeState
+        self.nodeStateLock.release()
+        return nodeState
+
+    def invalidateNodeState(self):
+        """
+        Discards the cached node state. Call this when the state of the nodes
+        is known to have changed, e.g. when a node is drained or resumed.
+        The next call to getUnusableNodes will run sinfo.
+        """
+        self.nodeStateLock.acquire()
+        self.nodeStateGen += 1
+        self.nodeState = None
+        self.nodeStateLock.release()
+        self.refreshWakeup.set()
+
+    def __getNodeState(self):
+        if self.cacheTTL == 0:
+            return self.__runSinfo()
+
+        # The node state is kept fresh by a thread, which is started the
+        # first time we need it. Programs that only look at the
+        # configuration don't need one.
+        if self.refreshThread is None:
+            self.refreshThread = threading.Thread(target=_refreshNodeState, args=(weakref.ref(self), self.refreshWakeup, self.cacheTTL))
+            self.refreshThread.setDaemon(True)
+            self.refreshThread.start()
+
+        nodeState = self.nodeState
+        if nodeState is None:
+            nodeState = self.refreshNodeState()
+        return nodeState
+
+    def __getAllNodes(self, nodeState):
+        allNodes = []
+        for state, nodes in nodeState:
+            allNodes += nodes
         return allNodes
 
     def getUnusableNodes(self):
@@ -184,19 +378,14 @@ class SLURMScheduler(scheduler.Scheduler):
 
 		We use the information about the unusable nodes to restrict ourselves from allocating
 		from those.
+
+		The answer comes from a snapshot of sinfo's output, which is at most
+		cacheTTL seconds old.
         """
-        try:
-            p = subprocess.Popen(["sinfo", "-h" ] + self.partition + [ "-o", "%T %N"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        except OSError, e:
-            raise slurmscheduler.SLURMError(repr(e))
-        if(p.returncode == 1):
-            raise slurmscheduler.SLURMError(p.communicate()[1])
-        jobList = p.communicate()[0].rstrip().split("\n")
         unusableNodes = []
-        for x in jobList:
-            if x.split(" ")[0] in ["drained", "down","down*","dranined*"]: # FIXME: Manju what is this "*" business ??
-                unusableNodes.append(vsutil.expandNodes(x.split(" ")[1]))
-        unusableNodes = self.__flatten(unusableNodes)
+        for state, nodes in self.__getNodeState():
+            if state in UNUSABLE_NODE_STATES:
+                unusableNodes += nodes
         return unusableNodes
 
 #cmd="/bin/date"
@@ -32,6 +32,7 @@ import subprocess
 import process
 import socket
 import copy
+import threading
 
 class SSHReservation(launcher.Launcher):
 
@@ -70,6 +71,10 @@ class SSHReservation(launcher.Launcher):
 				self.sched.deallocate(self)
 		self.sched = None
 
+	def detach(self):
+		# There's nothing outside us to keep; this is the same as deallocate
+		self.deallocate()
+
 	def run(self, args, node, inFile=None, outFile=None, errFile=None, launcherEnv=None):
 		# Use the VizStack application execution wrapper to ensure cleanup when SSH
 		# exits
@@ -88,10 +93,20 @@ class SSHReservation(launcher.Launcher):
 		if domNode.nodeName != SSHReservation.rootNodeName:
 			raise ValueError, "Failed to deserialize SSHReservation. Programmatic Error"
 
+	def toDict(self):
+		return { 'class' : SSHReservation.rootNodeName }
+
+	def fromDict(self, d):
+		if d.get('class') != SSHReservation.rootNodeName:
+			raise ValueError, "Failed to deserialize SSHReservation. Programmatic Error"
+
 class SSHScheduler(scheduler.Scheduler):
 
 	def __init__(self, nodeList, params):
 		self.allocations = []
+		# allocate and deallocate may be called from the SSM's allocation
+		# workers, as well as from its main loop
+		self.allocationsLock = threading.Lock()
         	self.nodeList = nodeList # FIXME: we could validate if we can resolve these names
 		if len(nodeList)==0:
 			raise ValueError, "I need one or more nodes to manage, you gave me none!"
@@ -106,15 +121,43 @@ class SSHScheduler(scheduler.Scheduler):
 			if nodeName not in self.nodeList:
 				raise ValueError, "Node '%s' is not managed by this Local Scheduler"%(nodeName)
 		alloc = SSHReservation(self)
+		self.allocationsLock.acquire()
 		self.allocations.append(alloc)
+		self.allocationsLock.release()
 		return alloc
 
+	def reclaim(self, requests):
+		"""
+		Take back the reservations of allocations made by an earlier run of
+		the SSM. requests is a list of [launcherInfo, nodeList, uid], where
+		launcherInfo is from the toDict method of the reservation. There's
+		nothing to check with us, so every reservation is taken back.
+		"""
+		ret = []
+		for launcherInfo, nodeList, uid in requests:
+			if launcherInfo.get('class') != SSHReservation.rootNodeName:
+				ret.append(None)
+				continue
+			alloc = SSHReservation(self)
+			self.allocationsLock.acquire()
+			self.allocations.append(alloc)
+			self.allocationsLock.release()
+			ret.append(alloc)
+		return ret
+
 	def getUnusableNodes(self):
 		return []
 
+	def invalidateNodeState(self):
+		pass
+
 	def deallocate(self, allocObj):
-		for idx in range(len(self.allocations)):
-			if allocObj is self.allocations[idx]:
-				self.allocations.pop(idx)
-				return
+		self.allocationsLock.acquire()
+		try:
+			for idx in range(len(self.allocations)):
+				if allocObj is self.allocations[idx]:
+					self.allocations.pop(idx)
+					return
+		finally:
+			self.allocationsLock.release()
 		print "No such allocation was allocated by the SSHScheduler"
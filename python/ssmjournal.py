@@ -0,0 +1,139 @@
+# VizStack - A Framework to manage visualization resources
+
+# Copyright (C) 2009-2010 Hewlett-Packard
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# The SSM keeps its allocations in memory. If asked to, it also writes each
+# change to them to a journal, so that they can be restored when the SSM is
+# restarted. To keep the journal from growing forever, the SSM now and then
+# writes all its state to a snapshot, and starts a new journal.
+#
+# Both files are in a directory of their own. Each record is a dictionary,
+# written as one line of JSON. Records are numbered; the snapshot remembers
+# the number of the last record it includes, so the records before it are
+# skipped even if the SSM died before it could start a new journal.
+#
+
+import os
+import vsapi
+
+JOURNAL_FILE = "journal"
+SNAPSHOT_FILE = "snapshot"
+
+# Number of records after which the state is written to a new snapshot
+DEFAULT_SNAPSHOT_INTERVAL = 1000
+
+class Journal:
+	def __init__(self, directory, snapshotInterval=DEFAULT_SNAPSHOT_INTERVAL, sync=True):
+		"""
+		Keep a journal in directory. If sync is True, then each record is
+		forced to disk before append() returns.
+		"""
+		self.directory = directory
+		self.journalPath = os.path.join(directory, JOURNAL_FILE)
+		self.snapshotPath = os.path.join(directory, SNAPSHOT_FILE)
+		self.snapshotInterval = snapshotInterval
+		self.sync = sync
+		self.f = None
+		self.seq = 0 # number of the last record
+		self.numRecords = 0 # records written since the last snapshot
+
+	def load(self):
+		"""
+		Read the snapshot and the journal. Returns [state, records] : the
+		state saved by the last snapshot (None if there is none), and the
+		records written after it, oldest first.
+
+		The last record may have been partly written when the SSM died; such
+		a record is ignored. ValueError is raised if anything else is bad.
+		"""
+		if not os.path.isdir(self.directory):
+			os.makedirs(self.directory, 0700)
+
+		state = None
+		try:
+			data = open(self.snapshotPath).read()
+		except IOError, e:
+			data = None
+		if data is not None:
+			try:
+				snapshot = vsapi.decodeJSONMessage(data)
+				self.seq = snapshot['seq']
+				state = snapshot['state']
+			except (ValueError, KeyError), e:
+				raise ValueError, "Bad journal snapshot %s. Reason: %s"%(self.snapshotPath, str(e))
+
+		records = []
+		try:
+			lines = open(self.journalPath).read().split('\n')
+		except IOError, e:
+			lines = []
+		# A complete journal ends with a newline, so the last line is empty
+		for i in range(len(lines)-1):
+			try:
+				record = vsapi.decodeJSONMessage(lines[i])
+			except ValueError, e:
+				raise ValueError, "Bad record %d in journal %s"%(i+1, self.journalPath)
+			if record['seq'] > self.seq:
+				records.append(record)
+				self.seq = record['seq']
+		return [state, records]
+
+	def append(self, record):
+		"""
+		Write a record to the journal. A snapshot must have been written
+		before the first record is.
+		"""
+		self.seq += 1
+		record = record.copy()
+		record['seq'] = self.seq
+		self.f.write(vsapi.encodeJSONMessage(record)+'\n')
+		self.f.flush()
+		if self.sync:
+			os.fsync(self.f.fileno())
+		self.numRecords += 1
+
+	def needsSnapshot(self):
+		"""
+		Returns True if enough records have been written since the last
+		snapshot that a new one should be written.
+		"""
+		return self.numRecords >= self.snapshotInterval
+
+	def writeSnapshot(self, state):
+		"""
+		Save state, which must include the changes in all the records
+		written so far, and start a new journal.
+		"""
+		tmpPath = self.snapshotPath+".tmp"
+		f = open(tmpPath, "w")
+		f.write(vsapi.encodeJSONMessage({ 'seq' : self.seq, 'state' : state })+'\n')
+		f.flush()
+		os.fsync(f.fileno())
+		f.close()
+		# The old snapshot is replaced only once the new one is complete
+		os.rename(tmpPath, self.snapshotPath)
+
+		if self.f is not None:
+			self.f.close()
+		self.f = open(self.journalPath, "w")
+		self.numRecords = 0
+
+	def close(self):
+		if self.f is not None:
+			self.f.close()
+			self.f = None
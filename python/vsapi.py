@@ -22,6 +22,7 @@ VizStack Job API
 """
 
 import socket
+import errno
 import os
 import subprocess
 from copy import deepcopy
@@ -36,12 +37,42 @@ import sshscheduler
 import string
 import copy
 import sys
+import struct
+import select
+import threading
+import time
+
+# json is needed only for the JSON encoding of the SSM protocol. It's
+# present in Python 2.6 onwards.
+try:
+	import json
+except ImportError:
+	json = None
+
+# ctypes is needed only to use munge through libmunge. Without it, the
+# munge and unmunge programs are used.
+try:
+	import ctypes
+	import ctypes.util
+except ImportError:
+	ctypes = None
+
+# Frames are received straight into a preallocated buffer using recv_into
+# and memoryview, which are present in Python 2.7 onwards. Otherwise, or if
+# this is set to False, they are received a piece at a time, and the pieces
+# joined.
+try:
+	memoryview
+	useRecvInto = hasattr(socket.socket, 'recv_into')
+except NameError:
+	useRecvInto = False
 
 masterConfigFile = '/etc/vizstack/master_config.xml'
 nodeConfigFile = '/etc/vizstack/node_config.xml'
 rgConfigFile = '/etc/vizstack/resource_group_config.xml'
 systemTemplateDir = '/opt/vizstack/share/templates/'
 overrideTemplateDir = '/etc/vizstack/templates/'
+configCacheFile = '/var/cache/vizstack/config_cache'
 
 SSM_UNIX_SOCKET_ADDRESS = "/tmp/vs-ssm-socket"
 NORMAL_SERVER = "normal"
@@ -49,6 +80,44 @@ VIRTUAL_SERVER = "virtual"
 
 VALID_SERVER_TYPES = [NORMAL_SERVER, VIRTUAL_SERVER]
 
+# Encodings of messages exchanged with the SSM. XML is the default, and the
+# only encoding older SSMs understand. The encoding is selected by the client
+# when it connects.
+ENCODING_XML = "xml"
+ENCODING_JSON = "json"
+
+VALID_ENCODINGS = [ENCODING_XML, ENCODING_JSON]
+
+# Messages exchanged with the SSM are sent as frames. Version 1 frames
+# carry the length of the message in decimal, padded with spaces to 5 bytes,
+# followed by the message. Version 2 frames start with a binary header
+# (FRAME_HEADER) with a 32-bit length, the type of the message and a request
+# ID. The identity message is always sent as a version 1 frame; the client
+# asks for version 2 frames in it. SSMs which support what the client asked
+# for say so in a reply to the identity message (CLIENT_ACCEPTED). Older SSMs
+# don't reply, so the client keeps to version 1 frames and XML till it gets
+# the reply.
+LEGACY_FRAME_VERSION = 1
+FRAME_VERSION = 2
+
+VALID_FRAME_VERSIONS = [LEGACY_FRAME_VERSION, FRAME_VERSION]
+
+LEGACY_FRAME_HEADER_SIZE = 5
+LEGACY_MAX_MESSAGE_SIZE = 99999
+
+# version, message type, flags (unused, 0), request ID, message length
+FRAME_HEADER = '!BBHII'
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER)
+MAX_MESSAGE_SIZE = 64*1024*1024
+
+MSG_TYPE_XML = 1
+MSG_TYPE_JSON = 2
+
+VALID_MSG_TYPES = [MSG_TYPE_XML, MSG_TYPE_JSON]
+
+# Start of the reply which accepts the identity message
+CLIENT_ACCEPTED = "<ssm><client_accepted>"
+
 #
 # On a multi-GPU system, I had observed that trying to start multiple
 # X servers at the same time resulted in a crash. The node would almost
@@ -72,12 +141,75 @@ def closeSocket(s):
 	s.shutdown(socket.SHUT_RDWR)
 	s.close()
 
+#
+# munge is used through libmunge if it can be loaded. This saves a fork and
+# exec of munge/unmunge per connection. mungeLibrary is None if libmunge
+# isn't there; set it to None to always use the programs. The programs are
+# used as well if the library can't reach munged, e.g. when a munge wrapper
+# is used for testing.
+#
+EMUNGE_SOCKET = 6
+
+def __loadMungeLibrary():
+	if ctypes is None:
+		return None
+	libName = ctypes.util.find_library('munge')
+	if libName is None:
+		return None
+	try:
+		lib = ctypes.CDLL(libName)
+		libc = ctypes.CDLL(ctypes.util.find_library('c'))
+	except OSError, e:
+		return None
+	lib.munge_encode.argtypes = [ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+	lib.munge_decode.argtypes = [ctypes.c_char_p, ctypes.c_void_p, ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_uint), ctypes.POINTER(ctypes.c_uint)]
+	lib.munge_strerror.restype = ctypes.c_char_p
+	libc.free.argtypes = [ctypes.c_void_p]
+	return [lib, libc]
+
+mungeLibrary = __loadMungeLibrary()
+
+def __mungeEncodeWithLibrary(msg):
+	lib, libc = mungeLibrary
+	cred = ctypes.c_void_p()
+	err = lib.munge_encode(ctypes.byref(cred), None, msg, len(msg))
+	if err == EMUNGE_SOCKET:
+		return None
+	if err != 0:
+		raise VizError(VizError.ACCESS_DENIED, "Unable to create munge credential. Reason: %s"%(lib.munge_strerror(err)))
+	payload = ctypes.string_at(cred.value)
+	libc.free(cred)
+	return payload
+
+def __mungeDecodeWithLibrary(msg):
+	lib, libc = mungeLibrary
+	buf = ctypes.c_void_p()
+	bufLen = ctypes.c_int()
+	uid = ctypes.c_uint()
+	gid = ctypes.c_uint()
+	err = lib.munge_decode(msg, None, ctypes.byref(buf), ctypes.byref(bufLen), ctypes.byref(uid), ctypes.byref(gid))
+	# The payload is returned even for some failures, so it's freed always
+	message = ""
+	if buf.value is not None:
+		message = ctypes.string_at(buf.value, bufLen.value)
+		libc.free(buf)
+	if err == EMUNGE_SOCKET:
+		return None
+	if err != 0:
+		return [err, None, None]
+	return [0, { 'uid' : uid.value, 'gid' : gid.value }, message]
+
 def encode_message_with_auth(authType, msg):
 	if authType!='Munge':
 		raise "Only Munge supported at this time"
 
+	if mungeLibrary is not None:
+		payload = __mungeEncodeWithLibrary(msg)
+		if payload is not None:
+			return payload
+
 	# create a auth packet using munge with this content
-	d = subprocess.Popen('munge', stdout=subprocess.PIPE, stdin=subprocess.PIPE)
+	d = subprocess.Popen('munge', stdout=subprocess.PIPE, stdin=subprocess.PIPE, close_fds=True)
 	d.stdin.write(msg)
 	d.stdin.close()
 	payload = d.stdout.read()
@@ -89,8 +221,15 @@ def decode_message_with_auth(authType, msg):
 	if authType!='Munge':
 		raise "Only Munge supported at this time"
 
+	if mungeLibrary is not None:
+		ret = __mungeDecodeWithLibrary(msg)
+		if ret is not None:
+			return ret
+
 	# decode the metadata & payload into separate files
-	sp = subprocess.Popen('unmunge', stdout=subprocess.PIPE, stdin=subprocess.PIPE)
+	# NOTE: the SSM calls this from multiple threads. close_fds ensures that
+	# an unmunge process doesn't keep another one's stdin pipe open.
+	sp = subprocess.Popen('unmunge', stdout=subprocess.PIPE, stdin=subprocess.PIPE, close_fds=True)
 	sp.stdin.write(msg)
 	sp.stdin.close()
 	decoded = sp.stdout.readlines()
@@ -200,6 +339,27 @@ class Schedulable:
 		if self.locality is None:
 			raise ValueError, "Bad Deserialized Object: No locality was specified"
 
+	def toDict(self):
+		return { 'class' : Schedulable.rootNodeName, 'locality' : self.locality, 'launcher' : self.__launcher.toDict() }
+
+	def fromDict(self, d):
+		self.__clearAll()
+		if d.get('class') != Schedulable.rootNodeName:
+			raise ValueError, "Failed to deserialize Schedulable. Programmatic Error"
+
+		self.locality = d.get('locality')
+		if self.locality is None:
+			raise ValueError, "Bad Deserialized Object: No locality was specified"
+
+		launcher = d.get('launcher')
+		if launcher is not None:
+			for className in [localscheduler.LocalReservation, slurmlauncher.SLURMLauncher, sshscheduler.SSHReservation]:
+				if launcher.get('class') == className.rootNodeName:
+					newObject = className()
+					newObject.fromDict(launcher)
+					self.__launcher = newObject
+					break
+
 class VizError(Exception):
 	INCORRECT_VALUE = 1
 	UNIMPLEMENTED = 2
@@ -613,6 +773,39 @@ class VizResource:
 		if node is not None:
 			self.allocationBias = int(domutil.getValue(node))
 
+	def toDict(self, detailedConfig=True, addrOnly=False):
+		"""
+		Return a dictionary representation of this resource. This is used
+		by the JSON encoding of the SSM protocol, and carries the same
+		information as serializeToXML. The base class implementation
+		includes only some of the info.
+		"""
+		ret = {}
+		if not addrOnly:
+			ret['owners'] = copy.copy(self.owners)
+			ret['maxShareCount'] = self.maxShareCount
+			ret['shared'] = bool(self.shared)
+			if self.allocationBias is not None:
+				ret['allocationBias'] = self.allocationBias
+		return ret
+
+	def fromDict(self, d):
+		"""
+		Restore the state of this resource from a dictionary created by toDict
+		"""
+		self.owners = []
+		for owner in d.get('owners', []):
+			self.addOwner(int(owner))
+
+		self.maxShareCount = int(d.get('maxShareCount', 1))
+		if self.maxShareCount < 1:
+			raise ValueError, "Failed to deserialize. Invalid maxShareCount."
+
+		self.shared = bool(d.get('shared', False))
+
+		if d.get('allocationBias') is not None:
+			self.allocationBias = int(d['allocationBias'])
+
 class Keyboard(VizResource):
 	"""
 	Keyboard resource class.
@@ -693,6 +886,36 @@ class Keyboard(VizResource):
 		if physNode is not None:
 			self.physAddr = domutil.getValue(physNode)
 
+	def toDict(self, detailedConfig = True, addrOnly=False):
+		ret = VizResource.toDict(self, detailedConfig, addrOnly)
+		ret['class'] = Keyboard.rootNodeName
+		if self.resIndex is not None: ret['index'] = self.resIndex
+		if self.hostName is not None: ret['hostname'] = self.hostName
+		if not addrOnly:
+			if self.resType is not None: ret['type'] = self.resType
+			if self.driver is not None: ret['driver'] = self.driver
+			if len(self.options)>0: ret['options'] = deepcopy(self.options)
+			if self.physAddr is not None: ret['phys_addr'] = self.physAddr
+		return ret
+
+	def fromDict(self, d):
+		if d.get('class') != Keyboard.rootNodeName:
+			raise ValueError, "Failed to deserialize Keyboard. Incorrect deserialization attempt."
+
+		self.__clearAll()
+
+		# Deserialize the base class info
+		VizResource.fromDict(self, d)
+
+		self.hostName = d.get('hostname')
+		if d.get('index') is not None:
+			self.resIndex = int(d['index'])
+		self.resType = d.get('type')
+		self.driver = d.get('driver')
+		for opt in d.get('options', []):
+			self.options.append({'name':opt['name'], 'value':opt['value']})
+		self.physAddr = d.get('phys_addr')
+
 class Mouse(VizResource):
 	"""
 	Mouse resource class.
@@ -772,6 +995,36 @@ class Mouse(VizResource):
 		if physNode is not None:
 			self.physAddr = domutil.getValue(physNode)
 
+	def toDict(self, detailedConfig = True, addrOnly=False):
+		ret = VizResource.toDict(self, detailedConfig, addrOnly)
+		ret['class'] = Mouse.rootNodeName
+		if self.resIndex is not None: ret['index'] = self.resIndex
+		if self.hostName is not None: ret['hostname'] = self.hostName
+		if not addrOnly:
+			if self.resType is not None: ret['type'] = self.resType
+			if self.driver is not None: ret['driver'] = self.driver
+			if len(self.options)>0: ret['options'] = deepcopy(self.options)
+			if self.physAddr is not None: ret['phys_addr'] = self.physAddr
+		return ret
+
+	def fromDict(self, d):
+		if d.get('class') != Mouse.rootNodeName:
+			raise ValueError, "Failed to deserialize Mouse. Incorrect deserialization attempt."
+
+		self.__clearAll()
+
+		# Deserialize the base class info
+		VizResource.fromDict(self, d)
+
+		self.hostName = d.get('hostname')
+		if d.get('index') is not None:
+			self.resIndex = int(d['index'])
+		self.resType = d.get('type')
+		self.driver = d.get('driver')
+		for opt in d.get('options', []):
+			self.options.append({'name':opt['name'], 'value':opt['value']})
+		self.physAddr = d.get('phys_addr')
+
 # Resource Aggregates
 
 # resClass       index    resType
@@ -1225,6 +1478,67 @@ class DisplayDevice(VizResource):
 		# We need to disallow usage of the same "alias" multiple
 		# times. We need to enforce default - if we find modes.
 
+	def toDict(self, detailedConfig=True, addrOnly=False):
+		ret = { 'class' : DisplayDevice.rootNodeName }
+		if self.resType is not None:
+			ret['model'] = self.resType
+		if self.input is not None:
+			ret['input'] = self.input
+		if self.edid is not None:
+			ret['edid'] = self.edid
+		if self.edidBytes is not None:
+			ret['edidBytes'] = self.edidBytes
+		if self.edid_name is not None:
+			ret['edid_name'] = self.edid_name
+		if (self.hsync_min is not None) or (self.hsync_max is not None):
+			ret['hsync'] = { 'min' : self.hsync_min, 'max' : self.hsync_max }
+		if (self.vrefresh_min is not None) or (self.vrefresh_max is not None):
+			ret['vrefresh'] = { 'min' : self.vrefresh_min, 'max' : self.vrefresh_max }
+		if self.dimensions is not None:
+			ret['dimensions'] = [ self.dimensions[0], self.dimensions[1] ]
+			if self.bezel is not None:
+				ret['bezel'] = copy.copy(self.bezel)
+		if self.default_mode is not None:
+			ret['default_mode'] = self.default_mode
+		# Modes are passed as-is, including the bezel info computed
+		# when the display was deserialized
+		ret['modes'] = deepcopy(self.modes)
+		return ret
+
+	def fromDict(self, d):
+		self.__clearAll()
+		if d.get('class') != DisplayDevice.rootNodeName:
+			raise ValueError, "Failed to deserialize DisplayDevice. Incorrect deserialization attempt."
+
+		self.resType = d.get('model')
+		self.input = d.get('input')
+		self.edid = d.get('edid')
+		self.edidBytes = d.get('edidBytes')
+		self.edid_name = d.get('edid_name')
+		if d.has_key('hsync'):
+			self.hsync_min = d['hsync'].get('min')
+			self.hsync_max = d['hsync'].get('max')
+		if d.has_key('vrefresh'):
+			self.vrefresh_min = d['vrefresh'].get('min')
+			self.vrefresh_max = d['vrefresh'].get('max')
+		if d.has_key('dimensions'):
+			self.dimensions = [ float(d['dimensions'][0]), float(d['dimensions'][1]) ]
+			if d.has_key('bezel'):
+				self.bezel = {}
+				for bpos in ['left','right','bottom','top']:
+					self.bezel[bpos] = float(d['bezel'][bpos])
+		self.default_mode = d.get('default_mode')
+		for thisMode in d.get('modes', []):
+			newMode = {}
+			for key in ['type', 'alias', 'width', 'height', 'refresh', 'value', 'bezel']:
+				if thisMode.has_key(key):
+					newMode[key] = thisMode[key]
+			newMode['width'] = int(newMode['width'])
+			newMode['height'] = int(newMode['height'])
+			if not newMode.has_key('value'):
+				newMode['value'] = None
+			self.modes.append(newMode)
+
 class GPU(VizResource):
 	"""
 	GPU resource class
@@ -1738,6 +2052,158 @@ class GPU(VizResource):
 			self.max_width = int(domutil.getValue(domutil.getChildNode(limitNode, "max_width")))
 			self.max_height = int(domutil.getValue(domutil.getChildNode(limitNode, "max_height")))
 
+	def toDict(self, detailedConfig = True, addrOnly=False):
+		"""
+		NOTE: detailedConfig triggers inclusion of schedulable information.
+		"""
+		ret = VizResource.toDict(self, detailedConfig, addrOnly)
+		ret['class'] = GPU.rootNodeName
+
+		if self.hostName is not None:
+			ret['hostname'] = self.hostName
+
+		if self.resIndex is not None:
+			ret['index'] = self.resIndex
+
+		if not addrOnly:
+			if self.sharedServerIndex is not None:
+				ret['sharedServerIndex'] = self.sharedServerIndex
+				if self.sharedServer is not None:
+					ret['sharedServer'] = self.sharedServer.toDict()
+
+			if self.resType is not None:
+				ret['model'] = self.resType
+
+			if self.busID is not None:
+				ret['busID'] = self.busID
+
+			if self.useScanOut is not None:
+				ret['useScanOut'] = bool(self.useScanOut)
+
+			if self.allowNoScanOut is not None:
+				ret['allowNoScanOut'] = bool(self.allowNoScanOut)
+
+			if self.allowStereo is not None:
+				ret['allowStereo'] = bool(self.allowStereo)
+
+			scanouts = []
+			scanoutKeys = self.scanout.keys()
+			scanoutKeys.sort()
+			for scanout_index in scanoutKeys:
+				scanout = self.scanout[scanout_index]
+				thisScanout = { 'port_index' : scanout_index }
+				for key in ['type', 'mode', 'area_x', 'area_y', 'area_width', 'area_height']:
+					if scanout.has_key(key):
+						thisScanout[key] = scanout[key]
+				if isinstance(scanout["display_device"],str):
+					thisScanout['display_device'] = scanout["display_device"]
+				else:
+					thisScanout['display_device'] = scanout["display_device"].getType()
+				scanouts.append(thisScanout)
+			if len(scanouts)>0:
+				ret['scanouts'] = scanouts
+
+			if detailedConfig:
+				if self.schedulable:
+					ret['schedulable'] = self.schedulable.toDict()
+
+			if self.vendor is not None:
+				ret['vendor'] = self.vendor
+			if self.scanoutCaps is not None:
+				ret['scanout_caps'] = []
+				for idx in self.scanoutCaps:
+					ret['scanout_caps'].append({ 'index' : idx, 'types' : copy.copy(self.scanoutCaps[idx]) })
+			if self.max_width is not None:
+				ret['max_width'] = self.max_width
+			if self.max_height is not None:
+				ret['max_height'] = self.max_height
+
+		return ret
+
+	def fromDict(self, d):
+		"""
+		Recreate the whole object from a dictionary created by toDict.
+		"""
+		self.__clearAll()
+
+		if d.get('class') != GPU.rootNodeName:
+			raise ValueError, "Faild deserialize GPU. Programmatic error."
+
+		# Deserialize the base class info
+		VizResource.fromDict(self, d)
+
+		self.hostName = d.get('hostname')
+		if d.get('index') is not None:
+			self.resIndex = int(d['index'])
+		self.busID = d.get('busID')
+		self.resType = d.get('model')
+		if d.get('useScanOut') is not None:
+			self.useScanOut = bool(d['useScanOut'])
+		if d.get('allowNoScanOut') is not None:
+			self.allowNoScanOut = bool(d['allowNoScanOut'])
+		if d.get('allowStereo') is not None:
+			self.allowStereo = bool(d['allowStereo'])
+
+		if d.has_key('sharedServer'):
+			self.sharedServer.fromDict(d['sharedServer'])
+			self.sharedServer.setShareLimit(self.getShareLimit())
+
+		if d.get('sharedServerIndex') is not None:
+			self.setSharedServerIndex(int(d['sharedServerIndex']))
+		elif self.sharedServer is not None:
+			self.sharedServerIndex = self.sharedServer.getIndex()
+
+		for thisCap in d.get('scanout_caps', []):
+			if self.scanoutCaps is None:
+				self.scanoutCaps = {}
+			self.scanoutCaps[int(thisCap['index'])] = copy.copy(thisCap['types'])
+
+		for sDict in d.get('scanouts', []):
+			thisScanout = {}
+			try:
+				portIndex = int(sDict['port_index'])
+				if (portIndex<0):
+					raise ValueError, "Bad value of port index. This can't be negative."
+				if (self.scanoutCaps is not None) and (portIndex>len(self.scanoutCaps)):
+					raise ValueError, "Port index(%d) has to be less than the number of scanouts supported(%d)"%(portIndex, len(self.scanoutCaps))
+			except (KeyError, TypeError, ValueError):
+				raise ValueError, "Failed to deserialize : Bad value for port index"
+
+			if sDict.has_key('type'):
+				if sDict['type'] not in GPU.ScanTypes:
+					raise ValueError, "Failed to deserialize. Bad value for type of scanout type. Valid values are %s, specified value was:%s"%(repr(GPU.ScanTypes), sDict['type'])
+				thisScanout['type'] = sDict['type']
+
+			if sDict.has_key('mode'):
+				if len(sDict['mode'])==0:
+					raise ValueError, "Failed to deserialize. Empty mode node has been specified."
+				thisScanout['mode'] = sDict['mode']
+
+			if sDict.get('display_device') is None:
+				raise ValueError, "Failed to deserialize. No display device specified"
+			thisScanout['display_device'] = sDict['display_device']
+
+			try:
+				for key in ['area_x', 'area_y', 'area_width', 'area_height']:
+					if sDict.has_key(key):
+						thisScanout[key] = int(sDict[key])
+			except (TypeError, ValueError):
+				raise ValueError, "Failed to deserialize. Bad value for area parameters : x or y or width or height"
+
+			self.scanout[portIndex] = thisScanout
+
+		if d.has_key('schedulable'):
+			self.schedulable = Schedulable()
+			self.schedulable.fromDict(d['schedulable'])
+		else:
+			self.schedulable = None
+
+		self.vendor = d.get('vendor')
+		if d.get('max_width') is not None:
+			self.max_width = int(d['max_width'])
+		if d.get('max_height') is not None:
+			self.max_height = int(d['max_height'])
+
 	def getScanouts(self):
 		ret = {}
 		for pi in self.scanout.keys():
@@ -2041,6 +2507,52 @@ class SLI(VizResource):
 		if sliModeNode is not None:
 			self.setMode(domutil.getValue(sliModeNode))
 
+	def toDict(self, detailedConfig = True, addrOnly=False):
+		ret = VizResource.toDict(self, detailedConfig, addrOnly)
+		ret['class'] = SLI.rootNodeName
+
+		if self.hostName is not None:
+			ret['hostname'] = self.hostName
+
+		if self.resIndex is not None:
+			ret['index'] = self.resIndex
+
+		if not addrOnly:
+			if self.resType is not None:
+				ret['type'] = self.resType
+
+			if detailedConfig == True:
+				if self.gpu0 is not None:
+					ret['gpu0'] = self.gpu0
+				if self.gpu1 is not None:
+					ret['gpu1'] = self.gpu1
+
+			if self.mode is not None:
+				ret['mode'] = self.mode
+
+		return ret
+
+	def fromDict(self, d):
+		self.__clearAll()
+
+		if d.get('class') != SLI.rootNodeName:
+			raise ValueError, "Faild to deserialize SLI. Programmatic error."
+
+		# Deserialize the base class info
+		VizResource.fromDict(self, d)
+
+		self.hostName = d.get('hostname')
+		if d.get('index') is not None:
+			self.resIndex = int(d['index'])
+		if d.get('type') is not None:
+			self.setType(d['type'])
+		if d.get('gpu0') is not None:
+			self.gpu0 = int(d['gpu0'])
+		if d.get('gpu1') is not None:
+			self.gpu1 = int(d['gpu1'])
+		if d.get('mode') is not None:
+			self.setMode(d['mode'])
+
 class Screen:
 	"""
 	Screen class enapsulates a single screen of an X server - i.e. a framebuffer.
@@ -2430,6 +2942,62 @@ class Screen:
 			newGPU.deserializeFromXML(gpuNode)
 			self.gpus.append(newGPU)
 
+	def toDict(self):
+		if self.isXineramaScreen:
+			raise VizError(VizError.BAD_OPERATION, "Can't serialize a Xinerama screen")
+
+		ret = { 'class' : Screen.rootNodeName }
+		if self.screenNumber is not None:
+			ret['index'] = self.screenNumber
+
+		properties = {}
+		for propName in ['position', 'resolution']:
+			if self.properties.has_key(propName):
+				properties[propName] = [ self.properties[propName][0], self.properties[propName][1] ]
+		for propName in ['stereo', 'rotate']:
+			if self.properties.has_key(propName):
+				properties[propName] = self.properties[propName]
+		if len(properties)>0:
+			ret['properties'] = properties
+
+		if self.gpuCombiner is not None:
+			ret['gpu_combiner'] = self.gpuCombiner.toDict(False)
+
+		# include the mimimum amount of GPU config possible
+		ret['gpus'] = map(lambda x: x.toDict(False), self.gpus)
+		return ret
+
+	def fromDict(self, d):
+		if d.get('class') != Screen.rootNodeName:
+			raise ValueError, "Failed to deserialize Screen. Incorrect deserialization attempt"
+
+		self.__clearAll()
+
+		if d.get('index') is None:
+			raise ValueError, "Failed to deserialize Screen. Improper screen specification: screen number is mandatory"
+		self.screenNumber = int(d['index'])
+
+		# setFBProperty validates the values
+		properties = d.get('properties', {})
+		for propName in ['position', 'resolution']:
+			if properties.has_key(propName):
+				self.setFBProperty(propName, map(int, properties[propName]))
+		for propName in ['stereo', 'rotate']:
+			if properties.has_key(propName):
+				self.setFBProperty(propName, properties[propName])
+
+		if d.has_key('gpu_combiner'):
+			newSLI = SLI()
+			newSLI.fromDict(d['gpu_combiner'])
+			self.setGPUCombiner(newSLI)
+
+		if len(d.get('gpus', []))==0:
+			raise ValueError, "Failed to deserialize Screen. Improper configuration - No GPUs are present"
+		for gpuDict in d['gpus']:
+			newGPU = GPU()
+			newGPU.fromDict(gpuDict)
+			self.gpus.append(newGPU)
+
 class Server(VizResource):
 	"""
 	Server class encapsulates a single X server
@@ -2828,6 +3396,79 @@ class Server(VizResource):
 		if combineFBNode is not None:
 			self.combineFBs = bool(domutil.getValue(combineFBNode))
 
+	def toDict(self, detailedConfig = True, addrOnly=False):
+		ret = VizResource.toDict(self, detailedConfig, addrOnly)
+		ret['class'] = Server.rootNodeName
+		if self.hostName is not None: ret['hostname'] = self.hostName
+		if self.resIndex is not None: ret['server_number'] = self.resIndex
+
+		if not addrOnly:
+			if self.resType is not None: ret['server_type'] = self.resType
+
+			if detailedConfig:
+				if len(self.serverArgs)>0:
+					argNames = self.serverArgs.keys()
+					argNames.sort()
+					ret['x_cmdline_args'] = map(lambda x: {'name':x, 'value':self.serverArgs[x]}, argNames)
+				if len(self.modules)>0:
+					ret['x_modules'] = copy.copy(self.modules)
+				if len(self.x_extension_section_option)>0:
+					optNames = self.x_extension_section_option.keys()
+					optNames.sort()
+					ret['x_extension_section_options'] = map(lambda x: {'name':x, 'value':self.x_extension_section_option[x]}, optNames)
+				if self.keyboard is not None: ret['keyboard'] = self.keyboard.toDict(detailedConfig=False)
+				if self.mouse is not None: ret['mouse'] = self.mouse.toDict(detailedConfig=False)
+
+				screenNumbers = self.screens.keys()
+				screenNumbers.sort()
+				if len(screenNumbers)>0:
+					ret['screens'] = map(lambda x: self.screens[x].toDict(), screenNumbers)
+
+			if self.combineFBs == True:
+				ret['combine_framebuffers'] = True
+
+		return ret
+
+	def fromDict(self, d):
+		self.__clearAll()
+
+		if d.get('class') != Server.rootNodeName:
+			raise ValueError, "Failed to deserialize Server. This should not happen. Class=%s, expected %s!"%(d.get('class'), Server.rootNodeName)
+
+		VizResource.fromDict(self, d)
+
+		self.hostName = d.get('hostname')
+		if d.get('server_number') is not None:
+			self.resIndex = int(d['server_number'])
+
+		if d.get('server_type') is not None:
+			if d['server_type'] not in VALID_SERVER_TYPES:
+				raise ValueError, "Invalid server type '%s'"%(d['server_type'])
+			self.resType = d['server_type']
+
+		for arg in d.get('x_cmdline_args', []):
+			self.setArg(arg['name'], arg.get('value'))
+
+		for name in d.get('x_modules', []):
+			self.modules.append(name)
+
+		for opt in d.get('x_extension_section_options', []):
+			self.setXExtensionSectionOption(opt['name'], opt['value'])
+
+		if d.has_key('keyboard'):
+			self.keyboard = deserializeVizResourceFromDict(d['keyboard'], [Keyboard])
+
+		if d.has_key('mouse'):
+			self.mouse = deserializeVizResourceFromDict(d['mouse'], [Mouse])
+
+		for screenDict in d.get('screens', []):
+			scr = Screen()
+			scr.fromDict(screenDict)
+			scr.setServer(self)
+			self.addScreen(scr)
+
+		self.combineFBs = bool(d.get('combine_framebuffers', False))
+
 	def getAllocationWeight(self):
 		"""
 		Returns a weight to be used by the allocation algorithm.
@@ -3025,6 +3666,53 @@ class ResourceGroup(VizResourceAggregate):
 		self.resources = resources
 		self.handlerObj = self.__createHandlerObj()
 
+	def toDict(self, detailedConfig=True, addrOnly=False):
+		# Validate before serializing
+		self.doValidate(self.validateAgainst)
+
+		ret = { 'class' : ResourceGroup.rootNodeName }
+		if self.name is not None:
+			ret['name'] = self.name
+		if self.resType is not None:
+			ret['handler'] = self.resType
+		if self.description is not None:
+			ret['description'] = self.description
+		if self.handler_params is not None:
+			ret['handler_params'] = self.handler_params
+		if len(self.resources)>0:
+			ret['resources'] = map(lambda innerList: map(lambda res: res.toDict(), innerList), self.resources)
+		return ret
+
+	def fromDict(self, d):
+		self.__clearAll()
+		if d.get('class') != ResourceGroup.rootNodeName:
+			raise ValueError, "Failed to deserialize Resource Group. This should not happen. Class=%s, expected %s!"%(d.get('class'), ResourceGroup.rootNodeName)
+
+		name = d.get('name')
+		if (name is not None) and (len(name)==0):
+			raise ValueError, "Resource Group name should not be empty"
+
+		handler = d.get('handler')
+		if (handler is not None) and (len(handler)==0):
+			raise ValueError, "Resource Group handler should not be empty"
+
+		self.description = d.get('description')
+
+		resources = []
+		if d.has_key('resources'):
+			if len(d['resources'])==0:
+				raise ValueError, "Resource Group needs to have one or more resource lists"
+			for resList in d['resources']:
+				if len(resList)==0:
+					raise ValueError, "Resource Group's resource lists must have one or more resources"
+				resources.append(map(deserializeVizResourceFromDict, resList))
+
+		self.name = name
+		self.resType = handler
+		self.handler_params = d.get('handler_params')
+		self.resources = resources
+		self.handlerObj = self.__createHandlerObj()
+
 	def getHandlerObject(self):
 		"""
 		Return the handler object corresponding to this resource group.
@@ -3950,6 +4638,25 @@ def deserializeVizResource(domNode, classList=[GPU, SLI, Server, Keyboard, Mouse
 				return newObject
 	raise ValueError, "Could not deserialize VizResource : Unrecognized object '%s'"%(domNode.nodeName)
 
+def deserializeVizResourceFromDict(d, classList=[GPU, SLI, Server, Keyboard, Mouse]):
+	"""
+	Convenience function to recreate VizResource subclasses from dictionaries
+	created by their toDict method.
+	"""
+	if not isinstance(d, dict):
+		raise ValueError, "Could not deserialize VizResource : Expected a dictionary"
+	for className in classList:
+		if d.get('class') == className.rootNodeName:
+			newObject = className()
+			# Dictionaries come from the network, so missing keys and values
+			# of the wrong type are errors in the input.
+			try:
+				newObject.fromDict(d)
+			except (KeyError, TypeError, AttributeError), e:
+				raise ValueError, "Could not deserialize VizResource : Malformed '%s'. Reason: %s"%(className.rootNodeName, str(e))
+			return newObject
+	raise ValueError, "Could not deserialize VizResource : Unrecognized object '%s'"%(d.get('class'))
+
 
 def findMatchingObjects(classTemplate, searchOb, objectList):
 	if not isinstance(objectList, list):
@@ -3997,6 +4704,7 @@ class Allocation:
 		self.id = id
 		self.resources = resList
 		self.xprocs = []
+		self.xStartupTimes = []
 
 	def __del__(self):
 		pass
@@ -4069,9 +4777,20 @@ class Allocation:
 		resourceAccess.updateServerConfig(self.getId(), serverList)
 		
 				
-	def startViz(self, resourceAccess, timeout=X_WAIT_TIMEOUT, suppressMessages=True):
+	def startViz(self, resourceAccess, timeout=X_WAIT_TIMEOUT, suppressMessages=True, onServerReady=None):
+		"""
+		Start the X servers of this allocation, and wait for all of them to
+		come up. The X servers are started at the same time.
+
+		If onServerReady is passed, then onServerReady(server, seconds) is
+		called as each X server comes up, with the time it took to do so.
+		The same information is available from getXStartupTimes() afterwards.
+		"""
 		if not isinstance(resourceAccess, ResourceAccess):
 			raise ValueError, "Bad type for argument resourceAccess '%s'. Expected ResourceAccess."%(allocObj.__class__)
+		if timeout is not None:
+			if (type(timeout) is not int) or (timeout<0) or (timeout>X_WAIT_MAX):
+				raise ValueError, "Timeout needs to be an integer between 0 and %d (secs)"%(X_WAIT_MAX)
 
 		# Make a list of _all_servers in this allocation !
 		allServers = self.getServers()
@@ -4093,25 +4812,90 @@ class Allocation:
 		if len(serversToStart)==0:
 			raise VizError(VizError.BAD_CONFIGURATION, "There are no servers with a valid configuration to start")
 
-		# Start the X servers !
-		for srv in serversToStart:
+		# Watch the X servers before starting them, so that we can't miss
+		# any of them coming up
+		watch = resourceAccess.watchXState(self, serversToStart)
+		try:
+			try:
+				startTime = time.time()
+				self.__startServers(serversToStart, suppressMessages)
+				self.__waitForServers(watch, serversToStart, startTime, timeout, onServerReady)
+			except Exception, e: # FIXME: Exception OR BaseException ?? Seems to have a dependency on Python Version
+				# If there's a problem, then they all have to GO!
+				# Kill all X servers !!!
+				try:
+					self.stopViz(resourceAccess)
+				except VizError, e2:
+					pass
+				raise e
+		finally:
+			watch.stop()
+
+	def getXStartupTimes(self):
+		"""
+		Returns how long the X servers took to come up the last time
+		startViz was called, as a list of [server, seconds], in the order
+		in which they came up.
+		"""
+		return self.xStartupTimes
+
+	def __startServer(self, srv, suppressMessages, results, index):
+		try:
 			if srv.isShared():
 				p = srv.start(self.id, suppressOutput=suppressMessages, suppressErrors=suppressMessages)
 			else:
 				p = srv.start(suppressOutput=suppressMessages, suppressErrors=suppressMessages)
-			self.xprocs.append(p)
-
-		# Wait for them to start
-		try:
-			resourceAccess.waitXState(self, 1, timeout, serversToStart)
-		except Exception, e: # FIXME: Exception OR BaseException ?? Seems to have a dependency on Python Version
-			# If there's a problem, then they all have to GO!
-			# Kill all X servers !!!
-			try:
-				self.stopViz(resourceAccess)
-			except VizError, e2:
-				pass
-			raise e
+			results[index] = [p, None]
+		except Exception, e:
+			results[index] = [None, sys.exc_info()]
+
+	def __startServers(self, serverList, suppressMessages):
+		"""
+		Start the X servers in serverList, each from a thread of its own. A
+		launch may take a while (e.g. srun or ssh), and we don't want later
+		X servers to wait for that.
+		"""
+		results = [None]*len(serverList)
+		threads = []
+		for index in range(len(serverList)):
+			t = threading.Thread(target=self.__startServer, args=(serverList[index], suppressMessages, results, index))
+			t.start()
+			threads.append(t)
+		for t in threads:
+			t.join()
+
+		excInfo = None
+		for p, thisExcInfo in results:
+			if p is not None:
+				self.xprocs.append(p)
+			if (thisExcInfo is not None) and (excInfo is None):
+				excInfo = thisExcInfo
+		if excInfo is not None:
+			raise excInfo[0], excInfo[1], excInfo[2]
+
+	def __waitForServers(self, watch, serverList, startTime, timeout, onServerReady):
+		pending = {}
+		for srv in serverList:
+			pending[srv.hashKey()] = srv
+		self.xStartupTimes = []
+		while len(pending)>0:
+			if timeout is None:
+				waitTime = None
+			else:
+				waitTime = startTime + timeout - time.time()
+				if waitTime<=0:
+					raise VizError(VizError.USER_ERROR, "%d of %d servers are not in the desired state"%(len(pending), len(serverList)))
+			change = watch.getNextChange(waitTime)
+			if change is None:
+				continue
+			server, newState = change
+			if (newState!=1) or (not pending.has_key(server.hashKey())):
+				continue
+			srv = pending.pop(server.hashKey())
+			elapsed = time.time()-startTime
+			self.xStartupTimes.append([srv, elapsed])
+			if onServerReady is not None:
+				onServerReady(srv, elapsed)
 
 	def __emptyXprocs(self):
 		for proc in self.xprocs:
@@ -4137,42 +4921,269 @@ class Allocation:
 
 		self.__emptyXprocs()
 
-def sendMessageOnSocket(sock, message):
-	dataLen = '%d'%(len(message))
-	dataLen = dataLen + ' '*(5-len(dataLen)) # NOTE: the '5' is a dependency from vs-ssm.py
+def sendMessageOnSocket(sock, message, frameVersion=LEGACY_FRAME_VERSION, msgType=MSG_TYPE_XML, requestId=0):
+	"""
+	Send a message as a single frame. msgType and requestId are sent only in
+	version 2 frames.
+	"""
+	if frameVersion == LEGACY_FRAME_VERSION:
+		if len(message)>LEGACY_MAX_MESSAGE_SIZE:
+			raise VizError(VizError.BAD_PROTOCOL, "Message of %d bytes is too large. Messages larger than %d bytes need version %d frames"%(len(message), LEGACY_MAX_MESSAGE_SIZE, FRAME_VERSION))
+		header = '%-5d'%(len(message))
+	elif frameVersion == FRAME_VERSION:
+		if len(message)>MAX_MESSAGE_SIZE:
+			raise VizError(VizError.BAD_PROTOCOL, "Message of %d bytes is too large. The maximum is %d bytes"%(len(message), MAX_MESSAGE_SIZE))
+		header = struct.pack(FRAME_HEADER, FRAME_VERSION, msgType, 0, requestId, len(message))
+	else:
+		raise ValueError, "Unknown frame version %s"%(frameVersion)
 
-	sock.send(dataLen)
-	sock.send(message)
+	# One buffer, so that the header and message don't go out as separate
+	# packets
+	sock.sendall(header + message)
 
-def readMessageFromSocket(sock):
-	try:
-		dataLenStr = sock.recv(5)
-		if len(dataLenStr)==0:
-			raise VizError(VizError.NOT_CONNECTED, "Socket Disconnected")
-		if len(dataLenStr)!=5:
-			raise VizError(VizError.BAD_PROTOCOL, "Message length should be indicated in 5 bytes, not '%s'"%(dataLenStr))
+def getFrameHeaderSize(frameVersion):
+	if frameVersion == LEGACY_FRAME_VERSION:
+		return LEGACY_FRAME_HEADER_SIZE
+	elif frameVersion == FRAME_VERSION:
+		return FRAME_HEADER_SIZE
+	raise ValueError, "Unknown frame version %s"%(frameVersion)
 
+def decodeFrameHeader(frameVersion, header):
+	"""
+	Decode a frame header. Returns [msgType, requestId, dataLen]. Version 1
+	frames don't have a message type, so msgType is None for them.
+	"""
+	if frameVersion == LEGACY_FRAME_VERSION:
 		try:
-			dataLen = int(dataLenStr)
-			if dataLen<=0:
-				raise VizError(VizError.BAD_PROTOCOL, "Message length = %d is invalid"%(dataLen))
+			dataLen = int(header)
 		except ValueError, e:
-			raise VizError(VizError.BAD_PROTOCOL, "Message length = %s is invalid"%(dataLenStr))
-		
-		# FIXME: is the below loop necessary ? it's a blocking socket afterall, right ?
-		payload =''
-		while len(payload)<dataLen:
-			data = sock.recv(dataLen-len(payload))
-			if len(data)==0:
-				break
-			payload = payload + data
+			raise VizError(VizError.BAD_PROTOCOL, "Message length = %s is invalid"%(header))
+		if dataLen<=0:
+			raise VizError(VizError.BAD_PROTOCOL, "Message length = %d is invalid"%(dataLen))
+		return [None, 0, dataLen]
+
+	version, msgType, flags, requestId, dataLen = struct.unpack(FRAME_HEADER, header)
+	if version != frameVersion:
+		raise VizError(VizError.BAD_PROTOCOL, "Expected a version %d frame, got version %d"%(frameVersion, version))
+	if msgType not in VALID_MSG_TYPES:
+		raise VizError(VizError.BAD_PROTOCOL, "Unknown message type %d"%(msgType))
+	if (dataLen<=0) or (dataLen>MAX_MESSAGE_SIZE):
+		raise VizError(VizError.BAD_PROTOCOL, "Message length = %d is invalid"%(dataLen))
+	return [msgType, requestId, dataLen]
+
+def getMessageType(msgType, message):
+	"""
+	Returns the type of a received message. Messages in version 1 frames
+	are identified by their first character.
+	"""
+	if msgType is not None:
+		return msgType
+	if message[:1] == '{':
+		return MSG_TYPE_JSON
+	return MSG_TYPE_XML
 
+def __recvAll(sock, nBytes):
+	"""
+	Receive nBytes from a blocking socket. Less data is returned only if the
+	socket got disconnected.
+	"""
+	if useRecvInto:
+		buf = bytearray(nBytes)
+		view = memoryview(buf)
+		received = 0
+		while received < nBytes:
+			n = sock.recv_into(view[received:], nBytes-received)
+			if n==0:
+				return str(buf[:received])
+			received += n
+		return str(buf)
+
+	pieces = []
+	received = 0
+	while received < nBytes:
+		piece = sock.recv(nBytes-received)
+		if len(piece)==0:
+			break
+		pieces.append(piece)
+		received += len(piece)
+	return ''.join(pieces)
+
+def readFrameFromSocket(sock, frameVersion=LEGACY_FRAME_VERSION):
+	"""
+	Read a frame from a blocking socket. Returns [msgType, requestId, message].
+	"""
+	headerSize = getFrameHeaderSize(frameVersion)
+	try:
+		header = __recvAll(sock, headerSize)
+		if len(header)==0:
+			raise VizError(VizError.NOT_CONNECTED, "Socket Disconnected")
+		if len(header)!=headerSize:
+			raise VizError(VizError.BAD_PROTOCOL, "Frame header should be %d bytes, not '%s'"%(headerSize, header))
+
+		msgType, requestId, dataLen = decodeFrameHeader(frameVersion, header)
+
+		payload = __recvAll(sock, dataLen)
 		if len(payload)!=dataLen:
-			raise VizError(VizError.BAD_PROTOCOL, "Incomplete message. Expected message of length %s, got message of lenght %d"%(dataLenStr, len(payload)))
+			raise VizError(VizError.BAD_PROTOCOL, "Incomplete message. Expected message of length %d, got message of length %d"%(dataLen, len(payload)))
 	except socket.error, e:
 		raise VizError(VizError.SOCKET_ERROR, str(e))
 
-	return payload
+	return [getMessageType(msgType, payload), requestId, payload]
+
+def readMessageFromSocket(sock, frameVersion=LEGACY_FRAME_VERSION):
+	return readFrameFromSocket(sock, frameVersion)[2]
+
+def peekFrameVersion(sock):
+	"""
+	Returns the version of the frame waiting on a blocking socket, without
+	reading it. Version 2 frames start with their version, and version 1
+	frames with a decimal digit.
+	"""
+	try:
+		first = sock.recv(1, socket.MSG_PEEK)
+	except socket.error, e:
+		raise VizError(VizError.SOCKET_ERROR, str(e))
+	if first == chr(FRAME_VERSION):
+		return FRAME_VERSION
+	# A disconnection is found when the frame is read
+	return LEGACY_FRAME_VERSION
+
+class MessageReader:
+	"""
+	Assembles frames sent using sendMessageOnSocket from a non-blocking
+	socket, a piece at a time. Call read() or readFrame() whenever the socket
+	is readable; they return the message once the whole frame has arrived,
+	and None till then. Data beyond the end of the frame is never consumed,
+	so the socket may be used with readMessageFromSocket once a message has
+	been read.
+	"""
+	def __init__(self, sock, frameVersion=LEGACY_FRAME_VERSION):
+		self.sock = sock
+		self.setFrameVersion(frameVersion)
+
+	def setFrameVersion(self, frameVersion):
+		"""
+		Change the version of frames expected. Must be called only between
+		frames.
+		"""
+		self.frameVersion = frameVersion
+		self.__startFrame()
+
+	def __startFrame(self):
+		self.header = None
+		self.msgType = None
+		self.requestId = None
+		self.__startPart(getFrameHeaderSize(self.frameVersion))
+
+	def __startPart(self, size):
+		# The header and the message are received one after the other
+		self.size = size
+		self.received = 0
+		if useRecvInto:
+			self.buf = bytearray(size)
+		else:
+			self.buf = [] # pieces received so far
+
+	def __recvPart(self):
+		# Returns the number of bytes received; 0 if the socket got disconnected
+		if useRecvInto:
+			n = self.sock.recv_into(memoryview(self.buf)[self.received:], self.size-self.received)
+		else:
+			piece = self.sock.recv(self.size-self.received)
+			n = len(piece)
+			self.buf.append(piece)
+		self.received += n
+		return n
+
+	def __partData(self):
+		if useRecvInto:
+			return str(self.buf)
+		return ''.join(self.buf)
+
+	def read(self):
+		frame = self.readFrame()
+		if frame is None:
+			return None
+		return frame[2]
+
+	def readFrame(self):
+		"""
+		Returns [msgType, requestId, message] once a complete frame has
+		been received, else None.
+		"""
+		while 1:
+			try:
+				n = self.__recvPart()
+			except socket.error, e:
+				if e.args[0] in [errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR]:
+					return None
+				raise VizError(VizError.SOCKET_ERROR, str(e))
+
+			if n==0:
+				if (self.header is None) and (self.received==0):
+					raise VizError(VizError.NOT_CONNECTED, "Socket Disconnected")
+				raise VizError(VizError.BAD_PROTOCOL, "Socket disconnected before the complete message was received")
+
+			if self.received < self.size:
+				continue
+
+			if self.header is None:
+				self.header = self.__partData()
+				self.msgType, self.requestId, dataLen = decodeFrameHeader(self.frameVersion, self.header)
+				self.__startPart(dataLen)
+			else:
+				payload = self.__partData()
+				ret = [getMessageType(self.msgType, payload), self.requestId, payload]
+				self.__startFrame()
+				return ret
+
+def encodeJSONMessage(msg):
+	"""
+	Encode a message (a dictionary) using the JSON encoding of the SSM
+	protocol. Strings are taken to be iso-8859-1, which is what we get from
+	domutil.getValue for XML messages.
+	"""
+	if json is None:
+		raise VizError(VizError.BAD_CONFIGURATION, "The JSON encoding needs the json module (Python 2.6 or later)")
+	# The json module uses its fast C encoder only for the default (utf-8)
+	# encoding. Nearly everything we send is plain ASCII, for which both
+	# encodings give the same output. Non-ASCII characters show up as \u
+	# escapes, and only then do we need to encode again as iso-8859-1.
+	try:
+		ret = json.dumps(msg, separators=(',',':'))
+		if ret.find('\\u')==-1:
+			return ret
+	except UnicodeDecodeError:
+		pass
+	return json.dumps(msg, separators=(',',':'), encoding='iso-8859-1')
+
+def decodeJSONMessage(msg):
+	"""
+	Decode a message in the JSON encoding of the SSM protocol, returning
+	a dictionary. Strings are returned as str objects, just like the XML
+	code paths do. Raises ValueError if the message is not valid.
+	"""
+	if json is None:
+		raise VizError(VizError.BAD_CONFIGURATION, "The JSON encoding needs the json module (Python 2.6 or later)")
+	ret = json.loads(msg)
+	if not isinstance(ret, dict):
+		raise ValueError, "A JSON message needs to be an object"
+	return __strFromJSON(ret)
+
+def __strFromJSON(value):
+	"""
+	Convert the unicode strings returned by the json module back to str.
+	"""
+	if isinstance(value, unicode):
+		return value.encode('iso-8859-1')
+	if isinstance(value, list):
+		return map(__strFromJSON, value)
+	if isinstance(value, dict):
+		ret = {}
+		for k in value:
+			ret[__strFromJSON(k)] = __strFromJSON(value[k])
+		return ret
+	return value
 
 def getMasterParameters(filepath = masterConfigFile):
 	try:
@@ -4224,10 +5235,146 @@ def getMasterParameters(filepath = masterConfigFile):
 		
 	return [master, masterPort, masterAuth]
 
+class XStateWatch:
+	"""
+	Tells you about the X servers of an allocation going up or down, as it
+	happens. Get one using ResourceAccess.watchXState.
+
+	The watch uses a connection to the SSM of its own. Call stop() when
+	you're done with it.
+	"""
+	def __init__(self, resourceAccess, allocObj):
+		self.ra = resourceAccess
+		self.allocObj = allocObj
+
+	def getNextChange(self, timeout=None):
+		"""
+		Wait for an X server to change state. Returns [server, newState], where
+		server is a Server object, and newState is 1 if the X server came up,
+		0 if it went down. The first change returned for each X server is its
+		current state. Returns None if nothing changed in timeout seconds. Pass
+		None for an infinite timeout.
+
+		Raises VizError when the allocation goes away, which ends the watch.
+		"""
+		if self.ra.sock is None:
+			raise VizError(VizError.NOT_CONNECTED, "Not watching X server state anymore")
+		if timeout is not None:
+			ready, w, e = select.select([self.ra.sock], [], [], timeout)
+			if len(ready)==0:
+				return None
+		try:
+			msgType, requestId, msg = readFrameFromSocket(self.ra.sock, self.ra.frameVersion)
+			dom = xml.dom.minidom.parseString(msg)
+		except xml.parsers.expat.ExpatError, e:
+			self.stop()
+			raise VizError(VizError.INTERNAL_ERROR, "Improperly formed XML from SSM.\n XML Error : %s \nReturned XML:%s\n"%(str(e),msg))
+		except VizError, e:
+			self.stop()
+			raise
+
+		changeNode = domutil.getChildNode(dom.documentElement, "x_state_change")
+		if changeNode is None:
+			endNode = domutil.getChildNode(dom.documentElement, "x_state_watch_end")
+			self.stop()
+			if endNode is None:
+				raise VizError(VizError.BAD_PROTOCOL, "Unexpected message from SSM while watching X server state :%s"%(msg))
+			raise VizError(VizError.USER_ERROR, domutil.getValue(domutil.getChildNode(endNode, "message")))
+		server = deserializeVizResource(domutil.getChildNode(changeNode, Server.rootNodeName), [Server])
+		newState = int(domutil.getValue(domutil.getChildNode(changeNode, "newState")))
+		return [server, newState]
+
+	def stop(self):
+		"""
+		Stop watching.
+		"""
+		self.ra.stop()
+
+#
+# Session tokens given to us by SSMs, indexed by (host, port). The value is
+# [token, time at which we stop using it]. A token lets later connections
+# to the same SSM skip munge.
+#
+_sessionTokens = {}
+_sessionTokenLock = threading.Lock()
+
+# A token is not used if it expires within this many seconds
+SESSION_TOKEN_MARGIN = 5
+
+def _getSessionToken(host, port):
+	_sessionTokenLock.acquire()
+	try:
+		entry = _sessionTokens.get((host, port))
+		if (entry is None) or (time.time() >= entry[1]):
+			return None
+		return entry[0]
+	finally:
+		_sessionTokenLock.release()
+
+def _setSessionToken(host, port, token, lifetime):
+	_sessionTokenLock.acquire()
+	_sessionTokens[(host, port)] = [token, time.time()+lifetime-SESSION_TOKEN_MARGIN]
+	_sessionTokenLock.release()
+
+def _forgetSessionToken(host, port):
+	_sessionTokenLock.acquire()
+	_sessionTokens.pop((host, port), None)
+	_sessionTokenLock.release()
+
+class PendingRequest:
+	"""
+	A request started using ResourceAccess.submit, which may not have
+	finished yet.
+	"""
+	def __init__(self, func, args, kwargs):
+		self.__done = threading.Event()
+		self.__result = None
+		self.__excInfo = None
+		thread = threading.Thread(target=self.__run, args=(func, args, kwargs))
+		thread.setDaemon(True)
+		thread.start()
+
+	def __run(self, func, args, kwargs):
+		try:
+			self.__result = func(*args, **kwargs)
+		except Exception, e:
+			self.__excInfo = sys.exc_info()
+		self.__done.set()
+
+	def isDone(self):
+		"""
+		Returns True if the request has finished.
+		"""
+		return self.__done.isSet()
+
+	def wait(self, timeout=None):
+		"""
+		Wait for the request to finish. Returns True if it did, False if it
+		didn't finish in timeout seconds. Pass None for an infinite timeout.
+		"""
+		self.__done.wait(timeout)
+		return self.__done.isSet()
+
+	def getResult(self, timeout=None):
+		"""
+		Wait for the request to finish, and return what it returned. If the
+		request raised an exception, then the same is raised here. Raises
+		VizError if the request didn't finish in timeout seconds.
+		"""
+		if not self.wait(timeout):
+			raise VizError(VizError.RESOURCE_BUSY, "The request did not finish in %s seconds"%(timeout))
+		if self.__excInfo is not None:
+			raise self.__excInfo[0], self.__excInfo[1], self.__excInfo[2]
+		return self.__result
+
 class ResourceAccess:
 	"""
 	The main class for gaining access to resources.
 
+	Many threads may use a ResourceAccess object at the same time. Their
+	requests share the one connection to the SSM; with version 2 frames,
+	a request needn't wait for the others to finish. See submit().
+
 	Usage of this class is needed for allocation/cleanup and interacting with resources.
 	"""
 
@@ -4237,7 +5384,12 @@ class ResourceAccess:
 		# anyway !
 		self.__endConnection()
 
-	def __init__(self, cleanupOnDisconnect=True):
+	def __deepcopy__(self, memo):
+		# Allocated resources refer to the connection they came on. Copies
+		# of them (e.g. made by Screen.setGPU) need to use the same one.
+		return self
+
+	def __init__(self, cleanupOnDisconnect=True, encoding=ENCODING_XML, frameVersion=FRAME_VERSION):
 		"""
 		If cleanupOnDisconnect is True, then all allocations made on this connection
 		are freed up when the connection to the SSM is either closed OR lost. The cleanup
@@ -4250,14 +5402,51 @@ class ResourceAccess:
 		runtime conditions). This flag helps in such cases. By shifting 
 		the burden of the cleanup to the server side, we guarantee proper cleanup 
 		on script termination. This way, user scripts do not lead to an unusable system.
+
+		encoding selects how messages are encoded on this connection. ENCODING_XML
+		works with all SSMs. ENCODING_JSON is cheaper to encode and decode on both
+		sides, and is used for messages which carry resources (allocate, attach and
+		the queries). It needs an SSM that supports it.
+
+		frameVersion selects the framing of messages after the identity message.
+		Version 2 frames allow messages larger than 99999 bytes, which are needed
+		to query the resources of large clusters.
+
+		The encoding and frame version are used only once the SSM accepts them.
+		Older SSMs don't, and the connection stays with XML and version 1 frames.
+		The encoding and frameVersion attributes give what is in use.
+
+		Connections over TCP are authenticated using munge. With version 2
+		frames, the SSM also gives us a session token, which later connections
+		from this process use instead of munge till the token expires.
 		"""
 		self.sock = None
 		if cleanupOnDisconnect is None:
 			raise ValueError, "Bad value for cleanupOnDisconnect"
 		if not isinstance(cleanupOnDisconnect, bool):
 			raise ValueError, "cleanupOnDisconnect must be a boolean"
+		if encoding not in VALID_ENCODINGS:
+			raise ValueError, "Invalid encoding '%s'. Expected one of %s"%(encoding, VALID_ENCODINGS)
+		if (encoding == ENCODING_JSON) and (json is None):
+			raise ValueError, "The JSON encoding needs the json module (Python 2.6 or later)"
+		if frameVersion not in VALID_FRAME_VERSIONS:
+			raise ValueError, "Invalid frame version '%s'. Expected one of %s"%(frameVersion, VALID_FRAME_VERSIONS)
 
 		self.cleanupOnDisconnect = cleanupOnDisconnect
+		self.__askedEncoding = encoding
+		self.__askedFrameVersion = frameVersion
+		self.encoding = ENCODING_XML
+		self.frameVersion = LEGACY_FRAME_VERSION
+		self.__acceptancePending = False # True till the SSM answers the identity message
+		self.__tokenFor = None # (host, port) of the SSM asked for a session token
+
+		# Requests sent on the connection, and responses to them. These are
+		# protected by __cond. See __exchange.
+		self.__cond = threading.Condition()
+		self.__outstanding = set() # request IDs waiting for a response
+		self.__responses = {} # request ID -> [msgType, message]
+		self.__reading = False # True while a thread reads a response
+		self.__lastRequestId = 0
 
 		[self.masterHost, self.masterPort, self.masterAuth] = getMasterParameters()
 		self.start()
@@ -4271,8 +5460,51 @@ class ResourceAccess:
 		if port is None:
 			port = self.masterPort
 
-		payload = '<client><cleanupOnDisconnect>%d</cleanupOnDisconnect></client>'%(self.cleanupOnDisconnect)
+		# Till the SSM accepts what we ask for, we use what all SSMs support
+		self.encoding = ENCODING_XML
+		self.frameVersion = LEGACY_FRAME_VERSION
+		self.__tokenFor = None
+
+		payload = '<client><cleanupOnDisconnect>%d</cleanupOnDisconnect>'%(self.cleanupOnDisconnect)
+		# Older SSMs don't know about encodings; we mention it only if we
+		# need something other than the default
+		if self.__askedEncoding != ENCODING_XML:
+			payload += '<encoding>%s</encoding>'%(self.__askedEncoding)
+		if self.__askedFrameVersion != LEGACY_FRAME_VERSION:
+			payload += '<frameVersion>%d</frameVersion>'%(self.__askedFrameVersion)
+		self.__acceptancePending = (self.__askedEncoding != ENCODING_XML) or (self.__askedFrameVersion != LEGACY_FRAME_VERSION)
+
+		# Session tokens are given out only on connections using version 2
+		# frames, so older SSMs are never asked for one
+		useSessionToken = (host != "localhost") and (self.masterAuth == 'Munge') and (self.__askedFrameVersion != LEGACY_FRAME_VERSION)
+		if useSessionToken:
+			token = _getSessionToken(host, port)
+			if token is not None:
+				if self.__resumeSession(host, port, token, payload+'</client>'):
+					return
+				_forgetSessionToken(host, port)
+			# The token comes with the acceptance of the identity message
+			payload += '<sessionToken>1</sessionToken>'
+			self.__tokenFor = (host, port)
+		payload += '</client>'
+
+		sock = self.__connect(host, port)
 
+		if host != "localhost":
+			# If we use TCP sockets, then we'll have to authenticate
+			payload = encode_message_with_auth(self.masterAuth, payload)
+
+		self.__setSocket(sock)
+
+		# Cleanup if sending the message failed. The SSM's reply, if any, is
+		# read along with the response to our first request.
+		try:
+			sendMessageOnSocket(sock, payload)
+		except Exception, e:
+			self.__endConnection()
+			raise e
+
+	def __connect(self, host, port):
 		# Connect using the right socket type, depending on the host
 		try:
 			if host == "localhost":
@@ -4283,27 +5515,88 @@ class ResourceAccess:
 				sock.connect((host,int(port)))
 		except socket.error, e:
 			raise VizError(VizError.NOT_CONNECTED, "Failed to connect to SSM. Please ensure that it is running. Reason: %s"%(str(e)))
+		return sock
 
-		if host != "localhost":
-			# If we use TCP sockets, then we'll have to authenticate
-			payload = encode_message_with_auth(self.masterAuth, payload)
-
+	def __setSocket(self, sock):
+		self.__cond.acquire()
 		self.sock = sock
+		self.__outstanding.clear()
+		self.__responses.clear()
+		self.__cond.release()
+
+	def __resumeSession(self, host, port, token, identity):
+		"""
+		Internal use function.
 
-		# Cleanup if sending the message failed
+		Connect using a session token instead of munge. Unlike the munge
+		identity message, this always gets a response, so we know if the token
+		was accepted. Returns True if it was.
+		"""
+		sock = self.__connect(host, port)
 		try:
-			sendMessageOnSocket(sock, payload)
-		except Exception, e:
-			self.__endConnection()
-			raise e
+			sendMessageOnSocket(sock, '<session><token>%s</token>%s</session>'%(token, identity))
+			msg = readMessageFromSocket(sock)
+			if self.__takeAcceptance(msg):
+				self.__setSocket(sock)
+				return True
+			dom = xml.dom.minidom.parseString(msg)
+			responseNode = domutil.getChildNode(dom.documentElement, "response")
+			if int(domutil.getValue(domutil.getChildNode(responseNode, "status"))) == 0:
+				self.__setSocket(sock)
+				return True
+		except (socket.error, VizError, ValueError, AttributeError, xml.parsers.expat.ExpatError), e:
+			pass
+		try:
+			closeSocket(sock)
+		except socket.error, e:
+			pass
+		return False
+
+	def __takeAcceptance(self, msg):
+		"""
+		Internal use function.
+
+		Check if msg is the SSM's reply to the identity message, accepting the
+		encoding and frame version we asked for. If so, start using them, and
+		keep the session token that came with it. Returns True if msg was the
+		reply. Older SSMs don't send it, so the first message from them is a
+		response to a request.
+		"""
+		self.__acceptancePending = False
+		if not msg.startswith(CLIENT_ACCEPTED):
+			return False
+		try:
+			dom = xml.dom.minidom.parseString(msg)
+			acceptNode = domutil.getChildNode(dom.documentElement, "client_accepted")
+			encoding = domutil.getValue(domutil.getChildNode(acceptNode, "encoding"))
+			frameVersion = int(domutil.getValue(domutil.getChildNode(acceptNode, "frameVersion")))
+			tokenNode = domutil.getChildNode(acceptNode, "token")
+			if tokenNode is not None:
+				token = domutil.getValue(tokenNode)
+				lifetime = int(domutil.getValue(domutil.getChildNode(acceptNode, "lifetime")))
+		except (ValueError, AttributeError, xml.parsers.expat.ExpatError), e:
+			raise VizError(VizError.BAD_PROTOCOL, "Bad reply from SSM to the identity message : %s"%(msg))
+		if (encoding not in VALID_ENCODINGS) or (frameVersion not in VALID_FRAME_VERSIONS):
+			raise VizError(VizError.BAD_PROTOCOL, "SSM accepted an unknown encoding or frame version : %s"%(msg))
+		self.encoding = encoding
+		self.frameVersion = frameVersion
+		if (tokenNode is not None) and (self.__tokenFor is not None):
+			_setSessionToken(self.__tokenFor[0], self.__tokenFor[1], str(token), lifetime)
+		return True
 
 	def __endConnection(self):
-		if self.sock is not None:
-			try:
-				closeSocket(self.sock)
-			except socket.error, e:
-				pass
-		self.sock = None
+		self.__cond.acquire()
+		try:
+			if self.sock is not None:
+				try:
+					closeSocket(self.sock)
+				except socket.error, e:
+					pass
+			self.sock = None
+			# Threads waiting for responses will find that the connection is gone
+			self.__cond.notifyAll()
+		finally:
+			self.__cond.release()
 
 	def stop(self):
 		"""
@@ -4311,6 +5604,81 @@ class ResourceAccess:
 		"""
 		self.__endConnection()
 
+	def __newRequestId(self):
+		# Request IDs are 32-bit, and 0 is what legacy frames carry
+		while 1:
+			self.__lastRequestId = (self.__lastRequestId % 0xffffffff) + 1
+			if self.__lastRequestId not in self.__outstanding:
+				return self.__lastRequestId
+
+	def __readResponse(self):
+		"""
+		Internal use function. Called with __cond held.
+
+		Read one response off the socket, and keep it for the thread which
+		sent the request. The lock is let go while reading, so that other
+		threads can send requests meanwhile.
+		"""
+		self.__reading = True
+		sock = self.sock
+		self.__cond.release()
+		try:
+			msgType, requestId, msg = readFrameFromSocket(sock, self.frameVersion)
+			# Till the identity message is answered, requests go one at a time
+			# in version 1 frames, so this can't be missed
+			if self.__acceptancePending and self.__takeAcceptance(msg):
+				msgType, requestId, msg = readFrameFromSocket(sock, self.frameVersion)
+		finally:
+			self.__cond.acquire()
+			self.__reading = False
+			self.__cond.notifyAll()
+		if requestId not in self.__outstanding:
+			raise VizError(VizError.BAD_PROTOCOL, "Got a response from SSM for request %d, which isn't pending"%(requestId))
+		self.__responses[requestId] = [msgType, msg]
+
+	def __exchange(self, message, msgType):
+		"""
+		Internal use function.
+
+		Send a message to the SSM, and wait for the response to it. Returns
+		[msgType, message] of the response.
+
+		Each message carries a request ID of its own, and the SSM tags the
+		response with the same ID. Responses may come in any order - e.g. the
+		response to a waitXState comes only when the X servers are ready, and
+		other requests are answered meanwhile. One of the waiting threads reads
+		the responses, and the others pick up theirs from __responses.
+
+		Legacy frames don't carry request IDs, so only one request may be
+		outstanding on such connections.
+		"""
+		self.__cond.acquire()
+		try:
+			if self.frameVersion == LEGACY_FRAME_VERSION:
+				while (self.sock is not None) and (len(self.__outstanding)>0):
+					self.__cond.wait()
+				requestId = 0
+			else:
+				requestId = self.__newRequestId()
+			if self.sock is None:
+				raise VizError(VizError.NOT_CONNECTED, "Not connected to SSM")
+			sendMessageOnSocket(self.sock, message, self.frameVersion, msgType, requestId)
+			self.__outstanding.add(requestId)
+			try:
+				while not self.__responses.has_key(requestId):
+					if self.sock is None:
+						raise VizError(VizError.NOT_CONNECTED, "Connection to SSM closed while waiting for a response")
+					if self.__reading:
+						self.__cond.wait()
+					else:
+						self.__readResponse()
+				return self.__responses.pop(requestId)
+			finally:
+				self.__outstanding.discard(requestId)
+				self.__cond.notifyAll()
+		finally:
+			self.__cond.release()
+
 	def __sendAndRecvMessage(self, message):
 		"""
 		Internal use function.
@@ -4320,8 +5688,9 @@ class ResourceAccess:
 		All errors are handled. Including this function has made the code so readable !
 		"""
 		try:
-			sendMessageOnSocket(self.sock, message)
-			msg = readMessageFromSocket(self.sock)
+			msgType, msg = self.__exchange(message, MSG_TYPE_XML)
+			if msgType != MSG_TYPE_XML:
+				raise VizError(VizError.BAD_PROTOCOL, "Expected an XML response from SSM, got message type %d"%(msgType))
 			dom = None
 			try:
 				dom = xml.dom.minidom.parseString(msg)
@@ -4354,6 +5723,51 @@ class ResourceAccess:
 			raise 
 
 		return [statusCode, statusMessage, dom]
+
+	def __sendAndRecvJSONMessage(self, message):
+		"""
+		Internal use function.
+
+		JSON counterpart of __sendAndRecvMessage. message is a dictionary.
+		Returns [statusCode, statusMessage, response] where response is the
+		dictionary representing the response.
+		"""
+		try:
+			msgType, msg = self.__exchange(encodeJSONMessage(message), MSG_TYPE_JSON)
+			if msgType != MSG_TYPE_JSON:
+				raise VizError(VizError.BAD_PROTOCOL, "Expected a JSON response from SSM, got message type %d"%(msgType))
+			try:
+				response = decodeJSONMessage(msg)['response']
+				statusCode = int(response['status'])
+			except (ValueError, KeyError, TypeError), e:
+				raise VizError(VizError.BAD_PROTOCOL, "Incorrect JSON response from SSM. Reason %s\nReturned message:%s\n"%(str(e), msg))
+			statusMessage = response.get('message', "")
+		except VizError, e:
+			# The connection can't be used after this; the raised error
+			# tells the caller why
+			self.__endConnection()
+			raise
+
+		return [statusCode, statusMessage, response]
+
+	def submit(self, methodName, *args, **kwargs):
+		"""
+		Start a request without waiting for it to finish. methodName is the
+		name of a method of this class - e.g. "waitXState" - which is called
+		with the rest of the arguments. Returns a PendingRequest, which gives
+		you the result once the request is done.
+
+		Any number of requests may be pending on one connection. So, you can
+		wait for X servers with a long timeout, and deallocate or query
+		meanwhile, without connecting to the SSM again.
+		"""
+		if methodName.startswith('_') or (methodName == 'submit'):
+			raise ValueError, "Can't submit '%s'"%(methodName)
+		method = getattr(self, methodName, None)
+		if not callable(method):
+			raise ValueError, "ResourceAccess has no method named '%s'"%(methodName)
+		return PendingRequest(method, args, kwargs)
+
 	def attach(self, allocId):
 		"""
 		attach(allocId)
@@ -4377,6 +5791,12 @@ class ResourceAccess:
 		if allocId<0:
 			raise ValueError, "allocId needs to be positive"
 
+		if self.encoding == ENCODING_JSON:
+			statusCode, statusMessage, response = self.__sendAndRecvJSONMessage({'attach' : {'allocId' : allocId}})
+			if statusCode!=0:
+				raise VizError(VizError.USER_ERROR, statusMessage)
+			return self.__decodeJSONAllocation(response)
+
 		message = "<ssm><attach><allocId>%d</allocId></attach></ssm>"%(allocId)
 
 		statusCode, statusMessage, dom = self.__sendAndRecvMessage(message)
@@ -4412,25 +5832,117 @@ class ResourceAccess:
 		Each element of this list corresponds to the requirement in the same position in the reqResList.
 		On failure, a VizError exception is thrown.
 		"""
+		if self.sock is None:
+			raise VizError(VizError.NOT_CONNECTED, "Not connected to SSM")
+
+		appName = self.__getAppName(appName)
+		self.__checkAllocateRequest(reqResList, chooseNodeList)
+
+		if self.encoding == ENCODING_JSON:
+			message = {'allocate' : self.__allocateRequestToDict(reqResList, chooseNodeList, appName)}
+			statusCode, statusMessage, response = self.__sendAndRecvJSONMessage(message)
+			if statusCode!=0:
+				raise VizError(VizError.USER_ERROR, statusMessage)
+			return self.__decodeJSONAllocation(response)
+
+		message = "<ssm><allocate>%s</allocate></ssm>"%(self.__serializeAllocateRequest(reqResList, chooseNodeList, appName))
+
+		statusCode, statusMessage, dom = self.__sendAndRecvMessage(message)
+
+		if statusCode!=0:
+			raise VizError(VizError.USER_ERROR, statusMessage)
+
+		return self.__decodeAllocation(dom)
+
+	def allocateMany(self, listOfRequests, chooseNodeList=[], appName=None, allOrNothing=True):
+		"""
+		allocateMany(listOfRequests, chooseNodeList, appName, allOrNothing)
+
+		Make a number of independent allocations, in a single exchange with the SSM.
+		Each element of listOfRequests is a list of resource requirements, as
+		passed to allocate(). Resources are chosen from chooseNodeList, as in
+		allocate().
+
+		If allOrNothing is True, then either all the allocations are made, or none
+		are. A list of allocation objects is returned, one for each request. On
+		failure, a VizError exception is thrown.
+
+		If allOrNothing is False, then each request is allocated if possible. A list
+		is returned, with an allocation object for each request which succeeded,
+		and a VizError object for each which failed.
+		"""
+		if self.sock is None:
+			raise VizError(VizError.NOT_CONNECTED, "Not connected to SSM")
+
+		if not isinstance(listOfRequests, list) or (len(listOfRequests)==0):
+			raise ValueError, "You need to pass a non-empty list of allocation requests"
+
+		appName = self.__getAppName(appName)
+		for reqResList in listOfRequests:
+			self.__checkAllocateRequest(reqResList, chooseNodeList)
+
+		results = []
+		if self.encoding == ENCODING_JSON:
+			requests = map(lambda x: self.__allocateRequestToDict(x, chooseNodeList, appName), listOfRequests)
+			message = {'allocate_many' : {'allOrNothing' : allOrNothing, 'requests' : requests}}
+			statusCode, statusMessage, response = self.__sendAndRecvJSONMessage(message)
+			for result in response.get('results', []):
+				if result.get('status') != 0:
+					results.append(VizError(VizError.USER_ERROR, result.get('message', "")))
+				else:
+					results.append(self.__decodeJSONAllocation(result))
+		else:
+			message = "<ssm><allocate_many><allOrNothing>%d</allOrNothing>"%(allOrNothing)
+			for reqResList in listOfRequests:
+				message += "<request>%s</request>"%(self.__serializeAllocateRequest(reqResList, chooseNodeList, appName))
+			message += "</allocate_many></ssm>"
+			statusCode, statusMessage, dom = self.__sendAndRecvMessage(message)
+			responseNode = domutil.getChildNode(dom.documentElement, "response")
+			for resultNode in domutil.getChildNodes(responseNode, "result"):
+				resultStatus = int(domutil.getValue(domutil.getChildNode(resultNode, "status")))
+				if resultStatus != 0:
+					results.append(VizError(VizError.USER_ERROR, domutil.getValue(domutil.getChildNode(resultNode, "message"))))
+				else:
+					results.append(self.__decodeAllocation(resultNode))
+
+		if len(results) != len(listOfRequests):
+			# The SSM rejected the message as a whole
+			raise VizError(VizError.USER_ERROR, statusMessage)
+
+		if allOrNothing and (statusCode != 0):
+			failed = filter(lambda x: isinstance(results[x], VizError), range(len(results)))[0]
+			raise VizError(VizError.USER_ERROR, "Request %d failed : %s"%(failed, results[failed].message))
+
+		return results
+
+	def __getAppName(self, appName):
 		if appName is None:
 			appName = sys.argv[0]
 			# remove any path prefix
 			exeName = appName.rfind('/')
 			if exeName != -1:
 				appName = appName[exeName+1:]
-		if self.sock is None:
-			raise VizError(VizError.NOT_CONNECTED, "Not connected to SSM")
+		return appName
 
+	def __checkAllocateRequest(self, reqResList, chooseNodeList):
 		if not isinstance(chooseNodeList, list):
 			raise TypeError, "You need to pass a list for possible nodes to choose from"
-		nodeSpec = ""
 		for nodeName in chooseNodeList:
 			if not isinstance(nodeName, str):
 				raise TypeError, "Each item in the list of nodes must be a string"
-			else:
-				nodeSpec += "<search_node>%s</search_node>"%(nodeName)
 
-		message = """<ssm><allocate>"""
+		for req in reqResList:
+			if type(req) is list:
+				for req2 in req:
+					if isinstance(req2, VizResourceAggregate):
+						raise ValueError, "allocate() does not all VizResourceAggregate objects inside lists"
+					elif not isinstance(req2, VizResource):
+						raise ValueError, "allocate() accepts only aggregation of VizResource objects, or single VizResourceAggregate objects."
+			elif not isinstance(req, VizResource):
+				raise ValueError, "allocate() does not accept this object %s"%(repr(req))
+
+	def __serializeAllocateRequest(self, reqResList, chooseNodeList, appName):
+		message = ""
 		if appName is not None:
 			message += "<appName>%s</appName>"%(appName)
 		for req in reqResList:
@@ -4438,30 +5950,24 @@ class ResourceAccess:
 			if type(req) is list:
 				message = message + "<list>"
 				for req2 in req:
-					if isinstance(req2, VizResourceAggregate):
-						raise ValueError, "allocate() does not all VizResourceAggregate objects inside lists"
-					elif isinstance(req2, VizResource):
-						message = message + "%s"%(req2.serializeToXML())
-					else:
-						raise ValueError, "allocate() accepts only aggregation of VizResource objects, or single VizResourceAggregate objects."
+					message = message + "%s"%(req2.serializeToXML())
 				message = message + "</list>"
-			elif isinstance(req, VizResource):
-				message = message+ "%s"%(req.serializeToXML())
-			elif isinstance(req, VizResourceAggregate):
-				message = message+ "%s"%(req.serializeToXML())
 			else:
-				raise ValueError, "allocate() does not accept this object %s"%(repr(req))
+				message = message+ "%s"%(req.serializeToXML())
 			message = message+ "</resdesc>"
 
-		message += nodeSpec
-		message = message + "</allocate></ssm>"
-
-		statusCode, statusMessage, dom = self.__sendAndRecvMessage(message)
-
-		if statusCode!=0:
-			raise VizError(VizError.USER_ERROR, statusMessage)
+		for nodeName in chooseNodeList:
+			message += "<search_node>%s</search_node>"%(nodeName)
+		return message
 
-		return self.__decodeAllocation(dom)
+	def __allocateRequestToDict(self, reqResList, chooseNodeList, appName):
+		resdesc = []
+		for req in reqResList:
+			if type(req) is list:
+				resdesc.append(map(lambda x: x.toDict(), req))
+			else:
+				resdesc.append(req.toDict())
+		return {'appName' : appName, 'resdesc' : resdesc, 'search_node' : chooseNodeList}
 
 	def __decodeAllocation(self, dom):
 		# If we came here, then the allocation was successful
@@ -4487,18 +5993,37 @@ class ResourceAccess:
 						raise VizError(VizError.INTERNAL_ERROR, "Incorrect return XML from the SSM in decodeAllocation")
 					innerRes.append(decodedObj)
 			else:
-				decodedObj = deserializeVizResource(vc, [GPU, Server, SLI, Keyboard, Mouse, ResourceGroup, VizNode])
-				#
-				# Setup the X servers for ResourceGroups. The user can tweak
-				# things after the call to allocate
-				#
-				if isinstance(decodedObj, ResourceGroup):
-					# FIXME: If something fails here, then do we know who is to blame. The caller !?
-					decodedObj.setupXServers(self)
-				innerRes = decodedObj
+				innerRes = deserializeVizResource(vc, [GPU, Server, SLI, Keyboard, Mouse, ResourceGroup, VizNode])
 			allocRes.append(innerRes)
 
 		allocId = int(domutil.getValue(dom.getElementsByTagName("allocId")[0]))
+		return self.__createAllocation(allocId, allocRes)
+
+	def __decodeJSONAllocation(self, response):
+		allocRes = []
+		try:
+			for value in response['allocation']:
+				if isinstance(value, list):
+					innerRes = map(lambda x: deserializeVizResourceFromDict(x, [GPU, SLI, Server, Keyboard, Mouse]), value)
+				else:
+					innerRes = deserializeVizResourceFromDict(value, [GPU, Server, SLI, Keyboard, Mouse, ResourceGroup, VizNode])
+				allocRes.append(innerRes)
+			allocId = int(response['allocId'])
+		except (KeyError, TypeError, ValueError), e:
+			raise VizError(VizError.INTERNAL_ERROR, "Incorrect return message from the SSM in decodeAllocation. Reason: %s"%(str(e)))
+
+		return self.__createAllocation(allocId, allocRes)
+
+	def __createAllocation(self, allocId, allocRes):
+		#
+		# Setup the X servers for ResourceGroups. The user can tweak
+		# things after the call to allocate
+		#
+		for res in allocRes:
+			if isinstance(res, ResourceGroup):
+				# FIXME: If something fails here, then do we know who is to blame. The caller !?
+				res.setupXServers(self)
+
 		allocObj = Allocation(allocId, allocRes)
 
 		# Set validation information on the created GPUs.
@@ -4516,6 +6041,25 @@ class ResourceAccess:
 		"""
 		if self.sock is None:
 			raise VizError(VizError.NOT_CONNECTED, "Not connected to SSM")
+
+		if self.encoding == ENCODING_JSON:
+			query = {}
+			if allocId is not None:
+				query['allocId'] = allocId
+			statusCode, statusMessage, response = self.__sendAndRecvJSONMessage({'query_allocation' : query})
+			if statusCode!=0:
+				raise VizError(VizError.USER_ERROR, statusMessage)
+			returnedMatches = []
+			for alloc in response['return_value']:
+				returnedMatches.append({
+					'allocId' : alloc['allocId'],
+					'user' : alloc['userName'],
+					'resources' : map(deserializeVizResourceFromDict, alloc['resources']),
+					'startTime' : alloc['startTime'],
+					'appName' : alloc['appName']
+				})
+			return returnedMatches
+
 		if allocId is None:
 			allocStr = ""
 		else:
@@ -4564,12 +6108,21 @@ class ResourceAccess:
 		"""
 		if self.sock is None:
 			raise VizError(VizError.NOT_CONNECTED, "Not connected to SSM")
+		if (what is not None) and (not isinstance(what, VizResource)):
+			raise TypeError, "Expecting a VizResource"
+
+		if self.encoding == ENCODING_JSON:
+			query = {}
+			if what is not None:
+				query['resource'] = what.toDict()
+			statusCode, statusMessage, response = self.__sendAndRecvJSONMessage({'query_resource' : query})
+			if statusCode!=0:
+				raise VizError(VizError.USER_ERROR, statusMessage)
+			return map(lambda x: deserializeVizResourceFromDict(x, [GPU, Server, SLI, Keyboard, Mouse, ResourceGroup, VizNode]), response['return_value'])
+
 		query = ""
 		if what is not None:
-			if not isinstance(what, VizResource):
-				raise TypeError, "Expecting a VizResource"
-			else:
-				query = what.serializeToXML()
+			query = what.serializeToXML()
 		message = """
 		<ssm>
 			<query_resource>%s</query_resource>
@@ -4597,6 +6150,12 @@ class ResourceAccess:
 		if not isinstance(searchServer,Server):
 			raise ValueError, "I expect the searchServer to be a Server"
 
+		if self.encoding == ENCODING_JSON:
+			statusCode, statusMessage, response = self.__sendAndRecvJSONMessage({'get_serverconfig' : {'server' : searchServer.toDict()}})
+			if statusCode!=0:
+				raise VizError(VizError.USER_ERROR, statusMessage)
+			return deserializeVizResourceFromDict(response['return_value'], [Server])
+
 		message = """
 		<ssm>
 			<get_serverconfig>
@@ -4625,6 +6184,18 @@ class ResourceAccess:
 			searchExpr = searchOb.serializeToXML()
 		else:
 			raise ValueError, "Expected GPU or DisplayDevice or None as search object"
+
+		if self.encoding == ENCODING_JSON:
+			query = {}
+			if searchOb is not None:
+				query['template'] = searchOb.toDict()
+			statusCode, statusMessage, response = self.__sendAndRecvJSONMessage({'get_templates' : query})
+			if statusCode!=0:
+				raise VizError(VizError.USER_ERROR, statusMessage)
+			try:
+				return map(lambda x: deserializeVizResourceFromDict(x, [GPU, DisplayDevice, Keyboard, Mouse]), response['return_value'])
+			except ValueError, e:
+				raise VizError(VizError.INTERNAL_ERROR, "Incorrect return message from the SSM during getTemplates")
 		
 		message = "<ssm><get_templates>%s</get_templates></ssm>"%(searchExpr)
 
@@ -4758,6 +6329,46 @@ class ResourceAccess:
 		# Success !
 		return
 
+	def watchXState(self, allocObj, serverList=None):
+		"""
+		Watch the specified X servers of an allocation (all of them, if
+		serverList is None) go up and down. Returns an XStateWatch object.
+
+		Unlike waitXState, this lets you use each X server as soon as it's
+		ready, instead of waiting for the slowest one.
+		"""
+		if self.sock is None:
+			raise VizError(VizError.NOT_CONNECTED, "Not connected to SSM")
+		if not isinstance(allocObj, Allocation):
+			raise ValueError, "You need to pass an Allocation object to watch"
+
+		watchServers = ""
+		if serverList is not None:
+			if type(serverList) is not list:
+				raise ValueError, "I expect serverList to be a list"
+			for s in serverList:
+				if not isinstance(s,Server):
+					raise ValueError, "All elements of serverList need to be objects of class Server"
+				watchServers = watchServers + s.serializeToXML()
+		message = """
+		<ssm>
+			<watch_x_state>
+				<allocId>%d</allocId>
+				%s
+			</watch_x_state>
+		</ssm>
+		"""%(allocObj.getId(), watchServers)
+
+		# Notifications arrive on the connection whenever X servers change
+		# state, so the watch gets a connection of its own
+		watchRA = ResourceAccess(cleanupOnDisconnect=False, frameVersion=self.__askedFrameVersion)
+		statusCode, statusMessage, dom = watchRA.__sendAndRecvMessage(message)
+		if statusCode!=0:
+			watchRA.stop()
+			raise VizError(VizError.USER_ERROR, statusMessage)
+
+		return XStateWatch(watchRA, allocObj)
+
 	def stopXServers(self, allocObj, serverList=None):
 		if self.sock is None:
 			raise VizError(VizError.NOT_CONNECTED, "Not connected to SSM")
@@ -4812,6 +6423,40 @@ class ResourceAccess:
 		# Success !
 		return
 
+	def deallocateMany(self, allocations):
+		"""
+		Free up a number of allocations, in a single exchange with the SSM. You may
+		pass in allocation objects, or allocation IDs. Every allocation is freed
+		if possible. If any can't be freed, then a VizError exception is thrown
+		after the rest are.
+		"""
+		if self.sock is None:
+			raise VizError(VizError.NOT_CONNECTED, "Not connected to SSM")
+		message = "<ssm><deallocate_many>"
+		for allocation in allocations:
+			if isinstance(allocation, Allocation):
+				resId = allocation.getId()
+			elif isinstance(allocation, int):
+				resId = allocation
+			else:
+				raise TypeError, "You need to pass Allocation objects or allocation IDs to deallocateMany"
+			message += "<allocId>%d</allocId>"%(resId)
+		message += "</deallocate_many></ssm>"
+
+		statusCode, statusMessage, dom = self.__sendAndRecvMessage(message)
+		if statusCode!=0:
+			failures = []
+			responseNode = domutil.getChildNode(dom.documentElement, "response")
+			for resultNode in domutil.getChildNodes(responseNode, "result"):
+				if int(domutil.getValue(domutil.getChildNode(resultNode, "status"))) != 0:
+					failures.append(domutil.getValue(domutil.getChildNode(resultNode, "message")))
+			if len(failures)>0:
+				statusMessage += " : " + string.join(failures, "; ")
+			raise VizError(VizError.USER_ERROR, statusMessage)
+
+		# Success !
+		return
+
 	def refreshResourceGroups(self):
 		"""
 		This is an administrative message. Will succeed only root sends it.
@@ -4831,6 +6476,88 @@ class ResourceAccess:
 		# Success !
 		return
 
+	def refreshSchedulerState(self):
+		"""
+		This is an administrative message. Will succeed only root sends it.
+
+		The SSM caches the state of the nodes as reported by the scheduler
+		(e.g. which SLURM nodes are down or drained). Sending this message
+		makes the SSM discard that, so the next allocation sees the current
+		state. Use this after draining or resuming nodes.
+		"""
+		if self.sock is None:
+			raise VizError(VizError.NOT_CONNECTED, "Not connected to SSM")
+
+		message = "<ssm><refresh_scheduler_state /></ssm>"
+
+		statusCode, statusMessage, dom = self.__sendAndRecvMessage(message)
+		if statusCode!=0:
+			raise VizError(VizError.ACCESS_DENIED, statusMessage)
+
+		# Success !
+		return
+
+	def getMessageLog(self, count=None):
+		"""
+		This is an administrative message. Will succeed only root sends it.
+
+		Returns summaries of the last few messages the SSM got from clients,
+		oldest first. If count is given, only the last count summaries are
+		returned; the whole log may be too large to receive over a connection
+		using version 1 frames. Each summary is a dictionary with the keys time, latency
+		(seconds taken to process the message), uid, request, requestId,
+		requestSize and responseSize. request is None if the message wasn't
+		understood, and responseSize is None if the response was deferred.
+		"""
+		if self.sock is None:
+			raise VizError(VizError.NOT_CONNECTED, "Not connected to SSM")
+
+		if count is None:
+			message = "<ssm><get_message_log /></ssm>"
+		else:
+			message = "<ssm><get_message_log><count>%d</count></get_message_log></ssm>"%(count)
+
+		statusCode, statusMessage, dom = self.__sendAndRecvMessage(message)
+		if statusCode!=0:
+			raise VizError(VizError.ACCESS_DENIED, statusMessage)
+
+		converters = { 'time' : float, 'latency' : float, 'uid' : int, 'request' : str, 'requestId' : int, 'requestSize' : int, 'responseSize' : int }
+		entries = []
+		responseNode = domutil.getChildNode(dom.documentElement, "response")
+		for entryNode in domutil.getChildNodes(responseNode, "entry"):
+			entry = {}
+			for name in converters:
+				node = domutil.getChildNode(entryNode, name)
+				if node is None:
+					entry[name] = None
+				else:
+					entry[name] = converters[name](domutil.getValue(node))
+			entries.append(entry)
+		return entries
+
+	def getMetrics(self):
+		"""
+		This is an administrative message. Will succeed only root sends it.
+
+		Returns the SSM's metrics as text, in the Prometheus text exposition
+		format : counts and latency histograms of the messages the SSM got,
+		of the scheduler commands it ran, and of the iterations of its main
+		loop, along with the number of clients, X servers, pending waits,
+		allocations, and of the free and busy resources on each node.
+		"""
+		if self.sock is None:
+			raise VizError(VizError.NOT_CONNECTED, "Not connected to SSM")
+
+		statusCode, statusMessage, dom = self.__sendAndRecvMessage("<ssm><get_metrics /></ssm>")
+		if statusCode!=0:
+			raise VizError(VizError.ACCESS_DENIED, statusMessage)
+
+		responseNode = domutil.getChildNode(dom.documentElement, "response")
+		valueNode = domutil.getChildNode(responseNode, "return_value")
+		if valueNode is None:
+			return ""
+		return domutil.getValue(valueNode)
+
 class VizNode(VizResourceAggregate):
 	rootNodeName = "node"
 	ALL_PROPERTIES = ['remote_hostname', 'fast_network']
@@ -4972,6 +6699,40 @@ class VizNode(VizResourceAggregate):
 				newResource = deserializeVizResource(xmlNode)
 				self.addResource(newResource)
 
+	def toDict(self, detailedConfig=True, addrOnly=False):
+		ret = { 'class' : VizNode.rootNodeName }
+		if self.resIndex is not None:
+			ret['index'] = self.resIndex
+		if self.hostName is not None:
+			ret['hostname'] = self.hostName
+		if self.resType is not None:
+			ret['model'] = self.resType
+		if self.allocationBias is not None:
+			ret['weight'] = self.allocationBias
+		if len(self.properties)>0:
+			ret['properties'] = copy.copy(self.properties)
+		# We serialize in a particular order
+		resources = self.getGPUs() + self.getKeyboards() + self.getMice() + self.getServers() + self.getSLIs()
+		ret['resources'] = map(lambda x: x.toDict(), resources)
+		return ret
+
+	def fromDict(self, d):
+		self.__clearAll()
+		if d.get('class') != VizNode.rootNodeName:
+			raise ValueError, "Failed to deserialize VizNode. Class=%s, expected %s!"%(d.get('class'), VizNode.rootNodeName)
+
+		if d.get('index') is not None:
+			self.resIndex = int(d['index'])
+		if d.get('weight') is not None:
+			self.allocationBias = int(d['weight'])
+		self.hostName = d.get('hostname')
+		self.resType = d.get('model')
+		properties = d.get('properties', {})
+		for propName in properties:
+			self.setProperty(propName, properties[propName])
+		for resDict in d.get('resources', []):
+			self.addResource(deserializeVizResourceFromDict(resDict))
+
 def sanitisedEnv():
 	"""
 	Return a modified environment. Currently, this ensures that
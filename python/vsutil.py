@@ -30,6 +30,14 @@ import domutil
 import copy
 import metascheduler
 import string
+import cPickle
+
+# hashlib is present in Python 2.5 onwards. The sha module computes the
+# same digest on older Pythons.
+try:
+	from hashlib import sha1
+except ImportError:
+	from sha import new as sha1
 
 def isFrameLockAvailable(resList):
 	"""
@@ -50,12 +58,17 @@ def isFrameLockAvailable(resList):
 		return False
 	return True
 
-def disableFrameLock(resList):
+def disableFrameLock(resList, timings=None):
 	"""
 	Disables Frame Lock. The list of X servers to enable frame-lock on is extracted from the input list.
 	The input list could contain Servers or VizResourceAggregate objects.
+
+	If timings is a list, then [step, seconds] is appended to it as each step
+	is done.
 	"""
+	stepStart = time.time()
 	flChain = __getFrameLockChain(resList)
+	stepStart = __endFrameLockStep(timings, 'query', stepStart)
 	# 0. Ensure that all GPUs are connected to framelock devices
 	nonFrameLockGPUs = 0
 	for member in flChain:
@@ -63,7 +76,7 @@ def disableFrameLock(resList):
 		if gpuDetails['FrameLockDeviceConnected']!=True:
 			nonFrameLockGPUs += 1
 	if nonFrameLockGPUs>0:
-		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "%d GPUs out of %d GPUs are not connected to the frame lock device. Frame lock requires all GPUs to be connected to G-Sync cards. Perhaps you passed a wrong list?"%(len(flChain)-enableCount, len(flChain)))
+		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "%d GPUs out of %d GPUs are not connected to the frame lock device. Frame lock requires all GPUs to be connected to G-Sync cards. Perhaps you passed a wrong list?"%(nonFrameLockGPUs, len(flChain)))
 	
 	# 1. Ensure that framelock is already active on all GPUs
 	enableCount = 0
@@ -94,23 +107,30 @@ def disableFrameLock(resList):
 		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "Frame lock master refresh rate is %s Hz. %d output ports have a different refresh rate %s Hz. Perhaps you have included two or more framelock chains in the input?"%(masterRefreshRate, numBadPorts, badRRList))
 
 	# 3. Disable frame lock on all GPUs
+	assignments = []
 	for member in flChain:
 		server = member['server']
 		screen = member['screen']
 		gpu_index = member['gpu_index']
-		__set_nvidia_settings(server, '[gpu:%d]/FrameLockEnable'%(gpu_index), '0')
+		assignments.append([server, '[gpu:%d]/FrameLockEnable'%(gpu_index), '0'])
+	__set_nvidia_settings(assignments)
+	stepStart = __endFrameLockStep(timings, 'disable', stepStart)
 
 	# 4. Reset master/slave too...
+	assignments = []
 	for member in flChain:
 		server = member['server']
 		screen = member['screen']
 		gpu_index = member['gpu_index']
-		__set_nvidia_settings(server, '[gpu:%d]/FrameLockMaster'%(gpu_index), '0x00000000')
-		__set_nvidia_settings(server, '[gpu:%d]/FrameLockSlaves'%(gpu_index), '0x00000000')
+		assignments.append([server, '[gpu:%d]/FrameLockMaster'%(gpu_index), '0x00000000'])
+		assignments.append([server, '[gpu:%d]/FrameLockSlaves'%(gpu_index), '0x00000000'])
+	__set_nvidia_settings(assignments)
+	stepStart = __endFrameLockStep(timings, 'reset', stepStart)
 
 	# Next check if framelock actually got disabled.
 	# Check FrameLockSyncRate on all GPUs.
 	flChain = __getFrameLockChain(resList)
+	stepStart = __endFrameLockStep(timings, 'verify', stepStart)
 
 	masterFLSR = None
 	badFLSRList = []
@@ -122,21 +142,26 @@ def disableFrameLock(resList):
 			masterFLSR = thisFLSR
 		elif thisFLSR != masterFLSR:
 			numBadGPUs += 1
-			if thisFLSR not in badFLSR:
-				badFLSR.append(thisFLSR)
+			if thisFLSR not in badFLSRList:
+				badFLSRList.append(thisFLSR)
 
 	if (masterFLSR!='0') or (numBadGPUs>0):	
 		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "Unable to disable lock due to unknown reasons.")
 	#pprint(flChain)
 	return "Disabled Frame Lock @ %s Hz on %d GPUs connected to %d display devices."%(masterRefreshRate, len(flChain), totalPorts)
 
-def enableFrameLock(resList):
+def enableFrameLock(resList, timings=None):
 	"""
 	Enable Frame Lock. The list of X servers to enable frame-lock on is extracted from the input list. Frame Lock should not be in an enabled state on any of the servers.
 	The input list may contain Servers or VizResourceAggregate objects.
+
+	If timings is a list, then [step, seconds] is appended to it as each step
+	is done.
 	"""
 
+	stepStart = time.time()
 	flChain = __getFrameLockChain(resList)
+	stepStart = __endFrameLockStep(timings, 'query', stepStart)
 
 	# Next do sanity checks
 
@@ -147,7 +172,7 @@ def enableFrameLock(resList):
 		if gpuDetails['FrameLockDeviceConnected']!=True:
 			nonFrameLockGPUs += 1
 	if nonFrameLockGPUs>0:
-		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "%d GPUs out of %d GPUs are not connected to the frame lock device. Frame lock requires all GPUs to be connected to G-Sync cards."%(len(flChain)-enableCount, len(flChain)))
+		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "%d GPUs out of %d GPUs are not connected to the frame lock device. Frame lock requires all GPUs to be connected to G-Sync cards."%(nonFrameLockGPUs, len(flChain)))
 
 	# 1. Ensure that framelock is not already active
 	enableCount = 0
@@ -206,6 +231,9 @@ def enableFrameLock(resList):
 	# 2. Setup all displays on all other other GPUs as slave
 	# 3. Enable frame lock on all GPUs
 	# 4. Toggle test signal on master
+	#
+	# Each step is done on all the X servers at the same time, but a step
+	# starts only after the one before it is done on all of them.
 
 	# 1. Setup the first available display on first GPU as master. If there are another other displays on the first GPU, set them up as slaves
 	masterServer = flChain[0]['server']
@@ -213,15 +241,19 @@ def enableFrameLock(resList):
 	masterGPUIndex = flChain[0]['gpu_index']
 	masterGPUDetails = flChain[0]['gpu_details']
 	isMaster = True
-	for portIndex in gpuDetails['ports']:
-		portMask = __encodeDisplay(gpuDetails['ports'][portIndex]['type'], portIndex)
+	assignments = []
+	for portIndex in masterGPUDetails['ports']:
+		portMask = __encodeDisplay(masterGPUDetails['ports'][portIndex]['type'], portIndex)
 		if isMaster:
-			__set_nvidia_settings(masterServer, '[gpu:%d]/FrameLockMaster'%(masterGPUIndex), '0x%08x'%(portMask))
+			assignments.append([masterServer, '[gpu:%d]/FrameLockMaster'%(masterGPUIndex), '0x%08x'%(portMask)])
 		else:
-			__set_nvidia_settings(masterServer, '[gpu:%d]/FrameLockSlaves'%(masterGPUIndex), '0x%08x'%(portMask))
+			assignments.append([masterServer, '[gpu:%d]/FrameLockSlaves'%(masterGPUIndex), '0x%08x'%(portMask)])
 		isMaster = False
+	__set_nvidia_settings(assignments)
+	stepStart = __endFrameLockStep(timings, 'master', stepStart)
 
 	# 2. Setup all displays on all other other GPUs as slave
+	assignments = []
 	for member in flChain[1:]:
 		slaveServer = member['server']
 		slaveScreen = member['screen']
@@ -230,15 +262,20 @@ def enableFrameLock(resList):
 		portMask = 0
 		for portIndex in slaveGPUDetails['ports']:
 			portMask = portMask | __encodeDisplay(slaveGPUDetails['ports'][portIndex]['type'], portIndex)
-		__set_nvidia_settings(slaveServer, '[gpu:%d]/FrameLockSlaves'%(slaveGPUIndex), '0x%08x'%(portMask))
-		__set_nvidia_settings(slaveServer, '[gpu:%d]/FrameLockMaster'%(slaveGPUIndex), '0x00000000')
-	
+		assignments.append([slaveServer, '[gpu:%d]/FrameLockSlaves'%(slaveGPUIndex), '0x%08x'%(portMask)])
+		assignments.append([slaveServer, '[gpu:%d]/FrameLockMaster'%(slaveGPUIndex), '0x00000000'])
+	__set_nvidia_settings(assignments)
+	stepStart = __endFrameLockStep(timings, 'slaves', stepStart)
+
 	# 3. Enable frame lock on all GPUs
+	assignments = []
 	for member in flChain:
 		server = member['server']
 		screen = member['screen']
 		gpu_index = member['gpu_index']
-		__set_nvidia_settings(server, '[gpu:%d]/FrameLockEnable'%(gpu_index), '1')
+		assignments.append([server, '[gpu:%d]/FrameLockEnable'%(gpu_index), '1'])
+	__set_nvidia_settings(assignments)
+	stepStart = __endFrameLockStep(timings, 'enable', stepStart)
 
 	# 4. Toggle test signal on master
 
@@ -249,17 +286,21 @@ def enableFrameLock(resList):
 	# there will be no problems.
 	sched = masterServer.getSchedulable()
 	p = sched.run(["/usr/bin/env","DISPLAY=%s"%(masterServer.getDISPLAY()),"metacity"], outFile=open("/dev/null","w"), errFile=open("/dev/null","w"))
-	time.sleep(2)
+	__waitForWindowManager(masterServer, WINDOW_MANAGER_TIMEOUT)
+	stepStart = __endFrameLockStep(timings, 'window_manager', stepStart)
 
-	__set_nvidia_settings(masterServer, '[gpu:%d]/FrameLockTestSignal'%(masterGPUIndex), '1')
-	__set_nvidia_settings(masterServer, '[gpu:%d]/FrameLockTestSignal'%(masterGPUIndex), '0')
+	__set_nvidia_settings([
+		[masterServer, '[gpu:%d]/FrameLockTestSignal'%(masterGPUIndex), '1'],
+		[masterServer, '[gpu:%d]/FrameLockTestSignal'%(masterGPUIndex), '0']])
 
 	# Kill window manager
 	p.kill()
+	stepStart = __endFrameLockStep(timings, 'test_signal', stepStart)
 
 	# Next check if framelock actually got enabled.
 	# Check FrameLockSyncRate on all GPUs.
 	flChain = __getFrameLockChain(resList)
+	stepStart = __endFrameLockStep(timings, 'verify', stepStart)
 
 	masterFLSR = None
 	badFLSRList = []
@@ -291,6 +332,38 @@ g_dfp2 = 0x00010000 # 0x00020000 - DFP-2
 # Logically ORing gives port combinations
 # so -- 0x00000003 = CRT-0 and CRT-1 both connected
 
+# Longest time to wait for the window manager to come up before toggling
+# the test signal. Frame lock is tried anyway if it does not.
+WINDOW_MANAGER_TIMEOUT = 2
+
+def __endFrameLockStep(timings, stepName, stepStart):
+	"""
+	Record the time taken by a step of enabling/disabling frame lock, if
+	timings are wanted. Returns the start time of the next step.
+	"""
+	now = time.time()
+	if timings is not None:
+		timings.append([stepName, now-stepStart])
+	return now
+
+def __waitForWindowManager(srv, timeout):
+	"""
+	Wait till a window manager is running on the X server srv, or till timeout
+	seconds have passed. A running window manager sets _NET_SUPPORTING_WM_CHECK
+	on the root window. Returns True if one is running.
+	"""
+	sched = srv.getSchedulable()
+	endTime = time.time() + timeout
+	while True:
+		p = sched.run(["/usr/bin/env", "xprop", "-display", srv.getDISPLAY(), "-root", "_NET_SUPPORTING_WM_CHECK"], outFile=subprocess.PIPE, errFile=open("/dev/null","w"))
+		p.wait()
+		output = p.getStdOut()
+		if (output is not None) and ('window id' in output):
+			return True
+		if time.time() >= endTime:
+			return False
+		time.sleep(0.1)
+
 def __decodeMonitorMask(mask):
 	result = {}
 	if mask & g_crt2: result[0]={'type':'analog', 'name':'CRT-0'}
@@ -315,84 +388,146 @@ def __encodeDisplay(displayType, port):
 	#else:
 	raise "Invalid display type"
 
-def __set_nvidia_settings(xServer, prop,val):
-	sched = xServer.getSchedulable()
-	cmd = ['/usr/bin/nvidia-settings', '--display=%s'%(xServer.getDISPLAY()), '-a', '%s=%s'%(prop,val)]
-	#print cmd
-	p = sched.run(cmd, outFile=subprocess.PIPE, errFile=subprocess.PIPE)
-	p.wait()
-	return p.getExitCode()
+# nvidia-settings is run on the node of each X server, using its scheduler
+NVIDIA_SETTINGS = '/usr/bin/nvidia-settings'
+
+# We don't know which display devices are enabled on a GPU till nvidia-settings
+# tells us. So we ask for the refresh rate on every port __decodeMonitorMask
+# knows about, along with everything else.
+g_port_names = ['CRT-0', 'DFP-0', 'CRT-1', 'DFP-1']
+
+#
+# Each answer to a query is printed like
+#  Attribute 'FrameLockAvailable' (host:0[gpu:0]): 1.
+#  Attribute 'RefreshRate3' (host:0[gpu:0]; display device: DFP-0): 60.000 Hz.
+#  Attribute 'FrameLockSyncRate' (host:0.0): 60000.
+# The target names the GPU for GPU attributes, and the display device for
+# display device attributes. Queries which fail print an error instead.
+#
+nvs_attribute_re = re.compile("^[\s]*Attribute '([A-Za-z0-9]+)' \((.*)\): (.*)$")
+nvs_gpu_re = re.compile("\[gpu:([0-9]+)\]")
+nvs_display_re = re.compile("((CRT|DFP|TV)-[0-9]+)")
+
+def parseNVSettingsOutput(output):
+	"""
+	Parse the output of 'nvidia-settings -q'. Returns a dictionary mapping
+	(attribute name, GPU index, display device) to the value printed. The GPU
+	index is None for attributes which weren't queried on a GPU, and the
+	display device is None for attributes which weren't queried on a display
+	device.
+	"""
+	values = {}
+	for line in output.split('\n'):
+		mobj = nvs_attribute_re.match(line)
+		if mobj is None:
+			continue
+		attrName, target, value = mobj.groups()
+		gpuIndex = None
+		gpuMatch = nvs_gpu_re.search(target)
+		if gpuMatch is not None:
+			gpuIndex = int(gpuMatch.groups()[0])
+		displayName = None
+		displayMatch = nvs_display_re.search(target)
+		if displayMatch is not None:
+			displayName = displayMatch.groups()[0]
+		values[(attrName, gpuIndex, displayName)] = value.rstrip()
+	return values
+
+def __runNVSettings(requests):
+	"""
+	Run nvidia-settings for the X servers in requests, a list of [server, args].
+	All the X servers are handled at the same time. Returns the output of each,
+	in the same order.
+	"""
+	procs = []
+	for srv, args in requests:
+		sched = srv.getSchedulable()
+		cmd = [NVIDIA_SETTINGS, "--ctrl-display=%s"%(srv.getDISPLAY()), "--display=%s"%(srv.getDISPLAY())] + args
+		procs.append(sched.run(cmd, outFile=subprocess.PIPE, errFile=subprocess.PIPE))
+	outputs = []
+	for p in procs:
+		p.wait()
+		outputs.append(p.getStdOut())
+	return outputs
+
+def __set_nvidia_settings(assignments):
+	"""
+	Set nvidia-settings attributes. assignments is a list of [server, attribute,
+	value]. Each X server is handled by a single nvidia-settings, which sets its
+	attributes in the order given.
+	"""
+	requests = []
+	serverArgs = {}
+	for xServer, prop, val in assignments:
+		srvKey = xServer.hashKey()
+		if not serverArgs.has_key(srvKey):
+			serverArgs[srvKey] = []
+			requests.append([xServer, serverArgs[srvKey]])
+		serverArgs[srvKey] += ['-a', '%s=%s'%(prop,val)]
+	__runNVSettings(requests)
+
+def __getNVSetting(values, attrName, gpuIndex, displayName, valueRE, srv):
+	try:
+		mobj = re.match(valueRE, values[(attrName, gpuIndex, displayName)])
+	except KeyError, e:
+		mobj = None
+	if mobj is None:
+		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "Failed to get '%s' from nvidia-settings for GPU %s on %s"%(attrName, gpuIndex, srv.hashKey()))
+	return mobj.groups()[0]
 
-def __getGPUDetails(srv, scr, gpuIndex):
+def __getGPUDetails(values, srv, gpuIndex):
+	"""
+	Returns the details of a GPU, from the parsed output of the queries
+	__getFrameLockQueries asked for.
+	"""
 	gpuInfo = {}
-	sched = srv.getSchedulable()
-	cmd = ["/usr/bin/nvidia-settings","--ctrl-display=%s"%(srv.getDISPLAY()), "--display=%s"%(srv.getDISPLAY()), "-q", "[gpu:%d]/EnabledDisplays"%(gpuIndex)]
-	#print cmd
-	p = sched.run(cmd, outFile=subprocess.PIPE)
-	p.wait()
-	content =  p.getStdOut().split('\n')
-	reobj = re.compile('^Attribute .*: (0x[0-9a-f]+).*$')
-	l=content[1].rstrip().lstrip()
-	#print l
-	mobj=reobj.match(l)
-	outputPortInfo = __decodeMonitorMask(int(mobj.groups(0)[0],16))
+	outputPortInfo = __decodeMonitorMask(int(__getNVSetting(values, 'EnabledDisplays', gpuIndex, None, '^(0x[0-9a-f]+)', srv), 16))
 	for portNum in outputPortInfo:
-		cmd = ["/usr/bin/nvidia-settings", "--ctrl-display=%s"%(srv.getDISPLAY()),"--display=%s"%(srv.getDISPLAY()),"-q","[gpu:%d]/RefreshRate3[%s]"%(gpuIndex, outputPortInfo[portNum]['name'])]
-		p = sched.run(cmd, outFile=subprocess.PIPE)
-		p.wait()
-		content =  p.getStdOut().split('\n')
-		reobj = re.compile("^Attribute 'RefreshRate3' \(.*\): ([0-9\.]+).*$")
-		l=content[1].rstrip().lstrip()
-		mobj=reobj.match(l)
-		outputPortInfo[portNum]['RefreshRate']=mobj.groups(0)[0]
+		outputPortInfo[portNum]['RefreshRate'] = __getNVSetting(values, 'RefreshRate3', gpuIndex, outputPortInfo[portNum]['name'], '^([0-9\.]+)', srv)
 	gpuInfo['ports']=outputPortInfo
 
-	cmd = ["/usr/bin/nvidia-settings","--ctrl-display=%s"%(srv.getDISPLAY()), "--display=%s"%(srv.getDISPLAY()), "-q", "[gpu:%d]/FrameLockAvailable"%(gpuIndex)]
-	p = sched.run(cmd, outFile=subprocess.PIPE)
-	p.wait()
-	content =  p.getStdOut().split('\n')
-	reobj = re.compile("^Attribute 'FrameLockAvailable' \(.*\): ([0-9\.]+)\..*$")
-	l=content[1].rstrip().lstrip()
-	mobj=reobj.match(l)
-	if mobj is None:
+	try:
+		gpuInfo['FrameLockAvailable'] = __getNVSetting(values, 'FrameLockAvailable', gpuIndex, None, '^([0-9\.]+)\.', srv)
+	except vsapi.VizError, e:
 		gpuInfo['FrameLockDeviceConnected']=False
 		return gpuInfo
-	else:
-		gpuInfo['FrameLockDeviceConnected']=True
-
-	gpuInfo['FrameLockAvailable']=mobj.groups(0)[0]
-
-	cmd = ["/usr/bin/nvidia-settings","--ctrl-display=%s"%(srv.getDISPLAY()),"--display=%s"%(srv.getDISPLAY()), "-q", "FrameLockSyncRate"]
-	p = sched.run(cmd, outFile=subprocess.PIPE)
-	p.wait()
-	content =  p.getStdOut().split('\n')
-	reobj = re.compile("^Attribute 'FrameLockSyncRate' \(.*\): ([0-9\.]+)\..*$")
-	l=content[1].rstrip().lstrip()
-	mobj=reobj.match(l)
-	gpuInfo['FrameLockSyncRate']=mobj.groups(0)[0]
-
-	cmd = ["/usr/bin/nvidia-settings", "--ctrl-display=%s"%(srv.getDISPLAY()), "--display=%s"%(srv.getDISPLAY()), "-q", "[gpu:%d]/FrameLockEnable"%(gpuIndex)]
-	p = sched.run(cmd, outFile=subprocess.PIPE)
-	p.wait()
-	content =  p.getStdOut().split('\n')
-	reobj = re.compile("^Attribute 'FrameLockEnable' \(.*\): ([0-9\.]+)\..*$")
-	l=content[1].rstrip().lstrip()
-	mobj=reobj.match(l)
-	gpuInfo['FrameLockEnable']=bool(int(mobj.groups(0)[0]))
+	gpuInfo['FrameLockDeviceConnected']=True
+
+	# The sync rate is asked for on the X screen, not the GPU
+	gpuInfo['FrameLockSyncRate'] = __getNVSetting(values, 'FrameLockSyncRate', None, None, '^([0-9\.]+)\.', srv)
+	gpuInfo['FrameLockEnable'] = bool(int(__getNVSetting(values, 'FrameLockEnable', gpuIndex, None, '^([0-9\.]+)\.', srv)))
 	return gpuInfo
 
+def __getFrameLockQueries(numGPUs):
+	args = ['-q', 'FrameLockSyncRate']
+	for gpuIndex in range(numGPUs):
+		for attrName in ['EnabledDisplays', 'FrameLockAvailable', 'FrameLockEnable']:
+			args += ['-q', '[gpu:%d]/%s'%(gpuIndex, attrName)]
+		for portName in g_port_names:
+			args += ['-q', '[gpu:%d]/RefreshRate3[%s]'%(gpuIndex, portName)]
+	return args
+
 def __getFrameLockChain(resList):
 	allServers = vsapi.extractObjects(vsapi.Server, resList)
-	flChain = []
 
-	# Create a frame lock chain consisting of all GPUs
+	# Each X server is asked about all its GPUs at once, and all X servers
+	# are asked at the same time
+	requests = []
 	for srv in allServers:
-		sched = srv.getSchedulable()
+		numGPUs = 0
+		for srvScreen in srv.getScreens():
+			numGPUs += len(srvScreen.getGPUs())
+		requests.append([srv, __getFrameLockQueries(numGPUs)])
+	outputs = __runNVSettings(requests)
+
+	# Create a frame lock chain consisting of all GPUs
+	flChain = []
+	for srv, output in zip(allServers, outputs):
+		values = parseNVSettingsOutput(output)
 		baseGPUIndex = 0
-		gpuDetails = []
 		for srvScreen in srv.getScreens():
 			for gi in range(baseGPUIndex, baseGPUIndex+len(srvScreen.getGPUs())):
-				gpuDetails = __getGPUDetails(srv, srvScreen, gi)
+				gpuDetails = __getGPUDetails(values, srv, gi)
 				flChain.append({'server':srv, 'screen':srvScreen, 'gpu_index':gi, 'gpu_details':gpuDetails})
 			baseGPUIndex += len(srvScreen.getGPUs())
 	return flChain
@@ -403,146 +538,245 @@ def loadResourceGroups(sysConfig, rg_config_file=None):
 	If the resource group configuration file is missing, then we behave as if no
 	resource groups have been defined.
 	"""
+	return updateResourceGroups(sysConfig, {}, rg_config_file)[0]
+
+def __getRGDigest(rgNode):
+	return sha1(rgNode.toxml('utf-8')).hexdigest()
+
+def __buildResourceGroup(rgNode, sysConfig):
+	obj = vsapi.ResourceGroup()
+	try:
+		obj.deserializeFromXML(rgNode)
+	except ValueError, e:
+		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "FATAL: Error loading Resource Group '%s'. Reason: %s"%(obj.getName(), str(e)))
+
+	# Normalize to paste hostnames where needed. This will make it easier to script tools!
+	obj = normalizeRG(obj)
+
+	try:
+		obj.doValidate(sysConfig['templates']['display'].values())
+	except ValueError, e:
+		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "FATAL: Error validating Resource Group '%s'. Reason: %s"%(obj.getName(),str(e)))
+	return obj
+
+def updateResourceGroups(sysConfig, rgDigests, rg_config_file=None):
+	"""
+	Parse the resource group configuration file, building only the resource
+	groups whose definition has changed.
+
+	sysConfig['resource_groups'] has the current resource groups, and rgDigests
+	the digests of their definitions, as returned by the last call (pass {} to
+	build all resource groups). Neither is modified. 
+
+	Returns [resgroups, digests, changed]. changed has the names of the resource
+	groups which were added, changed or removed.
+	"""
 	if rg_config_file is None:
 		rg_config_file = vsapi.rgConfigFile
 
 	resgroups = {}
+	digests = {}
 	# Check if the resource group config file exists
 	# A non existent file will be treated as if there were
 	# no resource groups defined
-	try:
-		os.stat(rg_config_file)
-	except:
-		return resgroups
-	try:
-		dom = minidom.parse(rg_config_file)
-	except xml.parsers.expat.ExpatError, e:
-		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "Failed to parse XML file '%s'. Reason: %s"%(rg_config_file, str(e)))
-
-	root_node = dom.getElementsByTagName("resourcegroupconfig")[0]
-	rgNodes = domutil.getChildNodes(root_node,"resourceGroup")
-	for node in rgNodes:
-		obj = vsapi.ResourceGroup()
+	rgNodes = []
+	if os.path.exists(rg_config_file):
 		try:
-			obj.deserializeFromXML(node)
-		except ValueError, e:
-			raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "FATAL: Error loading Resource Group '%s'. Reason: %s"%(obj.getName(), str(e)))
+			dom = minidom.parse(rg_config_file)
+		except xml.parsers.expat.ExpatError, e:
+			raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "Failed to parse XML file '%s'. Reason: %s"%(rg_config_file, str(e)))
 
-		# Normalize to paste hostnames where needed. This will make it easier to script tools!
-		obj = normalizeRG(obj)
+		root_node = dom.getElementsByTagName("resourcegroupconfig")[0]
+		rgNodes = domutil.getChildNodes(root_node,"resourceGroup")
 
-		try:
-			obj.doValidate(sysConfig['templates']['display'].values())
-		except ValueError, e:
-			raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "FATAL: Error validating Resource Group '%s'. Reason: %s"%(obj.getName(),str(e)))
+	currentGroups = sysConfig['resource_groups']
+	changed = []
+	for node in rgNodes:
+		# Reuse the current resource group if its definition is unchanged
+		digest = __getRGDigest(node)
+		nameNode = domutil.getChildNode(node, "name")
+		if nameNode is not None:
+			rgName = domutil.getValue(nameNode)
+		else:
+			rgName = None
+		if (rgDigests.get(rgName) == digest) and currentGroups.has_key(rgName):
+			obj = currentGroups[rgName]
+		else:
+			obj = __buildResourceGroup(node, sysConfig)
 
 		newResGrp = obj.getName()
 		if resgroups.has_key(newResGrp):
 			raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "FATAL: Resource group '%s' defined more than once."%(newResGrp))
 
 		resgroups[newResGrp] = obj
-	return resgroups
-
-def loadLocalConfig(
-	onlyTemplates=False, master_config_file=None, node_config_file=None, rg_config_file=None, 
-	systemTemplateDir = None, overrideTemplateDir = None):
-	"""
-	Load the local system configuration. Can load templates only, if needed.
-	"""
-	if master_config_file is None:
-		master_config_file = vsapi.masterConfigFile
-	if node_config_file is None:
-		node_config_file = vsapi.nodeConfigFile
-	if rg_config_file is None:
-		rg_config_file = vsapi.rgConfigFile
-	if systemTemplateDir is None:
-		systemTemplateDir = vsapi.systemTemplateDir
-	if overrideTemplateDir is None:
-		overrideTemplateDir = vsapi.overrideTemplateDir
-	sysConfig = {
-		'templates' : { 'gpu' : {} , 'display' : {}, 'keyboard' : {}, 'mouse' : {}  }, 
-		'nodes' : {},
-		'resource_groups' : {}
-	}
+		digests[newResGrp] = digest
+		if rgDigests.get(newResGrp) != digest:
+			changed.append(newResGrp)
 
-	# Load all templates...
-	# NOTE: We load the templates from the global directory first.
-	# Then load them from the local directory. This way, we ensure
-	# that the local templates override the global ones.
+	for rgName in currentGroups:
+		if not resgroups.has_key(rgName):
+			changed.append(rgName)
 
-	# Load GPU templates
-	fileList = glob('%s/gpus/*.xml'%(systemTemplateDir))
-	fileList += glob('%s/gpus/*.xml'%(overrideTemplateDir))
-	for fname in fileList:
-		try:
-			dom = minidom.parse(fname)
-		except xml.parsers.expat.ExpatError, e:
-			raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "Failed to parse XML file '%s'. Reason: %s"%(fname, str(e)))
+	return [resgroups, digests, changed]
 
-		newObj = vsapi.deserializeVizResource(dom.documentElement, [vsapi.GPU])	
-		sysConfig['templates']['gpu'][newObj.getType()] = newObj
+# Bump this whenever the objects kept in the configuration cache change
+CONFIG_CACHE_VERSION = 2
 
-	# DisplayDevice templates
-	fileList = glob('%s/displays/*.xml'%(systemTemplateDir))
-	fileList += glob('%s/displays/*.xml'%(overrideTemplateDir))
-	for fname in fileList:
-		try:
-			dom = minidom.parse(fname)
-		except xml.parsers.expat.ExpatError, e:
-			raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "Failed to parse XML file '%s'. Reason: %s"%(fname, str(e)))
+class ConfigCache:
+	"""
+	Objects built from configuration files, kept in a file so that later runs
+	need not parse the files again. Each object is rebuilt only if one of the
+	files it was built from has changed.
 
-		newObj = vsapi.deserializeVizResource(dom.documentElement, [vsapi.DisplayDevice])	
-		sysConfig['templates']['display'][newObj.getType()] = newObj
+	Files are compared by their SHA1 digest. The digest is computed again only
+	if the modification time or the size of the file has changed.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.entries = {}
+		self.digests = {}
+		self.changed = False
+		if path:
+			self.__load()
+
+	def __getVersion(self):
+		# Code changes can change what the cached objects look like,
+		# so the cache is valid only for the code that wrote it
+		version = [CONFIG_CACHE_VERSION]
+		for mod in [vsapi, sys.modules[__name__]]:
+			srcFile = os.path.splitext(mod.__file__)[0]+'.py'
+			try:
+				st = os.stat(srcFile)
+				version.append([srcFile, st.st_mtime, st.st_size])
+			except OSError, e:
+				version.append([srcFile, None, None])
+		return version
 
-	# Keyboard templates
-	fileList = glob('%s/keyboard/*.xml'%(systemTemplateDir))
-	fileList += glob('%s/keyboard/*.xml'%(overrideTemplateDir))
-	for fname in fileList:
+	def __load(self):
 		try:
-			dom = minidom.parse(fname)
-		except xml.parsers.expat.ExpatError, e:
-			raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "Failed to parse XML file '%s'. Reason: %s"%(fname, str(e)))
-		newObj = vsapi.deserializeVizResource(dom.documentElement, [vsapi.Keyboard])
-		sysConfig['templates']['keyboard'][newObj.getType()] = newObj
-
-	# Mice templates
-	fileList = glob('%s/mouse/*.xml'%(systemTemplateDir))
-	fileList += glob('%s/mouse/*.xml'%(overrideTemplateDir))
-	for fname in fileList:
+			f = open(self.path, 'rb')
+		except IOError, e:
+			return
 		try:
-			dom = minidom.parse(fname)
-		except xml.parsers.expat.ExpatError, e:
-			raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "Failed to parse XML file '%s'. Reason: %s"%(fname, str(e)))
-
-		newObj = vsapi.deserializeVizResource(dom.documentElement, [vsapi.Mouse])	
-		sysConfig['templates']['mouse'][newObj.getType()] = newObj
-
-	# If we are asked for templates only, then we are done.
-	if onlyTemplates:
-		return sysConfig
+			# Loading a pickle can run arbitrary code, so we trust only
+			# files that nobody but us (or root) could have written
+			st = os.fstat(f.fileno())
+			if (st.st_uid not in [0, os.getuid()]) or (st.st_mode & 022):
+				return
+			try:
+				saved = cPickle.load(f)
+				if saved['version'] != self.__getVersion():
+					return
+				self.entries = saved['entries']
+				self.digests = saved['digests']
+			except Exception, e:
+				# A cache which can't be read is simply rebuilt
+				pass
+		finally:
+			f.close()
+
+	def getDigest(self, fname):
+		"""
+		Returns the SHA1 digest of a file, or None if the file doesn't exist.
+		"""
+		try:
+			st = os.stat(fname)
+		except OSError, e:
+			return None
+		stamp = [st.st_mtime, st.st_size]
+		# A file changed right after we saw it could keep its time and size,
+		# so the time is trusted only for files which aren't too recent
+		if self.digests.has_key(fname) and (self.digests[fname][0] == stamp) and (time.time()-st.st_mtime>2):
+			return self.digests[fname][1]
+		f = open(fname, 'rb')
+		try:
+			digest = sha1(f.read()).hexdigest()
+		finally:
+			f.close()
+		if self.digests.get(fname) != [stamp, digest]:
+			self.digests[fname] = [stamp, digest]
+			self.changed = True
+		return digest
+
+	def get(self, kind, inputFiles, build):
+		"""
+		Returns the object built from inputFiles. build is called to build the
+		object if it isn't in the cache, or if any of inputFiles has changed
+		since it was built. The first of inputFiles identifies the object.
+		"""
+		key = (kind, inputFiles[0])
+		signature = map(lambda fname:[fname, self.getDigest(fname)], inputFiles)
+		if self.entries.has_key(key) and (self.entries[key][0] == signature):
+			return self.entries[key][1]
+		value = build()
+		self.entries[key] = [signature, value]
+		self.changed = True
+		return value
+
+	def save(self):
+		"""
+		Write the cache back to its file, if anything changed. The cache only
+		saves time, so failing to write it is not an error.
+		"""
+		if (not self.path) or (not self.changed):
+			return
+
+		# Forget about files which are gone
+		for key in self.entries.keys():
+			if not os.path.exists(key[1]):
+				del self.entries[key]
+		for fname in self.digests.keys():
+			if not os.path.exists(fname):
+				del self.digests[fname]
+
+		tmpPath = '%s.%d'%(self.path, os.getpid())
+		try:
+			cacheDir = os.path.dirname(self.path)
+			if (cacheDir != '') and (not os.path.isdir(cacheDir)):
+				os.makedirs(cacheDir, 0755)
+			fd = os.open(tmpPath, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0644)
+			f = os.fdopen(fd, 'wb')
+			try:
+				cPickle.dump({'version':self.__getVersion(), 'entries':self.entries, 'digests':self.digests}, f, cPickle.HIGHEST_PROTOCOL)
+			finally:
+				f.close()
+			# Readers see either the old cache or the new one, never a part
+			os.rename(tmpPath, self.path)
+			self.changed = False
+		except (IOError, OSError, cPickle.PicklingError), e:
+			try:
+				os.unlink(tmpPath)
+			except OSError, e:
+				pass
 
-	# Check the master config file.	
+def __parseConfigFile(fname):
 	try:
-		dom = minidom.parse(vsapi.masterConfigFile)
+		return minidom.parse(fname)
 	except xml.parsers.expat.ExpatError, e:
-		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "Failed to parse XML file '%s'. Reason: %s"%(vsapi.masterConfigFile, str(e)))
+		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "Failed to parse XML file '%s'. Reason: %s"%(fname, str(e)))
+
+def __loadTemplate(fname, resClass):
+	dom = __parseConfigFile(fname)
+	return vsapi.deserializeVizResource(dom.documentElement, [resClass])
 
+def __loadSystemType(master_config_file):
+	dom = __parseConfigFile(master_config_file)
 	root_node = dom.getElementsByTagName("masterconfig")[0]
 	system_node = domutil.getChildNode(root_node, "system")
 	type_node = domutil.getChildNode(system_node, "type")
-	system_type = domutil.getValue(type_node)
-
-	if system_type=='standalone':
-		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "FATAL : Standalone configurations are not managed by the SSM")
+	return domutil.getValue(type_node)
 
-	# Read in the node configuration file. This includes the scheduler information
-	try:
-		dom = minidom.parse(node_config_file)
-	except xml.parsers.expat.ExpatError, e:
-		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "Failed to parse XML file '%s'. Reason: %s"%(node_config_file, str(e)))
+def __loadNodeConfig(node_config_file, gpuTemplates):
+	"""
+	Parse the node configuration file. Returns [nodes, schedulers] : the nodes
+	in the order they are defined, and [type, nodeList, param] for each
+	scheduler.
+	"""
+	dom = __parseConfigFile(node_config_file)
 
 	root_node = dom.getElementsByTagName("nodeconfig")[0]
 	nodes_node = domutil.getChildNode(root_node,"nodes")
+	nodes = []
 	nodeIdx = 0
 	for node in domutil.getChildNodes(nodes_node, "node"):
 		nodeName = domutil.getValue(domutil.getChildNode(node,"hostname"))
@@ -568,7 +802,7 @@ def loadLocalConfig(
 				raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "ERROR: useScanOut needs to be defined for every GPU")
 
 			try:
-				newGPU = copy.deepcopy(sysConfig['templates']['gpu'][inGPU.getType()])
+				newGPU = copy.deepcopy(gpuTemplates[inGPU.getType()])
 			except KeyError, e:
 				raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "ERROR: No such GPU type '%s'"%(inGPU.getType()))
 
@@ -590,8 +824,6 @@ def loadLocalConfig(
 						continue
 					newGPU.setScanout(pi, thisScanout['display_device'], thisScanout['type'])
 			gpus.append(newGPU)
-		if len(gpus)==0:
-			print >>sys.stderr, "WARNING: Node %s has no GPUs."%(nodeName)
 		resList += gpus
 
 		for sli in domutil.getChildNodes(node, "sli"):
@@ -658,14 +890,14 @@ def loadLocalConfig(
 		resList += all_servers
 
 		newNode.setResources(resList)
-		sysConfig['nodes'][nodeName] = newNode
+		nodes.append(newNode)
 
 	# Process scheduler
 	schedNodes = domutil.getChildNodes(root_node,"scheduler")
 	if len(schedNodes)==0:
 		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "FATAL: You need to specify at-least a scheduler")
 
-	schedList = []
+	schedSpecs = []
 	for sNode in schedNodes:
 		typeNode = domutil.getChildNode(sNode,"type")
 		if typeNode is None:
@@ -686,8 +918,81 @@ def loadLocalConfig(
 		for nodeNode in nodeNodes:
 			nodeList.append(domutil.getValue(nodeNode))
 
+		schedSpecs.append([domutil.getValue(typeNode), nodeList, param])
+
+	return [nodes, schedSpecs]
+
+def loadLocalConfig(
+	onlyTemplates=False, master_config_file=None, node_config_file=None, rg_config_file=None, 
+	systemTemplateDir = None, overrideTemplateDir = None, configCacheFile = None):
+	"""
+	Load the local system configuration. Can load templates only, if needed.
+
+	What is parsed from the configuration files is kept in configCacheFile
+	(vsapi.configCacheFile by default). Only the files which have changed
+	since are parsed again. Pass an empty configCacheFile to parse everything.
+	"""
+	if master_config_file is None:
+		master_config_file = vsapi.masterConfigFile
+	if node_config_file is None:
+		node_config_file = vsapi.nodeConfigFile
+	if rg_config_file is None:
+		rg_config_file = vsapi.rgConfigFile
+	if systemTemplateDir is None:
+		systemTemplateDir = vsapi.systemTemplateDir
+	if overrideTemplateDir is None:
+		overrideTemplateDir = vsapi.overrideTemplateDir
+	if configCacheFile is None:
+		configCacheFile = vsapi.configCacheFile
+	sysConfig = {
+		'templates' : { 'gpu' : {} , 'display' : {}, 'keyboard' : {}, 'mouse' : {}  }, 
+		'nodes' : {},
+		'resource_groups' : {}
+	}
+	cache = ConfigCache(configCacheFile)
+
+	# Load all templates...
+	# NOTE: We load the templates from the global directory first.
+	# Then load them from the local directory. This way, we ensure
+	# that the local templates override the global ones.
+	templateFiles = {}
+	for templateType, subDir, resClass in [
+		['gpu', 'gpus', vsapi.GPU],
+		['display', 'displays', vsapi.DisplayDevice],
+		['keyboard', 'keyboard', vsapi.Keyboard],
+		['mouse', 'mouse', vsapi.Mouse]]:
+		fileList = glob('%s/%s/*.xml'%(systemTemplateDir, subDir))
+		fileList += glob('%s/%s/*.xml'%(overrideTemplateDir, subDir))
+		for fname in fileList:
+			newObj = cache.get('template', [fname], lambda:__loadTemplate(fname, resClass))
+			sysConfig['templates'][templateType][newObj.getType()] = newObj
+		templateFiles[templateType] = fileList
+
+	# If we are asked for templates only, then we are done.
+	if onlyTemplates:
+		cache.save()
+		return sysConfig
+
+	# Check the master config file.	
+	system_type = cache.get('master', [master_config_file], lambda:__loadSystemType(master_config_file))
+	if system_type=='standalone':
+		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "FATAL : Standalone configurations are not managed by the SSM")
+
+	# Read in the node configuration file. This includes the scheduler information
+	# Nodes are made from the GPU templates, so they depend on those too.
+	nodes, schedSpecs = cache.get('nodes', [node_config_file]+templateFiles['gpu'], lambda:__loadNodeConfig(node_config_file, sysConfig['templates']['gpu']))
+	for newNode in nodes:
+		nodeName = newNode.getHostName()
+		if len(newNode.getGPUs())==0:
+			print >>sys.stderr, "WARNING: Node %s has no GPUs."%(nodeName)
+		sysConfig['nodes'][nodeName] = newNode
+
+	# Schedulers are never cached; creating them can involve checking
+	# with the scheduler itself
+	schedList = []
+	for schedType, nodeList, param in schedSpecs:
 		try:
-			sched = metascheduler.createSchedulerType(domutil.getValue(typeNode), nodeList, param)
+			sched = metascheduler.createSchedulerType(schedType, nodeList, param)
 			schedList.append(sched)
 		except ValueError, e:
 			raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "Error creating a scheduler : %s"%(str(e)))
@@ -711,220 +1016,278 @@ def loadLocalConfig(
 	# If not, then that item will never be usable ! This is an
 	# important debugging check
 
-	# Load the resource groups
-	resgroups = loadResourceGroups(sysConfig, rg_config_file)
+	# Load the resource groups. These are validated against the display
+	# templates, so they depend on those too.
+	resgroups, rgDigests = cache.get('resource_groups', [rg_config_file]+templateFiles['display'], lambda:updateResourceGroups(sysConfig, {}, rg_config_file)[:2])
 	sysConfig['resource_groups'] = resgroups
+	# Lets the SSM rebuild only the resource groups that change later
+	sysConfig['resource_group_digests'] = rgDigests
 
-	return sysConfig
-
-def parseXLogFile(xServerNumber=0):
-	try:
-		fname = '/var/log/Xorg.%d.log'%(xServerNumber)
-		f = open(fname,'r')
-	except IOError, e:
-		raise ValueError, "Invalid server number. Failed to open file '%s'. Reason : %s"%(fname, str(e))
+	# Save before returning; callers are free to modify what we return
+	cache.save()
 
-	# Extract all file data
-	all_lines = f.readlines()
-	f.close()
-
-	# NOTE: each of the regexps below have an extra ".*" before
-	# NVIDIA. Some versions of the driver append a date value
-	# in every line, and this takes care of those cases.
-	#
-	#Detect the starting of the EDID
-	# Sample lines I've seen are
-	#(--) NVIDIA(0): --- EDID for LPL (DFP-0) ---
-	#
-	edid_header_re = re.compile("^\(--\)[\s]+.*NVIDIA\(([0-9]+)\):[\s]+---[\s]+EDID[\s]+for[\s]+(.*)[\s]+\(([A-Z]+)\-([0-9]+)\)[\s]+---[\s]+$")
+	return sysConfig
 
-	#
-	# Property lines can be
-	#'(--) NVIDIA(0): 32-bit Serial Number         : 0' # Value = 0
-	#'(--) NVIDIA(0): Serial Number String         : '  # NOTE: no Value!
-	#
-	edid_prop_re = re.compile("^\(--\)[\s]+.*NVIDIA\(([0-9]+)\):[\s]+(.*)[\s]+:[\s]+((.*)[\s]+)?$")
-
-	# Properties end with
-	edid_end_prop_re = re.compile("^\(--\)[\s]+.*NVIDIA\(([0-9]+)\):[\s]+$")
-
-	# EDIDs have this 'Prefer first detailed timing' property.
-	# If set to 'Yes', then the mode following the below line is the default mode for the
-	# device
-	#(--) NVIDIA(0): Detailed Timings:
-	edid_detailed_timing_re = re.compile("^\(--\)[\s]+.*NVIDIA\(([0-9]+)\):[\s]+Detailed Timings:[\s]*$")
-
-	# Each supported mode is shown as
-	# '(--) NVIDIA(0):   1280 x 800  @ 60 Hz'
-	edid_supported_mode_re = re.compile("^\(--\)[\s]+.*NVIDIA\(([0-9]+)\):[\s]+([0-9]+)[\s]+x[\s]+([0-9]+)[\s]+@[\s]+([0-9\.]+)[\s]+Hz[\s]*$")
-
-	# Modes are followed by the Raw EDID bytes
-	#'(--) NVIDIA(0): Raw EDID bytes:'
-	edid_raw_edid_start_re = re.compile("^\(--\)[\s]+.*NVIDIA\(([0-9]+)\):[\s]+Raw EDID bytes:[\s]*$")
-
-	# EDID data bytes are in this format
-	#(--) NVIDIA(0):   00 4c 50 31 34 31 57 58  31 2d 54 4c 41 32 00 ae
-	edid_data_re = re.compile("^\(--\)[\s]+.*NVIDIA\(([0-9]+)\):[\s]+"+ ("([0-9a-f]{2})[\s]+"*16)+"[\s]*$")
-	edid_footer_re = re.compile("^\(--\)[\s]+.*NVIDIA\(([0-9]+)\):[\s]+---[\s]+End[\s]+of[\s]+EDID[\s]+for[\s]+(.*)[\s]+\(([A-Z]+)\-([0-9]+)\)[\s]+---[\s]+$")
-
-	# Supported display devices can span two lines...
-	#(II) Mar 10 06:40:21 NVIDIA(0): Supported display device(s): CRT-0, CRT-1, DFP-0, DFP-1,
-	#(II) Mar 10 06:40:21 NVIDIA(0):     DFP-2, DFP-3
-	sup_dd_re = re.compile("^\(II\)[\s]+.*NVIDIA\(([0-9]+)\):[\s]+Supported display device\(s\):(.*)$")
-	ext_sup_dd_re = re.compile("^\(II\)[\s]+.*NVIDIA\(([0-9]+)\):[\s](.*)$")
-	
-	# Process line by line
-	lineNum = -1
-	maxLines = len(all_lines)
+#
+# Parsing the X server log
+#
+# All the lines we are interested in are written by the nvidia driver, and
+# start like
+#(--) NVIDIA(0): 
+# Some versions of the driver put a date before NVIDIA, e.g.
+#(II) Mar 10 06:40:21 NVIDIA(0): 
+# xlog_prefix_re matches this part. The rest of the line is matched by one of
+# the expressions below it, depending on what we expect to find next.
+# Lines which can't be what we expect next are skipped using plain substring
+# checks; with -logverbose 6, most of the log is such lines.
+#
+xlog_prefix_re = re.compile("^\((--|II)\)[\s]+.*NVIDIA\(([0-9]+)\):")
+
+#Detect the starting of the EDID
+# Sample lines I've seen are
+#(--) NVIDIA(0): --- EDID for LPL (DFP-0) ---
+#
+edid_header_re = re.compile("^[\s]+---[\s]+EDID[\s]+for[\s]+(.*)[\s]+\(([A-Z]+)\-([0-9]+)\)[\s]+---[\s]+$")
+
+#
+# Property lines can be
+#'(--) NVIDIA(0): 32-bit Serial Number         : 0' # Value = 0
+#'(--) NVIDIA(0): Serial Number String         : '  # NOTE: no Value!
+#
+edid_prop_re = re.compile("^[\s]+(.*)[\s]+:[\s]+((.*)[\s]+)?$")
+
+# Properties end with
+edid_end_prop_re = re.compile("^[\s]+$")
+
+# EDIDs have this 'Prefer first detailed timing' property.
+# If set to 'Yes', then the mode following the below line is the default mode for the
+# device
+#(--) NVIDIA(0): Detailed Timings:
+edid_detailed_timing_re = re.compile("^[\s]+Detailed Timings:[\s]*$")
+
+# Each supported mode is shown as
+# '(--) NVIDIA(0):   1280 x 800  @ 60 Hz'
+edid_supported_mode_re = re.compile("^[\s]+([0-9]+)[\s]+x[\s]+([0-9]+)[\s]+@[\s]+([0-9\.]+)[\s]+Hz[\s]*$")
+
+# Modes are followed by the Raw EDID bytes
+#'(--) NVIDIA(0): Raw EDID bytes:'
+edid_raw_edid_start_re = re.compile("^[\s]+Raw EDID bytes:[\s]*$")
+
+# EDID data bytes are in this format
+#(--) NVIDIA(0):   00 4c 50 31 34 31 57 58  31 2d 54 4c 41 32 00 ae
+edid_data_re = re.compile("^[\s]+"+ ("([0-9a-f]{2})[\s]+"*16)+"[\s]*$")
+edid_footer_re = re.compile("^[\s]+---[\s]+End[\s]+of[\s]+EDID[\s]+for[\s]+(.*)[\s]+\(([A-Z]+)\-([0-9]+)\)[\s]+---[\s]+$")
+
+# Supported display devices can span two lines...
+#(II) Mar 10 06:40:21 NVIDIA(0): Supported display device(s): CRT-0, CRT-1, DFP-0, DFP-1,
+#(II) Mar 10 06:40:21 NVIDIA(0):     DFP-2, DFP-3
+sup_dd_re = re.compile("^[\s]+Supported display device\(s\):(.*)$")
+ext_sup_dd_re = re.compile("^[\s](.*)$")
+
+# What the X log parser expects next
+XLOG_ANY = 0 # Supported display devices, or the start of an EDID
+XLOG_MORE_DEVICES = 1 # Rest of the supported display devices
+XLOG_EDID_PROPS = 2 # EDID properties
+XLOG_EDID_MODES = 3 # Supported modes, till the raw EDID bytes start
+XLOG_EDID_BYTES = 4 # Raw EDID bytes, till the end of the EDID
+
+def __addScanouts(allScanouts, gpuIndex, allDevs):
+	allDevs = map(lambda x:x.lstrip().rstrip(), allDevs.split(','))
+	gpuScanouts = {}
+	for dev in allDevs:
+		parts = dev.split('-')
+		port_index = int(parts[1])
+		port_type = parts[0]
+		try:
+			gpuScanouts[port_index].append(port_type)
+		except:
+			gpuScanouts[port_index]=[port_type]
+	allScanouts.append({'GPU':gpuIndex, 'scanouts':gpuScanouts})
+
+def __finishDisplay(thisDisplay):
+	hsr = thisDisplay['Valid HSync Range'].split('-')
+	hsyncMin = hsr[0].lstrip().rstrip().split(' ')[0]
+	hsyncMax = hsr[1].lstrip().rstrip().split(' ')[0]
+	#print hsyncMin, hsyncMax
+
+	vsr = thisDisplay['Valid VRefresh Range'].split('-')
+	vrefreshMin = vsr[0].lstrip().rstrip().split(' ')[0]
+	vrefreshMax = vsr[1].lstrip().rstrip().split(' ')[0]
+	thisDisplay['hsync_range'] = [hsyncMin, hsyncMax]
+	thisDisplay['vrefresh_range'] = [vrefreshMin, vrefreshMax]
+	#print vrefreshMin, vrefreshMax
+
+	# Create a display device object representing this display device
+	thisDD = vsapi.DisplayDevice(thisDisplay['display_device'])
+	thisDD.setEDIDDisplayName(thisDisplay['display_device'])
+	thisDD.setHSyncRange(thisDisplay['hsync_range'])
+	thisDD.setVRefreshRange(thisDisplay['vrefresh_range'])
+	thisDD.setEDIDBytes(string.join(thisDisplay['edid_bytes'],""))
+	for modeDesc in thisDisplay['edid_modes']:
+		thisDD.addMode('edid', '%dx%d_%s'%(modeDesc[0], modeDesc[1], modeDesc[2]), modeDesc[0], modeDesc[1], modeDesc[2])
+	if thisDisplay.has_key('first_detailed_timing'):
+		modeDesc = thisDisplay['first_detailed_timing']
+		thisDD.setDefaultMode('%dx%d_%s'%(modeDesc[0], modeDesc[1], modeDesc[2]))
+	if thisDisplay['output_type']=='DFP':
+		thisDD.setInput('digital')
+	elif thisDisplay['output_type']=='CRT':
+		thisDD.setInput('analog')
+	thisDisplay['display_template'] = thisDD
+	if thisDisplay.has_key('Maximum Image Size'):
+		dims = map(lambda x:int(x[:-2]), map(lambda x:x.strip(), thisDisplay['Maximum Image Size'].split('x')))
+		thisDD.setDimensions(dims)
+
+def parseXLog(lines):
+	"""
+	Parse the log of an X server, given as an iterable of lines. Returns
+	{'possible_scanouts': ..., 'connected_displays': ...}; see parseXLogFile.
 
+	The log is parsed in a single pass, looking at each line once.
+	"""
 	allDisplays = []
 	allScanouts = []
-	while lineNum < (maxLines-1):
-		lineNum += 1
-		thisLine = all_lines[lineNum]
-
-		ddcapmatch = sup_dd_re.match(thisLine)
-		if ddcapmatch:
-			ddcapProps = ddcapmatch.groups()
-			allDevs = ddcapProps[1].lstrip().rstrip()
-			if len(allDevs)>0: # Empty match means no display devices are supported
-				thisGPUScanout = {}
-				thisGPUScanout['GPU']=int(ddcapProps[0])
-				if allDevs[-1]==',':
-					lineNum += 1
-					ddcapmatch = ext_sup_dd_re.match(all_lines[lineNum])
-					ddcapProps = ddcapmatch.groups()
-					otherDevs = ddcapProps[1].lstrip().rstrip()
-					allDevs += otherDevs
-				allDevs = map(lambda x:x.lstrip().rstrip(), allDevs.split(','))
-				gpuScanouts = {}
-				for dev in allDevs:
-					parts = dev.split('-')
-					port_index = int(parts[1])
-					port_type = parts[0]
-					try:
-						gpuScanouts[port_index].append(port_type)
-					except:
-						gpuScanouts[port_index]=[port_type]
-				thisGPUScanout['scanouts']=gpuScanouts
-				allScanouts.append(thisGPUScanout)
-				# Done for this line
-				continue
-
-		headerMatch = edid_header_re.match(thisLine)
-		# Ignore lines till the beginning of an EDID header
-		if headerMatch is None:
+	state = XLOG_ANY
+	for thisLine in lines:
+		# Most lines are of no interest when we aren't in the middle of
+		# something. Skip them before doing anything costlier.
+		if (state == XLOG_ANY) and (thisLine.find('Supported display device') == -1) and (thisLine.find('EDID') == -1):
 			continue
-
-		thisDisplay = {}
-		headerProps = headerMatch.groups()
-		thisDisplay['GPU'] = int(headerProps[0])
-		thisDisplay['display_device'] = headerProps[1]
-		thisDisplay['port_index'] = int(headerProps[3])
-		thisDisplay['output_type'] = headerProps[2]
-		thisDisplay['edid_modes'] = []
-		thisDisplay['edid_bytes'] = []
-
-		# The header will be followed by a list of properties
-		# that the nvidia driver decodes from the EDID
-		# The end of this information is indicated with a line like
-		# "(--) NVIDIA(0): "
-		while lineNum < (maxLines-1):
-			lineNum += 1
-			thisLine = all_lines[lineNum]
-			mob2 = edid_end_prop_re.match(thisLine)
-			if mob2 is None:
-				propMatch = edid_prop_re.match(thisLine)
-				if propMatch is not None:
-					#print propMatch.groups()
-					propMatches = propMatch.groups()
-					propName = propMatches[1].rstrip()
-					thisDisplay[propName]=propMatches[3]
-					
-				else:
-					raise ValueError, "Failed parsing line:'%s'"%(thisLine)
-			else:
-				break
-
-		next_is_default = False
-		# Next find all supported modes
-		while lineNum < (maxLines-1):
-			lineNum += 1
-			thisLine = all_lines[lineNum]
-			mob2 = edid_raw_edid_start_re.match(thisLine)
-			if mob2 is None:
-				# FIXME: we have to handle "preferred mode"s here!
-				# this manifests as "prefer first detailed timing" on edids
-				matchedMode = edid_supported_mode_re.match(thisLine)
-				if matchedMode is not None:
-					#print matchedMode.groups()
-					matchedMode = matchedMode.groups()
-					mode_width = int(matchedMode[1])
-					mode_height = int(matchedMode[2])
-					mode_refresh = matchedMode[3]
-					thisDisplay['edid_modes'].append([mode_width, mode_height, mode_refresh])
-					if next_is_default:
-						thisDisplay['first_detailed_timing'] = [mode_width, mode_height, mode_refresh]
-						next_is_default = False
+		prefix = None
+		if thisLine.find('NVIDIA(') != -1:
+			prefix = xlog_prefix_re.match(thisLine)
+		if prefix is None:
+			# Only EDID properties and display device lists have to be
+			# contiguous
+			if state in [XLOG_EDID_PROPS, XLOG_MORE_DEVICES]:
+				raise ValueError, "Failed parsing line:'%s'"%(thisLine)
+			continue
+		lineType, gpuIndex = prefix.groups()
+		body = thisLine[prefix.end():]
+
+		if state == XLOG_ANY:
+			if lineType == 'II':
+				ddcapmatch = sup_dd_re.match(body)
+				if ddcapmatch is None:
+					continue
+				allDevs = ddcapmatch.groups()[0].lstrip().rstrip()
+				if len(allDevs)==0: # Empty match means no display devices are supported
+					continue
+				if allDevs[-1]==',':
+					ddcapGPU = int(gpuIndex)
+					state = XLOG_MORE_DEVICES
 				else:
-					doesMatch = edid_detailed_timing_re.match(thisLine)
-					if doesMatch is not None:
-						next_is_default = True
+					__addScanouts(allScanouts, int(gpuIndex), allDevs)
 			else:
-				break
-
-		# Next leach all EDID data bytes
-		# till the end of EDID
-		while lineNum < (maxLines-1):
-			lineNum += 1
-			thisLine = all_lines[lineNum]
-			footerMatch = edid_footer_re.match(thisLine)
-			if footerMatch is None:
-				# Till we reach the footer, we may get data bytes
-				edidData = edid_data_re.match(thisLine)
-				if edidData is not None:
-					#print edidData.groups()
-					for edidByte in edidData.groups()[1:]:
-						thisDisplay['edid_bytes'].append(edidByte)
-			else:
-				break
-		hsr = thisDisplay['Valid HSync Range'].split('-')
-		hsyncMin = hsr[0].lstrip().rstrip().split(' ')[0]
-		hsyncMax = hsr[1].lstrip().rstrip().split(' ')[0]
-		#print hsyncMin, hsyncMax
-
-		vsr = thisDisplay['Valid VRefresh Range'].split('-')
-		vrefreshMin = vsr[0].lstrip().rstrip().split(' ')[0]
-		vrefreshMax = vsr[1].lstrip().rstrip().split(' ')[0]
-		thisDisplay['hsync_range'] = [hsyncMin, hsyncMax]
-		thisDisplay['vrefresh_range'] = [vrefreshMin, vrefreshMax]
-		#print vrefreshMin, vrefreshMax
-
-		# Create a display device object representing this display device
-		thisDD = vsapi.DisplayDevice(thisDisplay['display_device'])
-		thisDD.setEDIDDisplayName(thisDisplay['display_device'])
-		thisDD.setHSyncRange(thisDisplay['hsync_range'])
-		thisDD.setVRefreshRange(thisDisplay['vrefresh_range'])
-		thisDD.setEDIDBytes(string.join(thisDisplay['edid_bytes'],""))
-		for modeDesc in thisDisplay['edid_modes']:
-			thisDD.addMode('edid', '%dx%d_%s'%(modeDesc[0], modeDesc[1], modeDesc[2]), modeDesc[0], modeDesc[1], modeDesc[2])
-		if thisDisplay.has_key('first_detailed_timing'):
-			modeDesc = thisDisplay['first_detailed_timing']
-			thisDD.setDefaultMode('%dx%d_%s'%(modeDesc[0], modeDesc[1], modeDesc[2]))
-		if thisDisplay['output_type']=='DFP':
-			thisDD.setInput('digital')
-		elif thisDisplay['output_type']=='CRT':
-			thisDD.setInput('analog')
-		thisDisplay['display_template'] = thisDD
-		if thisDisplay.has_key('Maximum Image Size'):
-			dims = map(lambda x:int(x[:-2]), map(lambda x:x.strip(), thisDisplay['Maximum Image Size'].split('x')))
-			thisDD.setDimensions(dims)
-
-		# Add this to our list of displays
+				headerMatch = edid_header_re.match(body)
+				# Ignore lines till the beginning of an EDID header
+				if headerMatch is None:
+					continue
+				headerProps = headerMatch.groups()
+				thisDisplay = {}
+				thisDisplay['GPU'] = int(gpuIndex)
+				thisDisplay['display_device'] = headerProps[0]
+				thisDisplay['port_index'] = int(headerProps[2])
+				thisDisplay['output_type'] = headerProps[1]
+				thisDisplay['edid_modes'] = []
+				thisDisplay['edid_bytes'] = []
+				next_is_default = False
+				state = XLOG_EDID_PROPS
+
+		elif state == XLOG_MORE_DEVICES:
+			ddcapmatch = ext_sup_dd_re.match(body)
+			if (lineType != 'II') or (ddcapmatch is None):
+				raise ValueError, "Failed parsing line:'%s'"%(thisLine)
+			allDevs += ddcapmatch.groups()[0].lstrip().rstrip()
+			__addScanouts(allScanouts, ddcapGPU, allDevs)
+			state = XLOG_ANY
+
+		elif lineType != '--':
+			# All EDID information is in lines starting with (--)
+			if state == XLOG_EDID_PROPS:
+				raise ValueError, "Failed parsing line:'%s'"%(thisLine)
+
+		elif state == XLOG_EDID_PROPS:
+			# The header will be followed by a list of properties
+			# that the nvidia driver decodes from the EDID
+			# The end of this information is indicated with a line like
+			# "(--) NVIDIA(0): "
+			if edid_end_prop_re.match(body):
+				state = XLOG_EDID_MODES
+				continue
+			propMatch = edid_prop_re.match(body)
+			if propMatch is None:
+				raise ValueError, "Failed parsing line:'%s'"%(thisLine)
+			propMatches = propMatch.groups()
+			propName = propMatches[0].rstrip()
+			thisDisplay[propName]=propMatches[2]
+
+		elif state == XLOG_EDID_MODES:
+			# Next find all supported modes
+			if edid_raw_edid_start_re.match(body):
+				state = XLOG_EDID_BYTES
+				continue
+			# FIXME: we have to handle "preferred mode"s here!
+			# this manifests as "prefer first detailed timing" on edids
+			matchedMode = edid_supported_mode_re.match(body)
+			if matchedMode is not None:
+				matchedMode = matchedMode.groups()
+				mode_width = int(matchedMode[0])
+				mode_height = int(matchedMode[1])
+				mode_refresh = matchedMode[2]
+				thisDisplay['edid_modes'].append([mode_width, mode_height, mode_refresh])
+				if next_is_default:
+					thisDisplay['first_detailed_timing'] = [mode_width, mode_height, mode_refresh]
+					next_is_default = False
+			elif edid_detailed_timing_re.match(body):
+				next_is_default = True
+
+		elif state == XLOG_EDID_BYTES:
+			# Next leach all EDID data bytes
+			# till the end of EDID
+			if edid_footer_re.match(body):
+				__finishDisplay(thisDisplay)
+				# Add this to our list of displays
+				allDisplays.append(thisDisplay)
+				state = XLOG_ANY
+				continue
+			# Till we reach the footer, we may get data bytes
+			edidData = edid_data_re.match(body)
+			if edidData is not None:
+				thisDisplay['edid_bytes'] += edidData.groups()
+
+	# A log which ends in the middle of an EDID has whatever we found
+	if state in [XLOG_EDID_PROPS, XLOG_EDID_MODES, XLOG_EDID_BYTES]:
+		__finishDisplay(thisDisplay)
 		allDisplays.append(thisDisplay)
+	elif state == XLOG_MORE_DEVICES:
+		__addScanouts(allScanouts, ddcapGPU, allDevs)
 
 	return {'possible_scanouts': allScanouts, 'connected_displays': allDisplays}
 
+def parseXLogFile(xServerNumber=0, fname=None):
+	"""
+	Parse the log of an X server using the nvidia driver; fname defaults to
+	the log of X server xServerNumber. Returns a dictionary with
+
+	  possible_scanouts  : the display devices each GPU can drive
+	  connected_displays : the displays connected to the GPUs, with the
+	                       details from their EDIDs
+
+	The file is read one line at a time, so large logs (e.g. from X servers
+	started with -logverbose 6) needn't fit in memory.
+	"""
+	try:
+		if fname is None:
+			fname = '/var/log/Xorg.%d.log'%(xServerNumber)
+		f = open(fname,'r')
+	except IOError, e:
+		raise ValueError, "Invalid server number. Failed to open file '%s'. Reason : %s"%(fname, str(e))
+
+	try:
+		return parseXLog(f)
+	finally:
+		f.close()
+
 def normalizeRG(rg):
 	"""
 	'Normalizes' a resource group. This basically passes through
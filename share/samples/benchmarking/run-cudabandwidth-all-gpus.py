@@ -46,9 +46,20 @@ ra = vsapi.ResourceAccess()
 # Get information about all available GPUs
 allGPUs = ra.queryResources(vsapi.GPU())
 
-# Allocate all of them !
-alloc = ra.allocate(allGPUs)
-allocGPU = alloc.getResources()
+# Allocate all of them, each as an allocation of its own, in one go !
+# GPUs which someone else is using are skipped.
+allocs = []
+allocGPU = []
+results = ra.allocateMany(map(lambda gpu: [gpu], allGPUs), allOrNothing=False)
+for idx in range(len(allGPUs)):
+	if isinstance(results[idx], vsapi.VizError):
+		print 'Skipping %s/GPU-%d : %s'%(allGPUs[idx].getHostName(), allGPUs[idx].getIndex(), str(results[idx]))
+	else:
+		allocs.append(results[idx])
+		allocGPU += results[idx].getResources()
+if len(allocs)==0:
+	print >>sys.stderr, "None of the GPUs could be allocated"
+	sys.exit(1)
 
 gpuNames = []
 gpuResults = {}
@@ -98,7 +109,7 @@ for idx in range(len(allocGPU)):
 	print
 
 # Give up the resources we are using
-ra.deallocate(alloc)
+ra.deallocateMany(allocs)
 
 # Disconnect from the SSM
 ra.stop()
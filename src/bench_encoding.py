@@ -0,0 +1,96 @@
+# VizStack - A Framework to manage visualization resources
+
+# Copyright (C) 2009-2010 Hewlett-Packard
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+#
+# bench_encoding.py
+#
+# Measures the cost of building and parsing SSM messages in the XML and
+# JSON encodings. The message used is a query_resource reply carrying the
+# configuration of a cluster of nodes, which is the largest message the SSM
+# sends.
+#
+# Usage: bench_encoding.py [numNodes] [iterations]
+#
+
+import vsapi
+import sys
+import time
+from xml.dom import minidom
+
+def createNode(nodeIndex):
+	hostname = 'node%d'%(nodeIndex)
+	node = vsapi.VizNode(hostname, 'ProLiant xw8600', nodeIndex)
+	for gpuIndex in range(4):
+		gpu = vsapi.GPU(gpuIndex, model='Quadro FX 5800', busID='PCI:%d:0:0'%(gpuIndex+1), useScanOut=True)
+		gpu.setVendor('NVIDIA Corporation')
+		gpu.setScanout(0, 'HP LP2065', 'digital', '1600x1200_60')
+		node.addResource(gpu)
+	node.addResource(vsapi.Keyboard(0, keyboardType='SystemKeyboard'))
+	node.addResource(vsapi.Mouse(0, mouseType='SystemMouse'))
+	for serverIndex in range(4):
+		node.addResource(vsapi.Server(serverIndex))
+	for serverIndex in range(10,14):
+		node.addResource(vsapi.Server(serverIndex, serverType=vsapi.VIRTUAL_SERVER))
+	node.addResource(vsapi.SLI(0, sliType='quadroplex', gpu0=0, gpu1=1))
+	return node
+
+def xmlEncode(nodes):
+	ret = "<ssm><response><status>0</status><message>Success</message><return_value>"
+	for node in nodes:
+		ret += node.serializeToXML()
+	ret += "</return_value></response></ssm>"
+	return ret
+
+def xmlDecode(msg):
+	dom = minidom.parseString(msg)
+	retNode = vsapi.domutil.getChildNode(dom.getElementsByTagName('response')[0], 'return_value')
+	return map(lambda x: vsapi.deserializeVizResource(x, [vsapi.VizNode]), vsapi.domutil.getAllChildNodes(retNode))
+
+def jsonEncode(nodes):
+	return vsapi.encodeJSONMessage({'response' : {'status' : 0, 'message' : 'Success', 'return_value' : map(lambda x: x.toDict(), nodes)}})
+
+def jsonDecode(msg):
+	response = vsapi.decodeJSONMessage(msg)['response']
+	return map(lambda x: vsapi.deserializeVizResourceFromDict(x, [vsapi.VizNode]), response['return_value'])
+
+def timeIt(func, arg, iterations):
+	startTime = time.time()
+	for i in range(iterations):
+		ret = func(arg)
+	return [ret, (time.time()-startTime)/iterations]
+
+if __name__ == '__main__':
+	numNodes = 16
+	iterations = 20
+	if len(sys.argv)>1:
+		numNodes = int(sys.argv[1])
+	if len(sys.argv)>2:
+		iterations = int(sys.argv[2])
+
+	nodes = map(createNode, range(numNodes))
+
+	print "Message : query_resource reply with %d nodes, averaged over %d iterations"%(numNodes, iterations)
+	print
+	print "%-8s %10s %15s %15s"%("Encoding", "Bytes", "Serialize(ms)", "Parse(ms)")
+	for encName, encFunc, decFunc in [(vsapi.ENCODING_XML, xmlEncode, xmlDecode), (vsapi.ENCODING_JSON, jsonEncode, jsonDecode)]:
+		msg, encTime = timeIt(encFunc, nodes, iterations)
+		decNodes, decTime = timeIt(decFunc, msg, iterations)
+		if len(decNodes) != numNodes:
+			print "ERROR: %s decoding returned %d nodes, expected %d"%(encName, len(decNodes), numNodes)
+			sys.exit(1)
+		print "%-8s %10d %15.2f %15.2f"%(encName, len(msg), encTime*1000, decTime*1000)
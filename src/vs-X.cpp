@@ -109,6 +109,8 @@
 #include <signal.h>
 #include <string.h>
 #include <sys/file.h>
+#include <sys/time.h>
+#include <time.h>
 
 #include <iostream>
 #include <map>
@@ -373,6 +375,12 @@ void parentWaitTillSUIDExits(int ssmSocket, bool isShared, int suidChildPid, int
 int g_lockFD = -1;
 bool g_haveLock = false;
 
+// Once our X server is up, we keep the lock for XSERVER_LOCK_DELAY seconds
+// more, so that the driver can finish initializing before another X server
+// starts. This is the time at which we give up the lock; it is 0 if we
+// aren't waiting to do that.
+time_t g_lockReleaseTime = 0;
+
 #define X_LOCK_FILE "/var/lock/vs-X"
 bool take_lock()
 {
@@ -431,6 +439,7 @@ void free_lock()
 	close(g_lockFD);
 	g_lockFD = -1;
 	g_haveLock = false;
+	g_lockReleaseTime = 0;
 }
 
 bool have_lock()
@@ -441,7 +450,12 @@ bool have_lock()
 void take_lock_once()
 {
 	if(have_lock())
+	{
+		// If we were going to give up the lock after startup, then
+		// we keep it now
+		g_lockReleaseTime = 0;
 		return;
+	}
 	take_lock();
 }
 
@@ -1065,6 +1079,16 @@ int main(int argc, char**argv)
 		exit(-1);
 	}
 
+	// For shared servers, the SUID child writes a byte to this pipe once it
+	// is ready to accept connections from sharing clients. If it exits before
+	// that, then we see the pipe being closed instead.
+	int suidReadyPipe[2] = {-1, -1};
+	if (isShared && (pipe(suidReadyPipe)<0))
+	{
+		perror("ERROR : Could not create pipe. System may be running out of resources");
+		exit(-1);
+	}
+
 	// Fork here to control SUID child
 	// Fork is needed else the caller of the vs-X cannot control the
 	// SUID child!
@@ -1092,8 +1116,13 @@ int main(int argc, char**argv)
 			string serverSocketAddr = "/var/run/vizstack/socket-";
 			serverSocketAddr += xdisplay;
 			strcpy(sa.sun_path, serverSocketAddr.c_str()); // on Linux, the path limit seems to be 118
-			// FIXME: rationalize the delay below. Does it make sense to put a retry loop here ?
-			sleep(XSERVER_LOCK_DELAY*2+1); // give time for the daemon process to accept connections
+			// wait for the daemon process to accept connections. This may take
+			// a while, since it needs the X server lock for that.
+			char readyBuf=0;
+			int ret;
+			close(suidReadyPipe[1]);
+			RETRY_ON_EINTR(ret, read(suidReadyPipe[0], &readyBuf, 1));
+			close(suidReadyPipe[0]);
 			if(connect(serverSocket, (sockaddr*) &sa, sizeof(sa.sun_family)+sizeof(sa.sun_path))==0)
 			{
 				// get the response to our connection
@@ -1180,6 +1209,8 @@ int main(int argc, char**argv)
 	close(g_parent_sig_pipe[1]);
 	close(g_parent_sig_pipe[0]);
 	g_parent_sig_pipe[0] = g_parent_sig_pipe[1] = -1;
+	if(isShared)
+		close(suidReadyPipe[0]);
 
 	// Close the write end since we don't need to communicate
 	// anything to the parent process
@@ -1320,6 +1351,12 @@ int main(int argc, char**argv)
 		// set a queue length of 5 (an arbitrary number) for incoming requests
 		listen(serverSocket, 5);
 		fprintf(stderr, "Wrapper server socket listening...\n");
+
+		// Let the parent know that it can connect to us now
+		char readyBuf=1;
+		int readyRet;
+		RETRY_ON_EINTR(readyRet, write(suidReadyPipe[1], &readyBuf, 1));
+		close(suidReadyPipe[1]);
 	}
 	else
 	{
@@ -1622,6 +1659,27 @@ int main(int argc, char**argv)
 
 	while(!loopDone)
 	{
+		// Give up our X server lock when it's time, so that other X servers
+		// can start. Till then, select() below waits only till that time.
+		struct timeval lockTimeout;
+		struct timeval *pSelectTimeout = NULL;
+		if(have_lock() && (g_lockReleaseTime!=0))
+		{
+			time_t now = time(NULL);
+			if(now >= g_lockReleaseTime)
+			{
+				if(g_debugPrints)
+					printf("INFO : Freeing our lock so that other X servers can start\n");
+				free_lock();
+			}
+			else
+			{
+				lockTimeout.tv_sec = g_lockReleaseTime - now;
+				lockTimeout.tv_usec = 0;
+				pSelectTimeout = &lockTimeout;
+			}
+		}
+
 		FD_ZERO (&rfds);
 		FD_SET (g_signotify_pipe[0], &rfds);
 		int maxFD = g_signotify_pipe[0];
@@ -1680,7 +1738,7 @@ int main(int argc, char**argv)
 		if(g_debugPrints)
 			printf("INFO : Waiting for child process\n");
 
-		// NOTE: Infinite timeout select below
+		// NOTE: Infinite timeout select below, unless we are waiting to give up the lock
 		int ret;
 
 		// FIXME: we need to add a timeout below
@@ -1693,7 +1751,7 @@ int main(int argc, char**argv)
 		// if the child doesn't die during that time, then kill -9 it
 		// send information about kill -9 to SSM, since this is a really 
 		// bad case.
-  		ret = select(maxFD + 1, &rfds, NULL, NULL, NULL);
+  		ret = select(maxFD + 1, &rfds, NULL, NULL, pSelectTimeout);
 
 		// Handle Errors in select
 		if (ret<0)
@@ -1702,6 +1760,10 @@ int main(int argc, char**argv)
 			continue;
 		}
 
+		// Time to give up the lock
+		if (ret==0)
+			continue;
+
 
 		// Handle SSM socket activity
 		if((ssmSocket!=-1) && FD_ISSET(ssmSocket, &rfds))
@@ -2113,13 +2175,14 @@ int main(int argc, char**argv)
 							printf("INFO : No action taken on SIGUSR1 from child X server\n");
 					}
 
-					// delay a bit to give time for the driver to initialize.
+					// Keep the lock for a bit, to give time for the driver to initialize.
 					// this takes more time compared to just X server startup.
 					// X server possibly allows connections before the driver completely inits
-					sleep(XSERVER_LOCK_DELAY);
-
-					// free our X server lock so that other X servers can start
-					free_lock();
+					//
+					// The lock is given up from the top of the loop, so that we don't
+					// delay telling the SSM that we're up. That way, clients can use
+					// this X server while the next one is starting.
+					g_lockReleaseTime = time(NULL) + XSERVER_LOCK_DELAY;
 
 					//
 					// Record the name of the user for whom this X server is intended in /var/run/vizstack/rgsuser
@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+#
+# Load generator and throughput benchmark for the SSM.
+#
+# This starts an SSM with a generated node configuration of many nodes,
+# which uses the local scheduler. Simulated users then run cycles of
+#
+#     allocate, setupViz, waitXState, deallocate
+#
+# while simulated vs-X processes connect as X clients of the allocated X
+# servers, and send update_x_avail to tell the SSM that they are up. The
+# SSM asks them to exit when the allocation is freed, as it does vs-X.
+#
+# At the end, the throughput, the latency of each request seen by the
+# users, the time the SSM took for each request, and the CPU time used
+# are printed. Run the same benchmark before and after a change to the
+# SSM's main loop or message handling to compare the two.
+#
+# This needs to run as root (the X clients and get_metrics need it), with
+# no other SSM running. The master configuration needs to name a master
+# host and a TCP port, not localhost: an SSM with a localhost master only
+# manages the node 'localhost', so it refuses the generated nodes. Run it
+# from this directory as
+#
+#     PYTHONPATH=../python python benchmark_ssm.py [options]
+#
+
+import os
+import sys
+import time
+import socket
+import select
+import signal
+import shutil
+import tempfile
+import threading
+import subprocess
+import Queue
+from optparse import OptionParser
+import vsapi
+
+GPU_MODEL = "Quadro FX 5800"
+SSM_START_TIMEOUT = 60
+SSM_STOP_TIMEOUT = 10
+
+# The requests the simulated users make, in the order they make them
+USER_REQUESTS = ["allocate", "update_serverconfig", "wait_x_state", "deallocate"]
+
+def generateNodeConfig(numNodes, gpusPerNode):
+	"""
+	Returns a node configuration of numNodes nodes with gpusPerNode GPUs
+	each, with one X server per GPU. All the nodes use the local scheduler.
+	"""
+	nodes = []
+	for nodeIndex in range(numNodes):
+		content = '<hostname>bench%d</hostname><model>Benchmark</model><weight>0</weight>'%(nodeIndex)
+		for gpuIndex in range(gpusPerNode):
+			content += '<gpu><index>%d</index><model>%s</model><busID>PCI:%d:0:0</busID><useScanOut>1</useScanOut></gpu>'%(gpuIndex, GPU_MODEL, gpuIndex+1)
+		content += '<keyboard><index>0</index><type>SystemKeyboard</type></keyboard>'
+		content += '<mouse><index>0</index><type>SystemMouse</type></mouse>'
+		content += '<x_server><type>normal</type><range><from>0</from><to>%d</to></range></x_server>'%(gpusPerNode-1)
+		nodes.append('<node>%s</node>'%(content))
+	scheduler = '<scheduler><type>local</type>%s</scheduler>'%(''.join(map(lambda x: '<node>bench%d</node>'%(x), range(numNodes))))
+	return '<?xml version="1.0" ?><nodeconfig><nodes>%s</nodes>%s</nodeconfig>'%('\n'.join(nodes), scheduler)
+
+def connectToSSM(encoding, timeout=0):
+	"""
+	Connect to the SSM, retrying for timeout seconds while it comes up.
+	"""
+	startTime = time.time()
+	while True:
+		try:
+			return vsapi.ResourceAccess(encoding=encoding)
+		except vsapi.VizError, e:
+			if time.time()-startTime>=timeout:
+				raise
+			time.sleep(0.5)
+
+def checkMasterConfig():
+	"""
+	Check that the SSM can be started with the generated node configuration.
+	With a localhost master, the SSM accepts only the node 'localhost'.
+	"""
+	try:
+		master, port, auth = vsapi.getMasterParameters()
+	except ValueError, e:
+		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "Bad master configuration %s : %s"%(vsapi.masterConfigFile, str(e)))
+	if master == "localhost":
+		raise vsapi.VizError(vsapi.VizError.BAD_CONFIGURATION, "The master in %s is localhost. The SSM would then refuse the generated nodes, so set the master to this host's name and master_port to a TCP port, or use --no-start with an SSM that is running already."%(vsapi.masterConfigFile))
+
+def startSSM(options, workDir):
+	nodeFile = os.path.join(workDir, 'node_config.xml')
+	rgFile = os.path.join(workDir, 'resource_group_config.xml')
+	open(nodeFile, 'w').write(generateNodeConfig(options.nodes, options.gpus_per_node))
+	open(rgFile, 'w').write('<?xml version="1.0" ?><resourcegroupconfig></resourcegroupconfig>')
+
+	cmd = [sys.executable, options.ssm, '--node-config=%s'%(nodeFile), '--resource-group-config=%s'%(rgFile)]
+	if options.templates is not None:
+		cmd.append('--system-templates=%s'%(options.templates))
+	if options.ssm_args is not None:
+		cmd += options.ssm_args.split()
+	cmd.append('nodaemon')
+
+	logFile = open(os.path.join(workDir, 'ssm.log'), 'w')
+	proc = subprocess.Popen(cmd, stdout=logFile, stderr=subprocess.STDOUT)
+	logFile.close()
+
+	startTime = time.time()
+	while True:
+		if proc.poll() is not None:
+			raise vsapi.VizError(vsapi.VizError.INTERNAL_ERROR, "The SSM exited with status %d. See %s"%(proc.returncode, os.path.join(workDir, 'ssm.log')))
+		try:
+			ra = connectToSSM(options.encoding)
+			ra.stop()
+			return proc
+		except vsapi.VizError, e:
+			if time.time()-startTime>SSM_START_TIMEOUT:
+				stopSSM(proc)
+				raise
+			time.sleep(0.5)
+
+def stopSSM(proc):
+	# The SSM shuts down cleanly on SIGINT
+	os.kill(proc.pid, signal.SIGINT)
+	startTime = time.time()
+	while proc.poll() is None:
+		if time.time()-startTime>SSM_STOP_TIMEOUT:
+			os.kill(proc.pid, signal.SIGKILL)
+			proc.wait()
+			break
+		time.sleep(0.1)
+
+def getCPUTime(pid):
+	"""
+	Returns [user, system] CPU seconds used by process pid so far.
+	"""
+	stat = open('/proc/%d/stat'%(pid)).read()
+	# The command name may have spaces ; fields after it are fixed
+	fields = stat[stat.rindex(')')+2:].split()
+	ticks = float(os.sysconf('SC_CLK_TCK'))
+	return [int(fields[11])/ticks, int(fields[12])/ticks]
+
+def getRequestTimes(ra):
+	"""
+	Returns { request : [count, seconds] } from the SSM's metrics.
+	"""
+	ret = {}
+	prefix = 'vizstack_ssm_request_duration_seconds_'
+	for line in ra.getMetrics().split('\n'):
+		if not line.startswith(prefix):
+			continue
+		name, value = line.rsplit(' ', 1)
+		kind, labels = name[len(prefix):].split('{', 1)
+		if kind not in ['count', 'sum']:
+			continue
+		request = labels.split('"')[1]
+		if not ret.has_key(request):
+			ret[request] = [0, 0.0]
+		if kind == 'count':
+			ret[request][0] = int(value)
+		else:
+			ret[request][1] = float(value)
+	return ret
+
+def percentile(values, fraction):
+	values = sorted(values)
+	return values[int(round(fraction*(len(values)-1)))]
+
+class Results:
+	"""
+	Latencies and errors seen by the simulated users and X clients.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.latencies = {}
+		self.cycles = 0
+		self.xUpdates = 0
+		self.errors = []
+
+	def addLatency(self, request, seconds):
+		self.lock.acquire()
+		if not self.latencies.has_key(request):
+			self.latencies[request] = []
+		self.latencies[request].append(seconds)
+		self.lock.release()
+
+	def addCycle(self):
+		self.lock.acquire()
+		self.cycles += 1
+		self.lock.release()
+
+	def addXUpdate(self):
+		self.lock.acquire()
+		self.xUpdates += 1
+		self.lock.release()
+
+	def addError(self, msg):
+		self.lock.acquire()
+		self.errors.append(msg)
+		self.lock.release()
+
+class SimulatedXClient(threading.Thread):
+	"""
+	Acts as vs-X for the X servers it is given : connects to the SSM as
+	their X client, says that the X server is up, and goes away when the
+	SSM asks it to.
+	"""
+	def __init__(self, ra, jobs, results, stopEvent):
+		threading.Thread.__init__(self)
+		self.masterHost = ra.masterHost
+		self.masterPort = ra.masterPort
+		self.masterAuth = ra.masterAuth
+		self.jobs = jobs
+		self.results = results
+		self.stopEvent = stopEvent
+		self.sockets = []
+
+	def connect(self, srv, allocId):
+		payload = '<xclient>%s<allocId>%d</allocId></xclient>'%(srv.serializeToXML(), allocId)
+		if self.masterHost == "localhost":
+			sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			sock.connect(vsapi.SSM_UNIX_SOCKET_ADDRESS)
+		else:
+			sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			sock.connect((self.masterHost, int(self.masterPort)))
+			payload = vsapi.encode_message_with_auth(self.masterAuth, payload)
+		vsapi.sendMessageOnSocket(sock, payload)
+		return sock
+
+	def closeFinished(self, timeout):
+		if len(self.sockets)==0:
+			return
+		# The SSM asks an X client to exit by closing its end of the socket
+		ready, w, e = select.select(self.sockets, [], [], timeout)
+		for sock in ready:
+			try:
+				data = sock.recv(1)
+			except socket.error:
+				data = ''
+			if len(data)==0:
+				sock.close()
+				self.sockets.remove(sock)
+
+	def run(self):
+		while (not self.stopEvent.isSet()) or (len(self.sockets)>0):
+			self.closeFinished(0)
+			try:
+				srv, allocId = self.jobs.get(True, 0.02)
+			except Queue.Empty:
+				if self.stopEvent.isSet():
+					self.closeFinished(0.1)
+				continue
+			try:
+				sock = self.connect(srv, allocId)
+				vsapi.sendMessageOnSocket(sock, '<ssm><update_x_avail><newState>1</newState>%s</update_x_avail></ssm>'%(srv.serializeToXML()))
+				self.sockets.append(sock)
+				self.results.addXUpdate()
+			except socket.error, e:
+				self.results.addError('X client for %s : %s'%(srv, str(e)))
+
+class SimulatedUser(threading.Thread):
+	"""
+	Allocates X servers, sets them up, waits for them to be started by the
+	simulated X clients, and frees them, till the deadline.
+	"""
+	def __init__(self, options, jobs, results, deadline):
+		threading.Thread.__init__(self)
+		self.options = options
+		self.jobs = jobs
+		self.results = results
+		self.deadline = deadline
+
+	def timed(self, request, func, *args):
+		startTime = time.time()
+		ret = func(*args)
+		self.results.addLatency(request, time.time()-startTime)
+		return ret
+
+	def cycle(self, ra):
+		alloc = self.timed('allocate', ra.allocate, [[vsapi.Server()]*self.options.servers])
+		try:
+			self.timed('update_serverconfig', alloc.setupViz, ra)
+			for srv in alloc.getResources()[0]:
+				self.jobs.put([srv, alloc.getId()])
+			self.timed('wait_x_state', ra.waitXState, alloc, 1, self.options.x_timeout)
+		finally:
+			self.timed('deallocate', ra.deallocate, alloc)
+		self.results.addCycle()
+
+	def run(self):
+		try:
+			ra = connectToSSM(self.options.encoding)
+		except vsapi.VizError, e:
+			self.results.addError(str(e))
+			return
+		while time.time()<self.deadline:
+			try:
+				self.cycle(ra)
+			except vsapi.VizError, e:
+				self.results.addError(str(e))
+		ra.stop()
+
+def printReport(options, results, elapsed, requestTimes, ssmCPU, ownCPU):
+	numRequests = 0
+	for request in USER_REQUESTS:
+		numRequests += len(results.latencies.get(request, []))
+
+	print 'Clients           : %d users, %d X clients, %d server(s) per allocation, %s encoding'%(options.clients, options.x_clients, options.servers, options.encoding)
+	print 'Nodes             : %d, with %d GPUs each'%(options.nodes, options.gpus_per_node)
+	print 'Duration          : %.1f seconds'%(elapsed)
+	print 'Cycles            : %d (%.1f/s)'%(results.cycles, results.cycles/elapsed)
+	print 'Requests          : %d (%.1f/s)'%(numRequests, numRequests/elapsed)
+	print 'update_x_avail    : %d (%.1f/s)'%(results.xUpdates, results.xUpdates/elapsed)
+	print 'Errors            : %d'%(len(results.errors))
+	for msg in results.errors[:5]:
+		print '  %s'%(msg)
+	print
+	print '%-20s %8s %10s %10s %10s'%('Request', 'Count', 'p50 (ms)', 'p99 (ms)', 'SSM (ms)')
+	for request in USER_REQUESTS+['update_x_avail']:
+		values = results.latencies.get(request, [])
+		if len(values)>0:
+			clientStats = '%8d %10.2f %10.2f'%(len(values), percentile(values, 0.5)*1000, percentile(values, 0.99)*1000)
+		else:
+			clientStats = '%8s %10s %10s'%('-', '-', '-')
+		count, total = requestTimes.get(request, [0, 0.0])
+		if count>0:
+			ssmStats = '%10.2f'%(total/count*1000)
+		else:
+			ssmStats = '%10s'%('-')
+		print '%-20s %s %s'%(request, clientStats, ssmStats)
+	print
+	if ssmCPU is not None:
+		print 'SSM CPU time      : %.2f s user, %.2f s system (%.2f ms per request)'%(ssmCPU[0], ssmCPU[1], (ssmCPU[0]+ssmCPU[1])*1000/max(numRequests+results.xUpdates, 1))
+	print 'Benchmark CPU time: %.2f s user, %.2f s system'%(ownCPU[0], ownCPU[1])
+
+def runBenchmark(options, proc):
+	results = Results()
+	jobs = Queue.Queue()
+	stopEvent = threading.Event()
+
+	ra = connectToSSM(options.encoding)
+	startTimes = getRequestTimes(ra)
+	if proc is not None:
+		startCPU = getCPUTime(proc.pid)
+	startOwnCPU = os.times()
+
+	startTime = time.time()
+	deadline = startTime+options.duration
+	xclients = map(lambda x: SimulatedXClient(ra, jobs, results, stopEvent), range(options.x_clients))
+	users = map(lambda x: SimulatedUser(options, jobs, results, deadline), range(options.clients))
+	for t in xclients+users:
+		t.start()
+	for t in users:
+		t.join()
+	elapsed = time.time()-startTime
+	stopEvent.set()
+	for t in xclients:
+		t.join()
+
+	ownCPU = os.times()
+	ownCPU = [ownCPU[0]-startOwnCPU[0], ownCPU[1]-startOwnCPU[1]]
+	ssmCPU = None
+	if proc is not None:
+		ssmCPU = getCPUTime(proc.pid)
+		ssmCPU = [ssmCPU[0]-startCPU[0], ssmCPU[1]-startCPU[1]]
+	requestTimes = getRequestTimes(ra)
+	for request in startTimes:
+		requestTimes[request][0] -= startTimes[request][0]
+		requestTimes[request][1] -= startTimes[request][1]
+	ra.stop()
+
+	printReport(options, results, elapsed, requestTimes, ssmCPU, ownCPU)
+
+parser = OptionParser(usage="%prog [options]", description="Benchmark the SSM with simulated users and X clients.")
+parser.add_option("-c", "--clients", dest="clients", type="int", default=8, help="The number of simulated users. Defaults to 8.")
+parser.add_option("-x", "--x-clients", dest="x_clients", type="int", default=4, help="The number of simulated vs-X processes. Each acts for many X servers. Defaults to 4.")
+parser.add_option("-s", "--servers", dest="servers", type="int", default=1, help="The number of X servers each user allocates. Defaults to 1.")
+parser.add_option("-n", "--nodes", dest="nodes", type="int", default=64, help="The number of nodes in the generated configuration. Defaults to 64.")
+parser.add_option("-g", "--gpus-per-node", dest="gpus_per_node", type="int", default=4, help="The number of GPUs on each node. Defaults to 4.")
+parser.add_option("-d", "--duration", dest="duration", type="float", default=30, help="How long to run, in seconds. Defaults to 30.")
+parser.add_option("-e", "--encoding", dest="encoding", type="choice", choices=[vsapi.ENCODING_XML, vsapi.ENCODING_JSON], default=vsapi.ENCODING_XML, help="The message encoding the simulated users use. Defaults to %s."%(vsapi.ENCODING_XML))
+parser.add_option("--x-timeout", dest="x_timeout", type="int", default=30, help="How long users wait for their X servers, in seconds. Defaults to 30.")
+parser.add_option("--ssm", dest="ssm", type="string", default=os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), '..', 'sbin', 'vs-ssm')), help="The SSM to start. Defaults to the one in this source tree.")
+parser.add_option("--ssm-args", dest="ssm_args", type="string", default=None, help="More arguments for the SSM, e.g. \"--query-workers=2\".")
+parser.add_option("--templates", dest="templates", type="string", default=os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), '..', 'share', 'templates')), help="The system templates for the SSM. Defaults to the ones in this source tree.")
+parser.add_option("--no-start", dest="no_start", action="store_true", default=False, help="Use the SSM that is already running, instead of starting one. Its node configuration needs enough free X servers, and its CPU time is not reported.")
+parser.add_option("--keep", dest="keep", action="store_true", default=False, help="Keep the generated configuration and the SSM log.")
+(options, args) = parser.parse_args()
+
+if len(args)>0:
+	parser.error("Unexpected arguments : %s"%(' '.join(args)))
+for name in ['clients', 'servers', 'nodes', 'gpus_per_node']:
+	if getattr(options, name)<1:
+		parser.error("--%s needs to be at least 1"%(name.replace('_', '-')))
+if options.x_clients<1:
+	parser.error("--x-clients needs to be at least 1")
+if options.clients*options.servers>options.nodes*options.gpus_per_node:
+	parser.error("%d users can't each allocate %d X servers from %d nodes with %d GPUs"%(options.clients, options.servers, options.nodes, options.gpus_per_node))
+
+workDir = None
+proc = None
+try:
+	try:
+		if not options.no_start:
+			checkMasterConfig()
+			workDir = tempfile.mkdtemp(prefix='vs-benchmark-')
+			proc = startSSM(options, workDir)
+		runBenchmark(options, proc)
+	except vsapi.VizError, e:
+		print >>sys.stderr, str(e)
+		# Keep the SSM log to find out what went wrong
+		options.keep = True
+		sys.exit(1)
+finally:
+	if proc is not None:
+		stopSSM(proc)
+	if workDir is not None:
+		if options.keep:
+			print 'Configuration and SSM log are in %s'%(workDir)
+		else:
+			shutil.rmtree(workDir)
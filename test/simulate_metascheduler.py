@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+#
+# Offline simulator for the Metascheduler.
+#
+# This drives a Metascheduler directly, without an SSM or a cluster. The
+# nodes are generated : many of them, with as many GPUs as asked for. The
+# local scheduler stands in for the real one, as it doesn't run anything.
+#
+# Requests arrive and go away in simulated time. They are either generated
+# at random (with a seed, so a run can be repeated), or replayed from a
+# trace file with one JSON object per line :
+#
+#     {"arrival": 12.5, "duration": 600, "uid": 500,
+#      "resdesc": [[{"class": "gpu"}, {"class": "server"}]],
+#      "search_node": []}
+#
+# resdesc and search_node are as in a JSON allocate request to the SSM.
+# A request which can't be satisfied when it arrives is rejected; it isn't
+# retried. --save-trace writes the generated requests in this format.
+#
+# At the end, the time taken to allocate and free, the fraction of
+# requests satisfied, the fragmentation and the utilization of the nodes
+# are printed. A free GPU counts as unusable if there is no free X server
+# on its node to drive it. A rejected request counts as a fragmentation
+# failure if there were at least as many free GPUs as it asked for.
+#
+# Run it from this directory as
+#
+#     PYTHONPATH=../python python simulate_metascheduler.py [options]
+#
+
+import sys
+import time
+import heapq
+import random
+from optparse import OptionParser
+import vsapi
+import metascheduler
+import localscheduler
+
+REQUEST_CLASSES = [vsapi.GPU, vsapi.SLI, vsapi.Server, vsapi.Keyboard, vsapi.Mouse, vsapi.VizNode]
+
+# Kinds of generated requests, with how often each comes
+REQUEST_MIX = [
+	['gpu', 30],
+	['gpu_server', 30],
+	['multi_gpu', 15],
+	['multi_node', 20],
+	['whole_node', 5]
+]
+
+# Departures at a time are handled before arrivals at the same time
+DEPARTURE = 0
+ARRIVAL = 1
+
+def createNodes(numNodes, gpuCounts, numServers=None):
+	"""
+	Returns numNodes VizNodes. The number of GPUs on the nodes goes through
+	gpuCounts in turn. Each node has numServers X servers, or one X server
+	per GPU if numServers is None.
+	"""
+	nodes = []
+	for nodeIndex in range(numNodes):
+		numGPUs = gpuCounts[nodeIndex % len(gpuCounts)]
+		node = vsapi.VizNode('sim%d'%(nodeIndex), 'Simulated', 0)
+		for gpuIndex in range(numGPUs):
+			node.addResource(vsapi.GPU(gpuIndex, model='Quadro FX 5800', busID='PCI:%d:0:0'%(gpuIndex+1)))
+		node.addResource(vsapi.Keyboard(0, keyboardType='SystemKeyboard'))
+		node.addResource(vsapi.Mouse(0, mouseType='SystemMouse'))
+		if numServers is None:
+			nodeServers = numGPUs
+		else:
+			nodeServers = numServers
+		for serverIndex in range(nodeServers):
+			node.addResource(vsapi.Server(serverIndex))
+		nodes.append(node)
+	return nodes
+
+def generateRequest(rand, maxGPUs, maxNodes):
+	"""
+	Returns a random resource request, as passed to Metascheduler.allocate.
+	"""
+	total = sum(map(lambda x: x[1], REQUEST_MIX))
+	pick = rand.uniform(0, total)
+	for kind, weight in REQUEST_MIX:
+		pick -= weight
+		if pick <= 0:
+			break
+	if kind == 'gpu':
+		return [vsapi.GPU()]
+	elif kind == 'gpu_server':
+		return [[vsapi.GPU(), vsapi.Server()]]
+	elif kind == 'multi_gpu':
+		# Items in the same list come from the same node
+		return [[vsapi.GPU()]*rand.randint(2, max(maxGPUs, 2))+[vsapi.Server()]]
+	elif kind == 'multi_node':
+		return map(lambda x: [vsapi.GPU(), vsapi.Server()], range(rand.randint(2, max(maxNodes, 2))))
+	return [vsapi.VizNode()]
+
+def requestToDict(request):
+	resdesc = []
+	for req in request:
+		if type(req) is list:
+			resdesc.append(map(lambda x: x.toDict(), req))
+		else:
+			resdesc.append(req.toDict())
+	return resdesc
+
+def requestFromDict(resdesc):
+	request = []
+	for desc in resdesc:
+		if isinstance(desc, list):
+			request.append(map(lambda x: vsapi.deserializeVizResourceFromDict(x, REQUEST_CLASSES), desc))
+		else:
+			request.append(vsapi.deserializeVizResourceFromDict(desc, REQUEST_CLASSES))
+	return request
+
+def countGPUs(request):
+	count = 0
+	for req in request:
+		if type(req) is list:
+			count += len(vsapi.extractObjects(vsapi.GPU, req))
+		elif isinstance(req, vsapi.GPU):
+			count += 1
+	return count
+
+def generateTrace(options):
+	"""
+	Returns a list of requests arriving at random, with random durations.
+	Each request is a dictionary as in a trace file.
+	"""
+	rand = random.Random(options.seed)
+	maxGPUs = max(map(int, options.gpus_per_node.split(',')))
+	trace = []
+	arrival = 0.0
+	for index in range(options.requests):
+		arrival += rand.expovariate(options.rate)
+		request = generateRequest(rand, maxGPUs, options.max_nodes)
+		trace.append({
+			'arrival' : arrival,
+			'duration' : rand.expovariate(1.0/options.mean_duration),
+			'uid' : 500+rand.randrange(options.users),
+			'resdesc' : requestToDict(request),
+			'search_node' : []
+		})
+	return trace
+
+def loadTrace(fileName):
+	trace = []
+	lineNum = 0
+	for line in open(fileName).readlines():
+		lineNum += 1
+		line = line.strip()
+		if len(line)==0:
+			continue
+		try:
+			record = vsapi.decodeJSONMessage(line)
+			for name in ['arrival', 'duration', 'resdesc']:
+				if not record.has_key(name):
+					raise ValueError, "'%s' is missing"%(name)
+		except ValueError, e:
+			raise ValueError, "%s, line %d : %s"%(fileName, lineNum, str(e))
+		trace.append(record)
+	trace.sort(lambda x,y: cmp(x['arrival'], y['arrival']))
+	return trace
+
+def saveTrace(trace, fileName):
+	f = open(fileName, 'w')
+	for record in trace:
+		f.write(vsapi.encodeJSONMessage(record)+'\n')
+	f.close()
+
+def percentile(values, fraction):
+	values = sorted(values)
+	return values[int(round(fraction*(len(values)-1)))]
+
+class Simulation:
+	def __init__(self, nodes):
+		self.nodes = nodes
+		self.ms = metascheduler.Metascheduler(nodes, [localscheduler.LocalScheduler(map(lambda x: x.getHostName(), nodes), "")])
+		self.numGPUs = 0
+		for node in nodes:
+			self.numGPUs += len(node.getGPUs())
+
+		self.allocTimes = []
+		self.rejectTimes = []
+		self.deallocTimes = []
+		self.fragmentationFailures = 0
+		self.badRequests = 0
+		self.samples = []
+		self.numEvents = 0
+
+	def addEvent(self, events, simTime, kind, item):
+		# numEvents keeps events at the same time in the order they came
+		heapq.heappush(events, (simTime, kind, self.numEvents, item))
+		self.numEvents += 1
+
+	def getUsage(self):
+		"""
+		Returns [busyGPUs, busyNodes, freeGPUs, unusableGPUs], by looking at
+		every resource.
+		"""
+		busyGPUs = 0
+		busyNodes = 0
+		unusableGPUs = 0
+		for node in self.nodes:
+			freeGPUs = 0
+			freeServers = 0
+			nodeBusy = False
+			for res in node.getResources():
+				if res.isFree():
+					if isinstance(res, vsapi.GPU):
+						freeGPUs += 1
+					elif isinstance(res, vsapi.Server):
+						freeServers += 1
+				else:
+					nodeBusy = True
+					if isinstance(res, vsapi.GPU):
+						busyGPUs += 1
+			if nodeBusy:
+				busyNodes += 1
+			if freeServers == 0:
+				unusableGPUs += freeGPUs
+		return [busyGPUs, busyNodes, self.numGPUs-busyGPUs, unusableGPUs]
+
+	def sample(self, simTime):
+		self.samples.append([simTime, len(self.ms.allocations)]+self.getUsage())
+
+	def arrive(self, record, simTime, events):
+		try:
+			request = requestFromDict(record['resdesc'])
+		except ValueError, e:
+			self.badRequests += 1
+			return
+		userInfo = { 'uid' : record.get('uid', 500), 'gid' : record.get('uid', 500) }
+		startTime = time.time()
+		try:
+			allocObj = self.ms.allocate(request, userInfo, record.get('search_node', []))
+		except vsapi.VizError, e:
+			self.rejectTimes.append(time.time()-startTime)
+			# A failed allocation leaves everything as it was
+			numGPUs = countGPUs(request)
+			if (numGPUs>0) and (numGPUs<=self.getUsage()[2]):
+				self.fragmentationFailures += 1
+			return
+		self.allocTimes.append(time.time()-startTime)
+		self.addEvent(events, simTime+record['duration'], DEPARTURE, allocObj)
+
+	def depart(self, allocObj):
+		startTime = time.time()
+		self.ms.deallocate(allocObj)
+		self.deallocTimes.append(time.time()-startTime)
+
+	def run(self, trace, sampleInterval):
+		"""
+		Runs the requests in trace, sampling the utilization every
+		sampleInterval seconds of simulated time.
+		"""
+		events = []
+		for record in trace:
+			self.addEvent(events, record['arrival'], ARRIVAL, record)
+		nextSample = 0.0
+		# The simulation ends with the last arrival; allocations still
+		# held then aren't freed, so that the utilization isn't averaged
+		# over the time they take to go away
+		arrivalsLeft = len(trace)
+		while arrivalsLeft>0:
+			simTime, kind, seq, item = heapq.heappop(events)
+			while nextSample <= simTime:
+				self.sample(nextSample)
+				nextSample += sampleInterval
+			if kind == ARRIVAL:
+				self.arrive(item, simTime, events)
+				arrivalsLeft -= 1
+			else:
+				self.depart(item)
+
+def formatTimes(values):
+	if len(values)==0:
+		return '-'
+	return 'p50 %.2f ms, p99 %.2f ms, max %.2f ms'%(percentile(values, 0.5)*1000, percentile(values, 0.99)*1000, max(values)*1000)
+
+def printReport(sim, numRequests, maxRows):
+	numAllocated = len(sim.allocTimes)
+	numRejected = len(sim.rejectTimes)
+	numNodes = len(sim.nodes)
+	print 'Nodes             : %d, with %d GPUs in all'%(numNodes, sim.numGPUs)
+	print 'Requests          : %d'%(numRequests)
+	print 'Allocated         : %d (%.1f%%)'%(numAllocated, numAllocated*100.0/max(numRequests, 1))
+	print 'Rejected          : %d, %d of them with enough free GPUs'%(numRejected, sim.fragmentationFailures)
+	if sim.badRequests>0:
+		print 'Bad requests      : %d'%(sim.badRequests)
+	print 'Allocate time     : %s'%(formatTimes(sim.allocTimes))
+	print 'Reject time       : %s'%(formatTimes(sim.rejectTimes))
+	print 'Deallocate time   : %s'%(formatTimes(sim.deallocTimes))
+
+	# Samples are evenly spaced, so plain averages are averages over time
+	samples = sim.samples
+	meanBusyGPUs = sum(map(lambda x: x[2], samples))/float(len(samples))
+	meanBusyNodes = sum(map(lambda x: x[3], samples))/float(len(samples))
+	meanUnusable = sum(map(lambda x: x[5], samples))/float(len(samples))
+	print 'GPU utilization   : %.1f%% on average'%(meanBusyGPUs*100.0/sim.numGPUs)
+	print 'Node utilization  : %.1f%% on average'%(meanBusyNodes*100.0/numNodes)
+	print 'Unusable GPUs     : %.1f on average'%(meanUnusable)
+	print
+	print '%10s %8s %10s %10s %10s %10s'%('Time', 'Allocs', 'GPUs busy', 'Nodes busy', 'Free GPUs', 'Unusable')
+	step = max(1, (len(samples)+maxRows-1)/maxRows)
+	for simTime, numAllocs, busyGPUs, busyNodes, freeGPUs, unusableGPUs in samples[::step]:
+		print '%10.0f %8d %9.1f%% %9.1f%% %10d %10d'%(simTime, numAllocs, busyGPUs*100.0/sim.numGPUs, busyNodes*100.0/numNodes, freeGPUs, unusableGPUs)
+
+def saveSamples(samples, fileName):
+	f = open(fileName, 'w')
+	f.write('time,allocations,busy_gpus,busy_nodes,free_gpus,unusable_gpus\n')
+	for sample in samples:
+		f.write('%s\n'%(','.join(map(str, sample))))
+	f.close()
+
+parser = OptionParser(usage="%prog [options]", description="Simulate allocations with the Metascheduler, on generated nodes.")
+parser.add_option("-n", "--nodes", dest="nodes", type="int", default=500, help="The number of nodes. Defaults to 500.")
+parser.add_option("-g", "--gpus-per-node", dest="gpus_per_node", type="string", default="4", help="The number of GPUs on each node. A comma separated list, e.g. \"2,4,8\", makes nodes of each size in turn. Defaults to 4.")
+parser.add_option("-s", "--servers-per-node", dest="servers_per_node", type="int", default=None, help="The number of X servers on each node. Defaults to one per GPU. With fewer X servers, some free GPUs can't be used.")
+parser.add_option("-t", "--trace", dest="trace", type="string", default=None, help="Replay the requests in this file, instead of generating them.")
+parser.add_option("--save-trace", dest="save_trace", type="string", default=None, help="Save the requests to this file, to replay them later.")
+parser.add_option("-r", "--requests", dest="requests", type="int", default=5000, help="The number of requests to generate. Defaults to 5000.")
+parser.add_option("--rate", dest="rate", type="float", default=1.0, help="Requests arriving per second, on average. Defaults to 1.")
+parser.add_option("--mean-duration", dest="mean_duration", type="float", default=800, help="How long allocations are kept, on average, in seconds. Defaults to 800.")
+parser.add_option("--max-nodes", dest="max_nodes", type="int", default=8, help="The most nodes a generated request asks for. Defaults to 8.")
+parser.add_option("--users", dest="users", type="int", default=10, help="The number of users making the generated requests. Defaults to 10.")
+parser.add_option("--seed", dest="seed", type="int", default=0, help="Seed for generating the requests. Defaults to 0.")
+parser.add_option("--sample-interval", dest="sample_interval", type="float", default=60, help="Sample the utilization every so many simulated seconds. Defaults to 60.")
+parser.add_option("--csv", dest="csv", type="string", default=None, help="Write all the utilization samples to this file, as CSV.")
+parser.add_option("--rows", dest="rows", type="int", default=20, help="The most utilization samples to print. Defaults to 20.")
+(options, args) = parser.parse_args()
+
+if len(args)>0:
+	parser.error("Unexpected arguments : %s"%(' '.join(args)))
+try:
+	gpuCounts = map(int, options.gpus_per_node.split(','))
+except ValueError:
+	parser.error("--gpus-per-node needs to be a comma separated list of numbers")
+if (options.nodes<1) or (min(gpuCounts)<1):
+	parser.error("There need to be nodes, with GPUs")
+if (options.servers_per_node is not None) and (options.servers_per_node<0):
+	parser.error("--servers-per-node can't be negative")
+if (options.rate<=0) or (options.mean_duration<=0) or (options.sample_interval<=0):
+	parser.error("--rate, --mean-duration and --sample-interval need to be more than 0")
+if (options.requests<1) or (options.users<1) or (options.max_nodes<1) or (options.rows<1):
+	parser.error("--requests, --users, --max-nodes and --rows need to be at least 1")
+
+if options.trace is not None:
+	try:
+		trace = loadTrace(options.trace)
+	except (IOError, ValueError), e:
+		print >>sys.stderr, str(e)
+		sys.exit(1)
+	if len(trace)==0:
+		print >>sys.stderr, "There are no requests in %s"%(options.trace)
+		sys.exit(1)
+else:
+	trace = generateTrace(options)
+if options.save_trace is not None:
+	saveTrace(trace, options.save_trace)
+
+sim = Simulation(createNodes(options.nodes, gpuCounts, options.servers_per_node))
+sim.run(trace, options.sample_interval)
+printReport(sim, len(trace), options.rows)
+if options.csv is not None:
+	saveSamples(sim.samples, options.csv)
@@ -6,10 +6,12 @@ import sys
 
 ssmConn = None
 connectionIsGlobal = False
+connectionEncoding = vsapi.ENCODING_XML
+connectionFrameVersion = vsapi.FRAME_VERSION
 
 def doConnect():
 	global ssmConn
-	ssmConn = vsapi.ResourceAccess()
+	ssmConn = vsapi.ResourceAccess(encoding=connectionEncoding, frameVersion=connectionFrameVersion)
 
 def doDisconnect():
 	global ssmConn
@@ -375,6 +377,99 @@ class AllocationTestCases(unittest.TestCase):
 		if failed:
 			self.fail("Was able to allocate an RGS session extra compared to what is possible (%d)"%(len(allRGSServers)))
 
+	def test_00400_allocate_many_all_GPUs(self):
+		allGPUs = getResources(vsapi.GPU())
+		self.assertTrue(len(allGPUs)>0)
+		allocs = ssmConn.allocateMany(map(lambda x: [x], allGPUs))
+		self.assertEqual(len(allocs), len(allGPUs))
+		for i in range(len(allGPUs)):
+			self.assertEqual(allocs[i].getResources()[0].hashKey(), allGPUs[i].hashKey())
+		self.assertEqual(len(getAllocationList()), len(allGPUs))
+		ssmConn.deallocateMany(allocs)
+
+	def test_00401_allocate_many_all_or_nothing(self):
+		allGPUs = getResources(vsapi.GPU())
+		# One more GPU than there are
+		requests = map(lambda x: [vsapi.GPU()], allGPUs+[None])
+		self.assertRaises(vsapi.VizError, ssmConn.allocateMany, requests)
+		self.assertEqual(len(getAllocationList()), 0)
+
+	def test_00402_allocate_many_best_effort(self):
+		allGPUs = getResources(vsapi.GPU())
+		requests = map(lambda x: [vsapi.GPU()], allGPUs+[None])
+		results = ssmConn.allocateMany(requests, allOrNothing=False)
+		allocs = filter(lambda x: isinstance(x, vsapi.Allocation), results)
+		self.assertEqual(len(allocs), len(allGPUs))
+		self.assert_(isinstance(results[-1], vsapi.VizError))
+		ssmConn.deallocateMany(allocs)
+
+	def test_00403_deallocate_many_bad_id(self):
+		alloc = doAllocate([vsapi.GPU()])
+		# The good allocation is freed even if another ID is bad
+		self.assertRaises(vsapi.VizError, ssmConn.deallocateMany, [alloc, alloc.getId()+1000])
+		self.assertEqual(len(getAllocationList()), 0)
+
+	def test_00500_message_log(self):
+		# This needs to run as root
+		getResources(vsapi.GPU())
+		log = ssmConn.getMessageLog(10)
+		self.assert_(len(log)>0 and len(log)<=10)
+		self.assertEqual(log[-1]['request'], 'query_resource')
+		self.assert_(log[-1]['responseSize']>0)
+
+	def test_00600_query_follows_allocations(self):
+		gpu = getResources(vsapi.GPU())[0]
+		query = vsapi.GPU(gpu.getIndex(), gpu.getHostName())
+		self.assertEqual(getResources(query)[0].getOwners(), [])
+		self.allocObj = doAllocate([query])
+		# Repeated queries must not give stale answers
+		self.assertEqual(len(getResources(query)[0].getOwners()), 1)
+		self.freeResources()
+		self.assertEqual(getResources(query)[0].getOwners(), [])
+		# Nor are other queries mixed up with this one
+		self.assert_(isinstance(getResources(vsapi.Server())[0], vsapi.Server))
+
+	def test_00700_serverconfig_follows_updates(self):
+		self.allocObj = doAllocate([vsapi.Server()])
+		srv = self.allocObj.getResources()[0]
+		query = vsapi.Server(srv.getIndex(), srv.getHostName())
+		# The configuration stays after the server is freed, so this needs
+		# to differ from what an earlier run of this test set
+		if getResources(query)[0].x_extension_section_option.get('Composite') == 'Disable':
+			newValue = 'Enable'
+		else:
+			newValue = 'Disable'
+		srv.setXExtensionSectionOption('Composite', newValue)
+		ssmConn.updateServerConfig(self.allocObj.getId(), [srv])
+		# Queries see the new configuration right after the update
+		self.assertEqual(ssmConn.getServerConfig(query).x_extension_section_option, { 'Composite' : newValue })
+		self.assertEqual(getResources(query)[0].x_extension_section_option, { 'Composite' : newValue })
+
+	def test_00800_metrics(self):
+		# This needs to run as root
+		self.allocObj = doAllocate([vsapi.GPU()])
+		getResources(vsapi.GPU())
+		metrics = {}
+		for line in ssmConn.getMetrics().split('\n'):
+			if (len(line)>0) and (not line.startswith('#')):
+				name, value = line.rsplit(' ', 1)
+				metrics[name] = float(value)
+		self.assertEqual(metrics['vizstack_ssm_allocations'], 1)
+		self.assert_(metrics['vizstack_ssm_request_duration_seconds_count{request="query_resource"}']>0)
+		self.assert_(metrics['vizstack_ssm_request_duration_seconds_count{request="allocate"}']>0)
+		self.assert_(metrics['vizstack_ssm_main_loop_iteration_seconds_count']>0)
+		gpu = self.allocObj.getResources()[0]
+		self.assert_(metrics['vizstack_ssm_resources{node="%s",type="gpu",state="busy"}'%(gpu.getHostName())]>=1)
+
+	def test_00900_copy_allocated_gpu(self):
+		self.allocObj = doAllocate([[vsapi.Server(), vsapi.GPU()]])
+		srv, gpu = self.allocObj.getResources()[0]
+		# Scripts put allocated GPUs on screens, which copies them
+		scr = vsapi.Screen(0)
+		scr.setGPU(gpu)
+		srv.addScreen(scr)
+		self.assert_(scr.getGPUs()[0].ra is ssmConn)
+
 if __name__ == '__main__':
 	tl = unittest.TestLoader()
 	#tl.sortTestMethodsUsing(None) # disable sorting of tests
@@ -394,3 +489,17 @@ if __name__ == '__main__':
 	unittest.TextTestRunner().run(suite2)
 	doDisconnect()
 
+	print 'Running allcoation tests with a global SSM connection using the JSON encoding'
+	suite3 = tl.loadTestsFromTestCase(AllocationTestCases)
+	connectionEncoding = vsapi.ENCODING_JSON
+	doConnect()
+	unittest.TextTestRunner().run(suite3)
+	doDisconnect()
+
+	print 'Running allcoation tests with a global SSM connection using version 1 frames'
+	suite4 = tl.loadTestsFromTestCase(AllocationTestCases)
+	connectionEncoding = vsapi.ENCODING_XML
+	connectionFrameVersion = vsapi.LEGACY_FRAME_VERSION
+	doConnect()
+	unittest.TextTestRunner().run(suite4)
+	doDisconnect()
@@ -0,0 +1,88 @@
+import unittest
+import os
+import sha
+import vsapi
+import sessiontoken
+
+userInfo = { 'uid' : 500, 'gid' : 501 }
+
+class SessionTokenTestCases(unittest.TestCase):
+	def setUp(self):
+		self.key = sessiontoken.createKey()
+
+	def test_00100_valid_token(self):
+		token = sessiontoken.createToken(self.key, userInfo, '10.0.0.1', 60)
+		self.assertEqual(sessiontoken.checkToken(self.key, token, '10.0.0.1'), userInfo)
+		# Tokens come back from XML messages as unicode
+		self.assertEqual(sessiontoken.checkToken(self.key, unicode(token), '10.0.0.1'), userInfo)
+
+	def test_00200_other_host(self):
+		token = sessiontoken.createToken(self.key, userInfo, '10.0.0.1', 60)
+		self.assertRaises(ValueError, sessiontoken.checkToken, self.key, token, '10.0.0.2')
+		self.assertRaises(ValueError, sessiontoken.checkToken, self.key, token, None)
+
+	def test_00300_expiry(self):
+		token = sessiontoken.createToken(self.key, userInfo, '10.0.0.1', 60, curTime=1000)
+		self.assertEqual(sessiontoken.checkToken(self.key, token, '10.0.0.1', curTime=1059), userInfo)
+		self.assertRaises(ValueError, sessiontoken.checkToken, self.key, token, '10.0.0.1', curTime=1060)
+
+	def test_00400_tampering(self):
+		token = sessiontoken.createToken(self.key, userInfo, '10.0.0.1', 60)
+		# A token made with another key, e.g. by an SSM that was restarted
+		self.assertRaises(ValueError, sessiontoken.checkToken, sessiontoken.createKey(), token, '10.0.0.1')
+		# Another uid, with the old signature
+		payload, signature = token.split('.')
+		payload = payload.decode('base64').replace('500', '0', 1).encode('base64').replace('\n', '')
+		self.assertRaises(ValueError, sessiontoken.checkToken, self.key, '%s.%s'%(payload, signature), '10.0.0.1')
+		for badToken in ['', 'abc', 'a.b.c', '%s.'%(payload)]:
+			self.assertRaises(ValueError, sessiontoken.checkToken, self.key, badToken, '10.0.0.1')
+
+	def test_00500_sha1(self):
+		# Pythons without hashlib sign tokens using the sha module
+		oldMethod = sessiontoken.digestMethod
+		sessiontoken.digestMethod = sha
+		try:
+			token = sessiontoken.createToken(self.key, userInfo, '10.0.0.1', 60)
+			self.assertEqual(sessiontoken.checkToken(self.key, token, '10.0.0.1'), userInfo)
+		finally:
+			sessiontoken.digestMethod = oldMethod
+		self.assertRaises(ValueError, sessiontoken.checkToken, self.key, token, '10.0.0.1')
+
+class MungeProgramTestCases(unittest.TestCase):
+	#
+	# These use the fake munge and unmunge in fakemunge/, so they don't need
+	# munged. They check how we use the programs, not munge itself.
+	#
+	def setUp(self):
+		self.oldPath = os.environ['PATH']
+		self.oldLibrary = vsapi.mungeLibrary
+		fakeDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakemunge')
+		os.environ['PATH'] = '%s:%s'%(fakeDir, self.oldPath)
+		vsapi.mungeLibrary = None
+
+	def tearDown(self):
+		os.environ['PATH'] = self.oldPath
+		vsapi.mungeLibrary = self.oldLibrary
+
+	def test_00100_round_trip(self):
+		message = '<client><cleanupOnDisconnect>1</cleanupOnDisconnect></client>'
+		credential = vsapi.encode_message_with_auth('Munge', message)
+		errcode, decodedUserInfo, decodedMessage = vsapi.decode_message_with_auth('Munge', credential)
+		self.assertEqual(errcode, 0)
+		self.assertEqual(decodedUserInfo, { 'uid' : os.getuid(), 'gid' : os.getgid() })
+		self.assertEqual(decodedMessage, message)
+
+	def test_00200_bad_credential(self):
+		errcode, decodedUserInfo, decodedMessage = vsapi.decode_message_with_auth('Munge', 'MUNGE:garbage\n')
+		self.assertNotEqual(errcode, 0)
+		self.assertEqual(decodedUserInfo, None)
+
+if __name__ == '__main__':
+	tl = unittest.TestLoader()
+	suite1 = tl.loadTestsFromTestCase(SessionTokenTestCases)
+	suite2 = tl.loadTestsFromTestCase(MungeProgramTestCases)
+
+	print 'Running session token tests'
+	unittest.TextTestRunner().run(suite1)
+	print 'Running munge program tests'
+	unittest.TextTestRunner().run(suite2)
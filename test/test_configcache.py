@@ -0,0 +1,79 @@
+import unittest
+import os
+import shutil
+import tempfile
+import vsutil
+
+class ConfigCacheTestCases(unittest.TestCase):
+	def setUp(self):
+		self.tmpDir = tempfile.mkdtemp()
+		self.cacheFile = os.path.join(self.tmpDir, 'cache', 'config_cache')
+		self.files = []
+		for i in range(2):
+			fname = os.path.join(self.tmpDir, 'file%d.xml'%(i))
+			open(fname, 'w').write('contents %d'%(i))
+			self.files.append(fname)
+		self.built = []
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpDir)
+
+	def getAll(self):
+		"""
+		Load the cache, get an object for each file and save the cache
+		"""
+		cache = vsutil.ConfigCache(self.cacheFile)
+		values = []
+		for fname in self.files:
+			values.append(cache.get('test', [fname], lambda:self.build(fname)))
+		cache.save()
+		return values
+
+	def build(self, fname):
+		self.built.append(fname)
+		return open(fname).read()
+
+	def test_00100_reuse(self):
+		self.assertEqual(self.getAll(), ['contents 0', 'contents 1'])
+		self.assertEqual(self.built, self.files)
+		self.built = []
+		self.assertEqual(self.getAll(), ['contents 0', 'contents 1'])
+		self.assertEqual(self.built, [])
+
+	def test_00200_rebuild_changed(self):
+		self.getAll()
+		self.built = []
+		open(self.files[1], 'w').write('new contents')
+		self.assertEqual(self.getAll(), ['contents 0', 'new contents'])
+		self.assertEqual(self.built, [self.files[1]])
+
+	def test_00300_depends_on_all_inputs(self):
+		cache = vsutil.ConfigCache(self.cacheFile)
+		cache.get('test', self.files, lambda:self.build(self.files[0]))
+		cache.save()
+		open(self.files[1], 'w').write('new contents')
+		self.built = []
+		cache = vsutil.ConfigCache(self.cacheFile)
+		cache.get('test', self.files, lambda:self.build(self.files[0]))
+		self.assertEqual(self.built, [self.files[0]])
+
+	def test_00400_untrusted_cache_ignored(self):
+		self.getAll()
+		self.built = []
+		os.chmod(self.cacheFile, 0666)
+		self.getAll()
+		self.assertEqual(self.built, self.files)
+
+	def test_00500_bad_cache_ignored(self):
+		self.getAll()
+		self.built = []
+		open(self.cacheFile, 'w').write('garbage')
+		self.assertEqual(self.getAll(), ['contents 0', 'contents 1'])
+		self.assertEqual(self.built, self.files)
+
+if __name__ == '__main__':
+	tl = unittest.TestLoader()
+	suite1 = tl.loadTestsFromTestCase(ConfigCacheTestCases)
+
+	print 'Running configuration cache tests'
+	unittest.TextTestRunner().run(suite1)
@@ -0,0 +1,158 @@
+import unittest
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import vsapi
+import vsutil
+import localscheduler
+
+FAKE_NVIDIA_SETTINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakenvidia', 'nvidia-settings')
+
+class FakeLauncher:
+	"""
+	Runs nvidia-settings as the fake one, makes xprop find a window manager,
+	and runs everything else as 'true'
+	"""
+	def run(self, args, node, inFile=None, outFile=None, errFile=None, launcherEnv=None):
+		if args[0] == vsutil.NVIDIA_SETTINGS:
+			args = [FAKE_NVIDIA_SETTINGS] + args[1:]
+		elif 'xprop' in args:
+			args = ['echo', '_NET_SUPPORTING_WM_CHECK(WINDOW): window id # 0x1400001']
+		else:
+			args = ['true']
+		return localscheduler.VizProcess(subprocess.Popen(args, stdout=outFile, stderr=errFile, close_fds=True))
+
+def createServer(serverIndex, numGPUs):
+	srv = vsapi.Server(serverIndex, 'node1')
+	scr = vsapi.Screen(0)
+	gpus = []
+	for gpuIndex in range(numGPUs):
+		gpu = vsapi.GPU(serverIndex*numGPUs+gpuIndex, 'node1')
+		gpu.setSchedulable(vsapi.Schedulable(FakeLauncher(), 'node1'))
+		gpus.append(gpu)
+	scr.setGPUs(gpus)
+	srv.addScreen(scr)
+	return srv
+
+class FrameLockTestCases(unittest.TestCase):
+	def setUp(self):
+		self.tmpDir = tempfile.mkdtemp()
+		self.statePath = os.path.join(self.tmpDir, 'state')
+		self.logPath = os.path.join(self.tmpDir, 'log')
+		os.environ['FAKE_NVS_STATE'] = self.statePath
+		os.environ['FAKE_NVS_LOG'] = self.logPath
+		self.servers = [createServer(0, 2), createServer(1, 2)]
+		state = {}
+		for srv in self.servers:
+			display = srv.getDISPLAY()
+			state[(display, 'FrameLockSyncRate')] = '0'
+			for gpuIndex in range(2):
+				state[(display, '[gpu:%d]/EnabledDisplays'%(gpuIndex))] = '0x00010000' # DFP-0
+				state[(display, '[gpu:%d]/RefreshRate3[DFP-0]'%(gpuIndex))] = '60.000'
+				state[(display, '[gpu:%d]/FrameLockAvailable'%(gpuIndex))] = '1'
+				state[(display, '[gpu:%d]/FrameLockEnable'%(gpuIndex))] = '0'
+		self.setState(state)
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpDir)
+		del os.environ['FAKE_NVS_STATE']
+		del os.environ['FAKE_NVS_LOG']
+
+	def setState(self, state):
+		f = open(self.statePath, 'w')
+		for key in state:
+			f.write('%s %s %s\n'%(key[0], key[1], state[key]))
+		f.close()
+
+	def getState(self):
+		state = {}
+		for line in open(self.statePath).read().split('\n'):
+			parts = line.split(' ')
+			if len(parts)==3:
+				state[(parts[0], parts[1])] = parts[2]
+		return state
+
+	def getRuns(self):
+		if not os.path.exists(self.logPath):
+			return []
+		return open(self.logPath).read().split('\n')[:-1]
+
+	def test_00100_parse(self):
+		output = """
+  Attribute 'EnabledDisplays' (node1:0[gpu:1]): 0x00010001.
+    'EnabledDisplays' is a bitmask attribute.
+
+  Attribute 'RefreshRate3' (node1:0[gpu:1]; display device: DFP-0): 59.950 Hz.
+
+  Attribute 'FrameLockSyncRate' (node1:0.0): 60000.
+"""
+		self.assertEqual(vsutil.parseNVSettingsOutput(output), {
+			('EnabledDisplays', 1, None) : '0x00010001.',
+			('RefreshRate3', 1, 'DFP-0') : '59.950 Hz.',
+			('FrameLockSyncRate', None, None) : '60000.' })
+
+	def test_00200_one_query_per_server(self):
+		self.assert_(vsutil.isFrameLockAvailable(self.servers))
+		runs = self.getRuns()
+		self.assertEqual(len(runs), 2)
+		self.assertEqual(sorted(map(lambda x:x.split(' ')[1], runs)), ['--display=:0', '--display=:1'])
+
+		state = self.getState()
+		del state[(':1', '[gpu:1]/FrameLockAvailable')]
+		self.setState(state)
+		self.failIf(vsutil.isFrameLockAvailable(self.servers))
+
+	def test_00300_enable(self):
+		# Make it look like framelock worked
+		state = self.getState()
+		for srv in self.servers:
+			state[(srv.getDISPLAY(), 'FrameLockSyncRate')] = '60000'
+		self.setState(state)
+
+		timings = []
+		startTime = time.time()
+		rate, message = vsutil.enableFrameLock(self.servers, timings)
+		# No waiting for the window manager, since it is already running
+		self.assert_(time.time()-startTime < vsutil.WINDOW_MANAGER_TIMEOUT)
+		self.assertEqual(map(lambda x:x[0], timings), ['query', 'master', 'slaves', 'enable', 'window_manager', 'test_signal', 'verify'])
+		self.assertEqual(rate, '60.000')
+		state = self.getState()
+		self.assertEqual(state[(':0', '[gpu:0]/FrameLockMaster')], '0x00010000')
+		self.assertEqual(state[(':0', '[gpu:1]/FrameLockMaster')], '0x00000000')
+		self.assertEqual(state[(':1', '[gpu:0]/FrameLockSlaves')], '0x00010000')
+		for srv in self.servers:
+			for gpuIndex in range(2):
+				self.assertEqual(state[(srv.getDISPLAY(), '[gpu:%d]/FrameLockEnable'%(gpuIndex))], '1')
+		# Query, set slaves, enable and check again are one run per server
+		# each. The master is set up before any slave, and the test signal is
+		# toggled after all GPUs are enabled.
+		runs = self.getRuns()
+		self.assertEqual(len(runs), 10)
+		self.assertEqual(runs[2], '--ctrl-display=:0 --display=:0 -a [gpu:0]/FrameLockMaster=0x00010000')
+		self.assert_(runs[7].endswith('-a [gpu:0]/FrameLockTestSignal=1 -a [gpu:0]/FrameLockTestSignal=0'))
+
+	def test_00400_disable(self):
+		state = self.getState()
+		for srv in self.servers:
+			for gpuIndex in range(2):
+				state[(srv.getDISPLAY(), '[gpu:%d]/FrameLockEnable'%(gpuIndex))] = '1'
+		self.setState(state)
+
+		timings = []
+		vsutil.disableFrameLock(self.servers, timings)
+		self.assertEqual(map(lambda x:x[0], timings), ['query', 'disable', 'reset', 'verify'])
+		state = self.getState()
+		for srv in self.servers:
+			for gpuIndex in range(2):
+				self.assertEqual(state[(srv.getDISPLAY(), '[gpu:%d]/FrameLockEnable'%(gpuIndex))], '0')
+				self.assertEqual(state[(srv.getDISPLAY(), '[gpu:%d]/FrameLockMaster'%(gpuIndex))], '0x00000000')
+		self.assertEqual(len(self.getRuns()), 8)
+
+if __name__ == '__main__':
+	tl = unittest.TestLoader()
+	suite1 = tl.loadTestsFromTestCase(FrameLockTestCases)
+
+	print 'Running frame lock tests'
+	unittest.TextTestRunner().run(suite1)
@@ -0,0 +1,88 @@
+import unittest
+import os
+import shutil
+import tempfile
+import ssmjournal
+
+class JournalTestCases(unittest.TestCase):
+	def setUp(self):
+		self.tmpDir = tempfile.mkdtemp()
+		self.journalDir = os.path.join(self.tmpDir, 'ssm')
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpDir)
+
+	def newJournal(self, snapshotInterval=ssmjournal.DEFAULT_SNAPSHOT_INTERVAL):
+		return ssmjournal.Journal(self.journalDir, snapshotInterval, sync=False)
+
+	def test_00100_empty(self):
+		journal = self.newJournal()
+		self.assertEqual(journal.load(), [None, []])
+		self.assert_(os.path.isdir(self.journalDir))
+
+	def test_00200_replay(self):
+		journal = self.newJournal()
+		journal.load()
+		journal.writeSnapshot({ 'allocations' : [] })
+		journal.append({ 'op' : 'allocate', 'allocId' : 1 })
+		journal.append({ 'op' : 'deallocate', 'allocId' : 1 })
+		journal.close()
+
+		journal = self.newJournal()
+		state, records = journal.load()
+		self.assertEqual(state, { 'allocations' : [] })
+		self.assertEqual(records, [{ 'op' : 'allocate', 'allocId' : 1, 'seq' : 1 }, { 'op' : 'deallocate', 'allocId' : 1, 'seq' : 2 }])
+		# Numbering continues where the last run left off
+		journal.writeSnapshot({ 'allocations' : [] })
+		journal.append({ 'op' : 'allocate', 'allocId' : 2 })
+		journal.close()
+		self.assertEqual(self.newJournal().load()[1], [{ 'op' : 'allocate', 'allocId' : 2, 'seq' : 3 }])
+
+	def test_00300_snapshot(self):
+		journal = self.newJournal(snapshotInterval=2)
+		journal.load()
+		journal.writeSnapshot({ 'allocations' : [] })
+		journal.append({ 'op' : 'allocate', 'allocId' : 1 })
+		self.failIf(journal.needsSnapshot())
+		journal.append({ 'op' : 'allocate', 'allocId' : 2 })
+		self.assert_(journal.needsSnapshot())
+		journal.writeSnapshot({ 'allocations' : [1, 2] })
+		self.failIf(journal.needsSnapshot())
+		journal.close()
+		self.assertEqual(self.newJournal().load(), [{ 'allocations' : [1, 2] }, []])
+
+	def test_00400_records_in_snapshot_are_skipped(self):
+		journal = self.newJournal()
+		journal.load()
+		journal.writeSnapshot({ 'allocations' : [] })
+		journal.append({ 'op' : 'allocate', 'allocId' : 1 })
+		journal.close()
+		# The SSM died after writing a snapshot, but before it could start
+		# a new journal
+		saved = open(journal.journalPath).read()
+		journal = self.newJournal()
+		journal.load()
+		journal.writeSnapshot({ 'allocations' : [1] })
+		journal.close()
+		open(journal.journalPath, 'w').write(saved)
+		self.assertEqual(self.newJournal().load(), [{ 'allocations' : [1] }, []])
+
+	def test_00500_partial_record(self):
+		journal = self.newJournal()
+		journal.load()
+		journal.writeSnapshot({})
+		journal.append({ 'op' : 'allocate', 'allocId' : 1 })
+		journal.close()
+		# A record cut short by a crash is ignored
+		open(journal.journalPath, 'a').write('{"op":"deall')
+		self.assertEqual(self.newJournal().load()[1], [{ 'op' : 'allocate', 'allocId' : 1, 'seq' : 1 }])
+		# Bad records elsewhere are errors
+		open(journal.journalPath, 'a').write('\n')
+		self.assertRaises(ValueError, self.newJournal().load)
+
+if __name__ == '__main__':
+	tl = unittest.TestLoader()
+	suite1 = tl.loadTestsFromTestCase(JournalTestCases)
+
+	print 'Running journal tests'
+	unittest.TextTestRunner().run(suite1)
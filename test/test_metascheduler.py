@@ -0,0 +1,232 @@
+import unittest
+import vsapi
+import metascheduler
+import localscheduler
+
+userInfo = { 'uid' : 500, 'gid' : 500 }
+
+def createNodes(numNodes):
+	nodes = []
+	for nodeIndex in range(numNodes):
+		node = vsapi.VizNode('node%d'%(nodeIndex), 'Test', nodeIndex)
+		for gpuIndex in range(2):
+			node.addResource(vsapi.GPU(gpuIndex, model='Quadro FX 5800', busID='PCI:%d:0:0'%(gpuIndex+1)))
+		node.addResource(vsapi.Keyboard(0, keyboardType='SystemKeyboard'))
+		for serverIndex in range(2):
+			node.addResource(vsapi.Server(serverIndex))
+		nodes.append(node)
+	return nodes
+
+class FailingScheduler(localscheduler.LocalScheduler):
+	def allocate(self, uid, gid, nodeList):
+		raise vsapi.VizError(vsapi.VizError.RESOURCE_UNAVAILABLE, "No nodes for you")
+
+class MetaschedulerTestCases(unittest.TestCase):
+	def setUp(self):
+		self.nodes = createNodes(3)
+		self.nodeNames = map(lambda x: x.getHostName(), self.nodes)
+		self.ms = metascheduler.Metascheduler(self.nodes, [localscheduler.LocalScheduler(self.nodeNames, "")])
+
+	def getState(self):
+		state = {}
+		for key in self.ms.infoTable:
+			res = self.ms.infoTable[key]
+			state[key] = [sorted(res.getOwners()), res.isShared()]
+		return state
+
+	def getIndexedKeys(self):
+		keys = []
+		for nodeIndex in self.ms.freeIndex.values():
+			for classIndex in nodeIndex.values():
+				keys += classIndex.keys()
+		return sorted(keys)
+
+	def assertIndexIsCorrect(self):
+		freeKeys = filter(lambda x: self.ms.infoTable[x].isFree(), self.ms.infoTable.keys())
+		self.assertEqual(self.getIndexedKeys(), sorted(freeKeys))
+
+	def test_00100_index_follows_allocations(self):
+		self.assertEqual(len(self.getIndexedKeys()), 15)
+		alloc1 = self.ms.allocate([[vsapi.GPU(), vsapi.Server()]], userInfo, [])
+		self.assertIndexIsCorrect()
+		alloc2 = self.ms.allocate([vsapi.GPU(1, 'node2')], userInfo, [])
+		self.assertIndexIsCorrect()
+		self.failIf(self.ms.freeIndex['node2']['gpu'].has_key(vsapi.GPU(1, 'node2').hashKey()))
+		self.ms.deallocate(alloc1)
+		self.ms.deallocate(alloc2)
+		self.assertIndexIsCorrect()
+		self.assertEqual(len(self.getIndexedKeys()), 15)
+
+	def test_00200_shared_gpu(self):
+		self.nodes[0].getGPUs()[0].setShareLimit(2)
+		self.ms = metascheduler.Metascheduler(self.nodes, [localscheduler.LocalScheduler(self.nodeNames, "")])
+		gpuKey = vsapi.GPU(0, 'node0').hashKey()
+		allocs = []
+		for i in range(2):
+			gpu = vsapi.GPU(0, 'node0')
+			gpu.setShared(True)
+			allocs.append(self.ms.allocate([gpu], userInfo, []))
+			self.assertIndexIsCorrect()
+		# The GPU stays free till its share limit is reached
+		self.failIf(self.ms.freeIndex['node0']['gpu'].has_key(gpuKey))
+		self.ms.deallocate(allocs[0])
+		self.assert_(self.ms.freeIndex['node0']['gpu'].has_key(gpuKey))
+		self.ms.deallocate(allocs[1])
+		self.assertIndexIsCorrect()
+
+	def test_00300_failure_leaves_state_unchanged(self):
+		alloc = self.ms.allocate([vsapi.GPU(0, 'node1')], userInfo, [])
+		before = self.getState()
+		# The first list can be satisfied, the second can't
+		request = [[vsapi.GPU(), vsapi.GPU()], [vsapi.GPU(), vsapi.GPU(), vsapi.GPU()]]
+		self.assertRaises(vsapi.VizError, self.ms.allocate, request, userInfo, [])
+		self.assertEqual(self.getState(), before)
+		self.assertIndexIsCorrect()
+		# Fixed resources are taken first; they need to be given back too
+		request = [vsapi.GPU(1, 'node1'), [vsapi.Server(hostName='node0'), vsapi.Server(hostName='node0'), vsapi.Server(hostName='node0')]]
+		self.assertRaises(vsapi.VizError, self.ms.allocate, request, userInfo, [])
+		self.assertEqual(self.getState(), before)
+		self.assertIndexIsCorrect()
+		self.ms.deallocate(alloc)
+
+	def test_00400_scheduler_failure_leaves_state_unchanged(self):
+		self.ms = metascheduler.Metascheduler(self.nodes, [FailingScheduler(self.nodeNames, "")])
+		before = self.getState()
+		self.assertRaises(vsapi.VizError, self.ms.allocate, [[vsapi.GPU(), vsapi.Server()]], userInfo, [])
+		self.assertEqual(self.getState(), before)
+		self.assertIndexIsCorrect()
+
+	def test_00500_whole_node(self):
+		alloc = self.ms.allocate([vsapi.GPU(1, 'node0')], userInfo, [])
+		nodeAlloc = self.ms.allocate([vsapi.VizNode()], userInfo, [])
+		allocatedNode = nodeAlloc.getResources()[0]
+		self.assertNotEqual(allocatedNode.getHostName(), 'node0')
+		self.assertEqual(self.ms.freeIndex[allocatedNode.getHostName()], { 'gpu' : {}, 'keyboard' : {}, 'server' : {} })
+		self.assertIndexIsCorrect()
+		self.ms.deallocate(nodeAlloc)
+		self.ms.deallocate(alloc)
+		self.assertIndexIsCorrect()
+
+	def test_00600_reserve_then_allocate_nodes(self):
+		pending = self.ms.reserve([vsapi.GPU(0, 'node0')], userInfo, [])
+		# Reserved resources can't be given to anyone else
+		self.assertRaises(vsapi.VizError, self.ms.allocate, [vsapi.GPU(0, 'node0')], userInfo, [])
+		self.assertIndexIsCorrect()
+		self.ms.allocateNodes(pending)
+		alloc = self.ms.finishAllocation(pending)
+		self.assertEqual(alloc.getResources()[0].hashKey(), vsapi.GPU(0, 'node0').hashKey())
+		self.ms.deallocate(alloc)
+		self.assertIndexIsCorrect()
+
+	def test_00700_cancel(self):
+		sched = self.ms.schedList[0]
+		before = self.getState()
+		pending = self.ms.reserve([[vsapi.GPU(), vsapi.Server()]], userInfo, [])
+		self.ms.allocateNodes(pending)
+		self.assertEqual(len(sched.allocations), 1)
+		self.ms.cancel(pending)
+		self.assertEqual(len(sched.allocations), 0)
+		self.assertEqual(self.getState(), before)
+		self.assertIndexIsCorrect()
+
+	def saveAndRestart(self, allocs):
+		# What the SSM's journal keeps goes through JSON
+		saved = vsapi.decodeJSONMessage(vsapi.encodeJSONMessage({ 'allocations' : map(lambda x: x.toDict(), allocs) }))['allocations']
+		self.ms.detach()
+		self.nodes = createNodes(3)
+		self.ms = metascheduler.Metascheduler(self.nodes, [localscheduler.LocalScheduler(self.nodeNames, "")])
+		return saved
+
+	def test_00800_restore(self):
+		self.nodes[1].getGPUs()[0].setShareLimit(2)
+		self.ms = metascheduler.Metascheduler(self.nodes, [localscheduler.LocalScheduler(self.nodeNames, "")])
+		sharedGPU = vsapi.GPU(0, 'node1')
+		sharedGPU.setShared(True)
+		allocs = [
+			self.ms.allocate([[vsapi.GPU(), vsapi.Server()]], userInfo, []),
+			self.ms.allocate([sharedGPU, vsapi.Keyboard()], userInfo, []),
+			self.ms.allocate([vsapi.VizNode()], userInfo, [])
+		]
+		before = self.getState()
+		saved = self.saveAndRestart(allocs)
+		self.nodes[1].getGPUs()[0].setShareLimit(2)
+		self.ms = metascheduler.Metascheduler(self.nodes, [localscheduler.LocalScheduler(self.nodeNames, "")])
+		results = self.ms.restoreAllocations(saved)
+		self.assertEqual(map(lambda x: x[1], results), [None, None, None])
+		self.assertEqual(self.getState(), before)
+		self.assertIndexIsCorrect()
+		# The restored allocations can be used and freed like any other
+		gpu = results[0][0].getResources()[0][0]
+		self.assert_(gpu.getSchedulable() is not None)
+		self.assertEqual(len(self.ms.schedList[0].allocations), 3)
+		for allocObj, errorMessage in results:
+			self.ms.deallocate(allocObj)
+		self.assertEqual(len(self.ms.schedList[0].allocations), 0)
+		self.assertEqual(len(self.getIndexedKeys()), 15)
+
+	def test_00900_restore_conflict(self):
+		allocs = [self.ms.allocate([vsapi.GPU(0, 'node0')], userInfo, []), self.ms.allocate([[vsapi.GPU(1, 'node0'), vsapi.Server(0, 'node0')]], userInfo, [])]
+		saved = self.saveAndRestart(allocs)
+		# Someone got the GPU in the meanwhile
+		other = self.ms.allocate([vsapi.GPU(1, 'node0')], userInfo, [])
+		before = self.getState()
+		# Resources which are no longer there can't be restored either
+		missing = vsapi.decodeJSONMessage(vsapi.encodeJSONMessage(saved[0]))
+		missing['resources'][0]['hostname'] = 'node9'
+		results = self.ms.restoreAllocations([saved[1], missing, saved[0]])
+		self.assertEqual(results[0][0], None)
+		self.assertEqual(results[1][0], None)
+		self.assert_(results[2][0] is not None)
+		self.ms.deallocate(results[2][0])
+		self.assertEqual(self.getState(), before)
+		self.assertIndexIsCorrect()
+		self.ms.deallocate(other)
+
+	def test_01000_lost_nodes(self):
+		# The scheduler can't take back a reservation it doesn't know
+		alloc = self.ms.allocate([vsapi.GPU(0, 'node0')], userInfo, [])
+		saved = self.saveAndRestart([alloc])
+		before = self.getState()
+		saved[0]['launchers'][0]['launcher']['class'] = 'SSHReservation'
+		results = self.ms.restoreAllocations(saved)
+		self.assertEqual(results[0][0], None)
+		self.assertEqual(self.getState(), before)
+		self.assertEqual(len(self.ms.schedList[0].allocations), 0)
+
+	def test_01100_allocation_bias(self):
+		for gpu in self.nodes[0].getGPUs():
+			self.ms.setAllocationBias(gpu.hashKey(), 100000)
+		# GPUs with a high bias are allocated last
+		alloc = self.ms.allocate([vsapi.GPU()], userInfo, [])
+		self.assertEqual(alloc.getResources()[0].getHostName(), 'node1')
+		self.ms.deallocate(alloc)
+		# Nodes stay usable as a whole
+		nodeAllocs = []
+		for i in range(3):
+			nodeAllocs.append(self.ms.allocate([vsapi.VizNode()], userInfo, []))
+		self.assertEqual(sorted(map(lambda x:x.getResources()[0].getHostName(), nodeAllocs)), self.nodeNames)
+		for nodeAlloc in nodeAllocs:
+			self.ms.deallocate(nodeAlloc)
+		self.assertRaises(KeyError, self.ms.setAllocationBias, vsapi.GPU(0, 'node9').hashKey(), 0)
+
+	def test_01200_node_generation(self):
+		before = map(self.ms.getNodeGeneration, self.nodeNames)
+		alloc = self.ms.allocate([vsapi.GPU(0, self.nodeNames[1])], userInfo, [])
+		after = map(self.ms.getNodeGeneration, self.nodeNames)
+		# Only the node whose GPU was allocated changes
+		self.assertEqual(map(lambda x,y: x!=y, before, after), [False, True, False])
+		self.ms.deallocate(alloc)
+		self.assertNotEqual(self.ms.getNodeGeneration(self.nodeNames[1]), after[1])
+		self.assertEqual(self.ms.getNodeGeneration(self.nodeNames[0]), before[0])
+		# Changes made outside the metascheduler count too
+		before = self.ms.getNodeGeneration(self.nodeNames[2])
+		self.ms.resourceModified(self.nodes[2].getResources()[0])
+		self.assertNotEqual(self.ms.getNodeGeneration(self.nodeNames[2]), before)
+		self.assertIndexIsCorrect()
+
+if __name__ == '__main__':
+	tl = unittest.TestLoader()
+	suite1 = tl.loadTestsFromTestCase(MetaschedulerTestCases)
+
+	print 'Running metascheduler tests'
+	unittest.TextTestRunner().run(suite1)
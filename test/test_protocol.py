@@ -0,0 +1,270 @@
+import unittest
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import vsapi
+
+class MessageReaderTestCases(unittest.TestCase):
+	def setUp(self):
+		self.sender, self.receiver = socket.socketpair()
+		self.receiver.setblocking(0)
+
+	def tearDown(self):
+		self.sender.close()
+		self.receiver.close()
+
+	def test_00100_complete_message(self):
+		reader = vsapi.MessageReader(self.receiver)
+		vsapi.sendMessageOnSocket(self.sender, "<client/>")
+		self.assertEqual(reader.read(), "<client/>")
+
+	def test_00200_message_in_pieces(self):
+		reader = vsapi.MessageReader(self.receiver)
+		self.assertEqual(reader.read(), None)
+		self.sender.send("9  ")
+		self.assertEqual(reader.read(), None)
+		self.sender.send("  <cli")
+		self.assertEqual(reader.read(), None)
+		self.sender.send("ent/>")
+		self.assertEqual(reader.read(), "<client/>")
+
+	def test_00300_following_message_not_consumed(self):
+		reader = vsapi.MessageReader(self.receiver)
+		vsapi.sendMessageOnSocket(self.sender, "<client/>")
+		vsapi.sendMessageOnSocket(self.sender, "<ssm/>")
+		self.assertEqual(reader.read(), "<client/>")
+		self.receiver.setblocking(1)
+		self.assertEqual(vsapi.readMessageFromSocket(self.receiver), "<ssm/>")
+
+	def test_00400_disconnect(self):
+		reader = vsapi.MessageReader(self.receiver)
+		self.sender.close()
+		try:
+			reader.read()
+			self.fail("Disconnection was not detected")
+		except vsapi.VizError, e:
+			self.assertEqual(e.errorCode, vsapi.VizError.NOT_CONNECTED)
+
+	def test_00500_truncated_message(self):
+		reader = vsapi.MessageReader(self.receiver)
+		self.sender.send("20   <client")
+		self.sender.close()
+		try:
+			reader.read()
+			self.fail("Truncated message was not detected")
+		except vsapi.VizError, e:
+			self.assertEqual(e.errorCode, vsapi.VizError.BAD_PROTOCOL)
+
+	def test_00600_bad_length(self):
+		reader = vsapi.MessageReader(self.receiver)
+		self.sender.send("abcde")
+		self.assertRaises(vsapi.VizError, reader.read)
+
+class FrameTestCases(unittest.TestCase):
+	def setUp(self):
+		self.sender, self.receiver = socket.socketpair()
+
+	def tearDown(self):
+		self.sender.close()
+		self.receiver.close()
+
+	def sendInThread(self, *args):
+		# Large messages don't fit in the socket buffers
+		t = threading.Thread(target=vsapi.sendMessageOnSocket, args=(self.sender,)+args)
+		t.start()
+		return t
+
+	def test_00100_frame_fields(self):
+		vsapi.sendMessageOnSocket(self.sender, '{"attach":{}}', vsapi.FRAME_VERSION, vsapi.MSG_TYPE_JSON, 42)
+		self.assertEqual(vsapi.readFrameFromSocket(self.receiver, vsapi.FRAME_VERSION), [vsapi.MSG_TYPE_JSON, 42, '{"attach":{}}'])
+
+	def test_00200_legacy_frame_type(self):
+		vsapi.sendMessageOnSocket(self.sender, '{"attach":{}}')
+		vsapi.sendMessageOnSocket(self.sender, '<ssm/>')
+		self.assertEqual(vsapi.readFrameFromSocket(self.receiver), [vsapi.MSG_TYPE_JSON, 0, '{"attach":{}}'])
+		self.assertEqual(vsapi.readFrameFromSocket(self.receiver), [vsapi.MSG_TYPE_XML, 0, '<ssm/>'])
+
+	def test_00300_large_message(self):
+		msg = '<ssm>%s</ssm>'%('x'*500000)
+		t = self.sendInThread(msg, vsapi.FRAME_VERSION)
+		self.assertEqual(vsapi.readMessageFromSocket(self.receiver, vsapi.FRAME_VERSION), msg)
+		t.join()
+
+	def test_00400_legacy_size_limit(self):
+		vsapi.sendMessageOnSocket(self.sender, 'x'*vsapi.LEGACY_MAX_MESSAGE_SIZE)
+		self.assertRaises(vsapi.VizError, vsapi.sendMessageOnSocket, self.sender, 'x'*(vsapi.LEGACY_MAX_MESSAGE_SIZE+1))
+
+	def test_00500_reader_in_pieces(self):
+		self.receiver.setblocking(0)
+		reader = vsapi.MessageReader(self.receiver, vsapi.FRAME_VERSION)
+		frame = struct.pack(vsapi.FRAME_HEADER, vsapi.FRAME_VERSION, vsapi.MSG_TYPE_XML, 0, 7, 9) + '<client/>'
+		for i in range(len(frame)-1):
+			self.sender.send(frame[i])
+			self.assertEqual(reader.readFrame(), None)
+		self.sender.send(frame[-1])
+		self.assertEqual(reader.readFrame(), [vsapi.MSG_TYPE_XML, 7, '<client/>'])
+
+	def test_00600_switch_frame_version(self):
+		# The identity message is a version 1 frame, the rest are version 2
+		self.receiver.setblocking(0)
+		reader = vsapi.MessageReader(self.receiver)
+		vsapi.sendMessageOnSocket(self.sender, '<client/>')
+		vsapi.sendMessageOnSocket(self.sender, '<ssm/>', vsapi.FRAME_VERSION, vsapi.MSG_TYPE_XML, 3)
+		self.assertEqual(reader.read(), '<client/>')
+		reader.setFrameVersion(vsapi.FRAME_VERSION)
+		self.assertEqual(reader.readFrame(), [vsapi.MSG_TYPE_XML, 3, '<ssm/>'])
+
+	def test_00700_bad_header(self):
+		# a version 1 frame where a version 2 frame is expected
+		vsapi.sendMessageOnSocket(self.sender, '<ssm>%s</ssm>'%('x'*100))
+		self.assertRaises(vsapi.VizError, vsapi.readFrameFromSocket, self.receiver, vsapi.FRAME_VERSION)
+
+	def test_00800_bad_message_type(self):
+		self.sender.send(struct.pack(vsapi.FRAME_HEADER, vsapi.FRAME_VERSION, 99, 0, 0, 6) + '<ssm/>')
+		self.assertRaises(vsapi.VizError, vsapi.readFrameFromSocket, self.receiver, vsapi.FRAME_VERSION)
+
+	def test_00900_oversized_frame(self):
+		self.sender.send(struct.pack(vsapi.FRAME_HEADER, vsapi.FRAME_VERSION, vsapi.MSG_TYPE_XML, 0, 0, vsapi.MAX_MESSAGE_SIZE+1))
+		self.assertRaises(vsapi.VizError, vsapi.readFrameFromSocket, self.receiver, vsapi.FRAME_VERSION)
+
+	def test_01000_peek_frame_version(self):
+		vsapi.sendMessageOnSocket(self.sender, '<ssm/>')
+		vsapi.sendMessageOnSocket(self.sender, '<ssm/>', vsapi.FRAME_VERSION, vsapi.MSG_TYPE_XML, 5)
+		self.assertEqual(vsapi.peekFrameVersion(self.receiver), vsapi.LEGACY_FRAME_VERSION)
+		self.assertEqual(vsapi.readFrameFromSocket(self.receiver), [vsapi.MSG_TYPE_XML, 0, '<ssm/>'])
+		self.assertEqual(vsapi.peekFrameVersion(self.receiver), vsapi.FRAME_VERSION)
+		self.assertEqual(vsapi.readFrameFromSocket(self.receiver, vsapi.FRAME_VERSION), [vsapi.MSG_TYPE_XML, 5, '<ssm/>'])
+
+class PieceMessageReaderTestCases(MessageReaderTestCases):
+	# Without recv_into, frames are received a piece at a time
+	def setUp(self):
+		MessageReaderTestCases.setUp(self)
+		self.oldUseRecvInto = vsapi.useRecvInto
+		vsapi.useRecvInto = False
+
+	def tearDown(self):
+		vsapi.useRecvInto = self.oldUseRecvInto
+		MessageReaderTestCases.tearDown(self)
+
+class PieceFrameTestCases(FrameTestCases):
+	def setUp(self):
+		FrameTestCases.setUp(self)
+		self.oldUseRecvInto = vsapi.useRecvInto
+		vsapi.useRecvInto = False
+
+	def tearDown(self):
+		vsapi.useRecvInto = self.oldUseRecvInto
+		FrameTestCases.tearDown(self)
+
+EMPTY_RESPONSE = '<ssm><response><status>0</status><message>success</message><return_value></return_value></response></ssm>'
+
+class FakeSSM:
+	"""
+	Serves one client on a unix domain socket, answering each request with
+	EMPTY_RESPONSE. If accept is True, it accepts version 2 frames like the
+	SSM does. Else it behaves like older SSMs, which know only version 1
+	frames and don't reply to the identity message.
+	"""
+	def __init__(self, path, accept, numRequests):
+		self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.server.bind(path)
+		self.server.listen(1)
+		self.accept = accept
+		self.numRequests = numRequests
+		self.identity = None
+		self.requestFrameVersions = []
+		self.thread = threading.Thread(target=self.serve)
+		self.thread.start()
+
+	def serve(self):
+		conn, address = self.server.accept()
+		self.identity = vsapi.readMessageFromSocket(conn)
+		frameVersion = vsapi.LEGACY_FRAME_VERSION
+		if self.accept:
+			frameVersion = vsapi.FRAME_VERSION
+			vsapi.sendMessageOnSocket(conn, vsapi.CLIENT_ACCEPTED+'<encoding>xml</encoding><frameVersion>2</frameVersion></client_accepted></ssm>')
+		for i in range(self.numRequests):
+			requestFrameVersion = vsapi.LEGACY_FRAME_VERSION
+			try:
+				if self.accept:
+					requestFrameVersion = vsapi.peekFrameVersion(conn)
+				msgType, requestId, msg = vsapi.readFrameFromSocket(conn, requestFrameVersion)
+			except vsapi.VizError, e:
+				break
+			self.requestFrameVersions.append(requestFrameVersion)
+			vsapi.sendMessageOnSocket(conn, EMPTY_RESPONSE, frameVersion, vsapi.MSG_TYPE_XML, requestId)
+		conn.close()
+
+	def stop(self):
+		self.thread.join()
+		self.server.close()
+
+class HandshakeTestCases(unittest.TestCase):
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+		self.oldAddress = vsapi.SSM_UNIX_SOCKET_ADDRESS
+		self.oldGetMasterParameters = vsapi.getMasterParameters
+		vsapi.SSM_UNIX_SOCKET_ADDRESS = os.path.join(self.tempDir, 'socket')
+		vsapi.getMasterParameters = lambda : ['localhost', vsapi.SSM_UNIX_SOCKET_ADDRESS, 'Munge']
+
+	def tearDown(self):
+		vsapi.SSM_UNIX_SOCKET_ADDRESS = self.oldAddress
+		vsapi.getMasterParameters = self.oldGetMasterParameters
+		shutil.rmtree(self.tempDir)
+
+	def test_00100_older_ssm(self):
+		ssm = FakeSSM(vsapi.SSM_UNIX_SOCKET_ADDRESS, False, 2)
+		ra = vsapi.ResourceAccess(encoding=vsapi.ENCODING_JSON)
+		self.assertEqual(ra.getAllocationList(), [])
+		self.assertEqual(ra.getAllocationList(), [])
+		ra.stop()
+		ssm.stop()
+		self.assert_(ssm.identity.find('<frameVersion>2</frameVersion>')!=-1)
+		self.assertEqual(ssm.requestFrameVersions, [vsapi.LEGACY_FRAME_VERSION]*2)
+		self.assertEqual(ra.frameVersion, vsapi.LEGACY_FRAME_VERSION)
+		self.assertEqual(ra.encoding, vsapi.ENCODING_XML)
+
+	def test_00200_accepting_ssm(self):
+		ssm = FakeSSM(vsapi.SSM_UNIX_SOCKET_ADDRESS, True, 2)
+		ra = vsapi.ResourceAccess()
+		self.assertEqual(ra.getAllocationList(), [])
+		self.assertEqual(ra.frameVersion, vsapi.FRAME_VERSION)
+		self.assertEqual(ra.getAllocationList(), [])
+		ra.stop()
+		ssm.stop()
+		# Only the request sent before the acceptance arrived uses version 1
+		self.assertEqual(ssm.requestFrameVersions, [vsapi.LEGACY_FRAME_VERSION, vsapi.FRAME_VERSION])
+
+	def test_00300_legacy_client(self):
+		ssm = FakeSSM(vsapi.SSM_UNIX_SOCKET_ADDRESS, False, 1)
+		ra = vsapi.ResourceAccess(frameVersion=vsapi.LEGACY_FRAME_VERSION)
+		self.assertEqual(ra.getAllocationList(), [])
+		ra.stop()
+		ssm.stop()
+		self.assertEqual(ssm.identity, '<client><cleanupOnDisconnect>1</cleanupOnDisconnect></client>')
+
+if __name__ == '__main__':
+	tl = unittest.TestLoader()
+	suite1 = tl.loadTestsFromTestCase(MessageReaderTestCases)
+	suite2 = tl.loadTestsFromTestCase(FrameTestCases)
+	suite3 = tl.loadTestsFromTestCase(HandshakeTestCases)
+	suite4 = tl.loadTestsFromTestCase(PieceMessageReaderTestCases)
+	suite5 = tl.loadTestsFromTestCase(PieceFrameTestCases)
+
+	print 'Running protocol tests'
+	unittest.TextTestRunner().run(suite1)
+
+	print 'Running frame tests'
+	unittest.TextTestRunner().run(suite2)
+
+	print 'Running handshake tests'
+	unittest.TextTestRunner().run(suite3)
+
+	print 'Running protocol tests, without recv_into'
+	unittest.TextTestRunner().run(suite4)
+
+	print 'Running frame tests, without recv_into'
+	unittest.TextTestRunner().run(suite5)
@@ -0,0 +1,83 @@
+import unittest
+import os
+import shutil
+import tempfile
+import vsapi
+import vsutil
+
+rgTemplate = """<resourceGroup>
+	<name>%s</name>
+	<handler>tiled_display</handler>
+	<handler_params>
+		block_type="gpu";
+		num_blocks=[1,1];
+		block_display_layout=[%s];
+		display_device="HP LP3065";
+	</handler_params>
+	<resources>
+		<reslist>
+			<res><server><hostname>node1</hostname></server></res>
+			<res><gpu><hostname>node1</hostname><index>%d</index></gpu></res>
+		</reslist>
+	</resources>
+</resourceGroup>
+"""
+
+class ResourceGroupTestCases(unittest.TestCase):
+	def setUp(self):
+		self.tmpDir = tempfile.mkdtemp()
+		self.rgFile = os.path.join(self.tmpDir, 'resource_group_config.xml')
+		self.sysConfig = vsutil.loadLocalConfig(True, systemTemplateDir='../share/templates', overrideTemplateDir=self.tmpDir, configCacheFile='')
+		self.sysConfig['resource_groups'] = {}
+		self.digests = {}
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpDir)
+
+	def writeGroups(self, groups):
+		f = open(self.rgFile, 'w')
+		f.write('<resourcegroupconfig>')
+		for name, layout, gpuIndex in groups:
+			f.write(rgTemplate%(name, layout, gpuIndex))
+		f.write('</resourcegroupconfig>')
+		f.close()
+
+	def refresh(self):
+		resgroups, self.digests, changed = vsutil.updateResourceGroups(self.sysConfig, self.digests, self.rgFile)
+		self.sysConfig['resource_groups'] = resgroups
+		changed.sort()
+		return changed
+
+	def test_00100_load(self):
+		self.writeGroups([['td1', '1,1', 0], ['td2', '2,1', 1]])
+		self.assertEqual(self.refresh(), ['td1', 'td2'])
+		self.assertEqual(sorted(self.sysConfig['resource_groups'].keys()), ['td1', 'td2'])
+		self.assert_(isinstance(self.sysConfig['resource_groups']['td1'].getHandlerObject(), vsapi.TiledDisplay))
+		self.assertEqual(sorted(vsutil.loadResourceGroups(self.sysConfig, self.rgFile).keys()), ['td1', 'td2'])
+
+	def test_00200_only_changed_rebuilt(self):
+		self.writeGroups([['td1', '1,1', 0], ['td2', '1,1', 1], ['td3', '1,1', 2]])
+		self.refresh()
+		before = self.sysConfig['resource_groups'].copy()
+		self.writeGroups([['td1', '1,1', 0], ['td2', '2,1', 1], ['td4', '1,1', 3]])
+		self.assertEqual(self.refresh(), ['td2', 'td3', 'td4'])
+		after = self.sysConfig['resource_groups']
+		self.assertEqual(sorted(after.keys()), ['td1', 'td2', 'td4'])
+		self.assert_(after['td1'] is before['td1'])
+		self.failIf(after['td2'] is before['td2'])
+		self.assertEqual(self.refresh(), [])
+
+	def test_00300_bad_group_changes_nothing(self):
+		self.writeGroups([['td1', '1,1', 0]])
+		self.refresh()
+		before = self.sysConfig['resource_groups'].copy()
+		self.writeGroups([['td1', '1,1', 0], ['td1', '1,1', 1]])
+		self.assertRaises(vsapi.VizError, self.refresh)
+		self.assertEqual(self.sysConfig['resource_groups'], before)
+
+if __name__ == '__main__':
+	tl = unittest.TestLoader()
+	suite1 = tl.loadTestsFromTestCase(ResourceGroupTestCases)
+
+	print 'Running resource group tests'
+	unittest.TextTestRunner().run(suite1)
@@ -0,0 +1,137 @@
+import unittest
+import vsapi
+import slurmlauncher
+from xml.dom import minidom
+
+allClasses = [vsapi.GPU, vsapi.SLI, vsapi.Server, vsapi.Keyboard, vsapi.Mouse, vsapi.ResourceGroup, vsapi.VizNode, vsapi.DisplayDevice]
+
+def roundTripDict(ob):
+	# Pass the object through the JSON encoding, like the SSM protocol does
+	msg = vsapi.encodeJSONMessage({'value' : ob.toDict()})
+	return vsapi.deserializeVizResourceFromDict(vsapi.decodeJSONMessage(msg)['value'], allClasses)
+
+def roundTripXML(ob):
+	dom = minidom.parseString(ob.serializeToXML())
+	return vsapi.deserializeVizResource(dom.documentElement, allClasses)
+
+class DictSerializationTestCases(unittest.TestCase):
+	def assertRoundTrip(self, ob):
+		newOb = roundTripDict(ob)
+		self.assertEqual(newOb.__class__, ob.__class__)
+		self.assertEqual(newOb.toDict(), ob.toDict())
+		# The dictionary must carry the same information as the XML
+		self.assertEqual(newOb.toDict(), roundTripXML(ob).toDict())
+		return newOb
+
+	def createGPU(self, index):
+		gpu = vsapi.GPU(index, 'node1', model='Quadro FX 5800', busID='PCI:%d:0:0'%(index+1), useScanOut=True)
+		gpu.setVendor('NVIDIA Corporation')
+		gpu.setScanout(0, 'HP LP2065', 'digital', '1600x1200_60')
+		gpu.setScanout(1, 'HP LP2065', outputX=1600)
+		return gpu
+
+	def test_00100_keyboard_and_mouse(self):
+		kbd = vsapi.Keyboard(0, 'node1', 'SystemKeyboard', '/dev/input/event0')
+		kbd.addOwner(500)
+		self.assertRoundTrip(kbd)
+		self.assertRoundTrip(vsapi.Mouse(1, 'node1', 'SystemMouse'))
+
+	def test_00200_gpu(self):
+		gpu = self.createGPU(0)
+		gpu.setAllowStereo(True)
+		newGPU = self.assertRoundTrip(gpu)
+		self.assertEqual(newGPU.getScanouts()[1]['area_x'], 1600)
+		self.assertEqual(newGPU.getAllowStereo(), True)
+
+	def test_00300_shared_gpu(self):
+		gpu = vsapi.GPU(0, 'node1', model='Quadro FX 5800', busID='PCI:1:0:0')
+		gpu.setShareLimit(4)
+		gpu.setSharedServerIndex(20)
+		newGPU = self.assertRoundTrip(gpu)
+		self.assertEqual(newGPU.getSharedServer().getIndex(), 20)
+		self.assertEqual(newGPU.getSharedServer().getShareLimit(), 4)
+
+	def test_00400_gpu_with_schedulable(self):
+		gpu = vsapi.GPU(0, 'node1')
+		gpu.schedulable = vsapi.Schedulable(slurmlauncher.SLURMLauncher(42), 'node1')
+		newGPU = self.assertRoundTrip(gpu)
+		self.assertEqual(newGPU.toDict()['schedulable']['launcher']['schedId'], 42)
+		# detailedConfig=False leaves out the scheduler details
+		self.failIf(gpu.toDict(detailedConfig=False).has_key('schedulable'))
+
+	def test_00500_server_with_screens(self):
+		srv = vsapi.Server(0, 'node1')
+		srv.setArg('-nolisten', 'tcp')
+		srv.setArg('-dpms')
+		srv.setXExtensionSectionOption('Composite', 'Disable')
+		srv.setKeyboard(vsapi.Keyboard(0, 'node1', 'SystemKeyboard'))
+		scr = vsapi.Screen(0)
+		scr.setGPU(self.createGPU(0))
+		scr.setFBProperty('position', [0,0])
+		scr.setFBProperty('stereo', 'active')
+		srv.addScreen(scr)
+		scr = vsapi.Screen(1)
+		scr.setGPU(self.createGPU(1))
+		scr.setFBProperty('position', [1600,0])
+		srv.addScreen(scr)
+		newSrv = self.assertRoundTrip(srv)
+		self.assertEqual(len(newSrv.getScreens()), 2)
+		self.assertEqual(newSrv.getScreen(1).getFBProperty('position'), [1600,0])
+		# addrOnly gives just enough to identify the server
+		self.assertEqual(srv.toDict(addrOnly=True), {'class':'server', 'hostname':'node1', 'server_number':0})
+
+	def test_00600_sli(self):
+		sli = vsapi.SLI(0, 'node1', 'quadroplex', 0, 1)
+		sli.setMode('mosaic')
+		self.assertRoundTrip(sli)
+
+	def test_00700_display_device(self):
+		dom = minidom.parse('../share/templates/displays/HP-LP2065.xml')
+		dd = vsapi.deserializeVizResource(dom.documentElement, [vsapi.DisplayDevice])
+		newDD = self.assertRoundTrip(dd)
+		self.assertEqual(newDD.getAllModes(), dd.getAllModes())
+
+	def test_00800_node(self):
+		node = vsapi.VizNode('node1', 'Test', 0)
+		node.setProperty('fast_network', 'node1-ib')
+		node.addResource(self.createGPU(0))
+		node.addResource(self.createGPU(1))
+		node.addResource(vsapi.Keyboard(0, keyboardType='SystemKeyboard'))
+		node.addResource(vsapi.Server(0))
+		node.addResource(vsapi.Server(10, serverType=vsapi.VIRTUAL_SERVER))
+		node.addResource(vsapi.SLI(0, sliType='discrete', gpu0=0, gpu1=1))
+		newNode = self.assertRoundTrip(node)
+		self.assertEqual(len(newNode.getGPUs()), 2)
+		self.assertEqual(newNode.getProperty('fast_network'), 'node1-ib')
+
+	def test_00900_resource_group(self):
+		rg = vsapi.ResourceGroup('rg1', resources=[[vsapi.GPU(0, 'node1'), vsapi.Server(0, 'node1')], [vsapi.GPU(1, 'node1')]])
+		newRG = self.assertRoundTrip(rg)
+		self.assertEqual(len(newRG.getResources()), 2)
+		self.assertRoundTrip(vsapi.ResourceGroup('rg1'))
+
+	def test_01000_strings_are_str(self):
+		msg = vsapi.decodeJSONMessage(vsapi.encodeJSONMessage({'name' : 'caf\xe9', 'list' : ['a', 1, None]}))
+		self.assertEqual(msg, {'name' : 'caf\xe9', 'list' : ['a', 1, None]})
+		self.assert_(isinstance(msg.keys()[0], str))
+		self.assert_(isinstance(msg['name'], str))
+		# Bytes that happen to be valid utf-8 are still taken as iso-8859-1
+		msg = vsapi.decodeJSONMessage(vsapi.encodeJSONMessage({'name' : 'caf\xc3\xa9'}))
+		self.assertEqual(msg['name'], 'caf\xc3\xa9')
+
+	def test_01100_bad_input(self):
+		self.assertRaises(ValueError, vsapi.decodeJSONMessage, '[1,2]')
+		self.assertRaises(ValueError, vsapi.decodeJSONMessage, '{"truncated":')
+		self.assertRaises(ValueError, vsapi.deserializeVizResourceFromDict, {'class' : 'unknown'})
+		self.assertRaises(ValueError, vsapi.deserializeVizResourceFromDict, ['gpu'])
+		# Missing or badly typed fields are errors in the input
+		self.assertRaises(ValueError, vsapi.deserializeVizResourceFromDict, {'class' : 'gpu', 'scanouts' : [{'port_index' : 0}]})
+		self.assertRaises(ValueError, vsapi.deserializeVizResourceFromDict, {'class' : 'keyboard', 'options' : [{}]})
+		self.assertRaises(ValueError, vsapi.deserializeVizResourceFromDict, {'class' : 'server', 'server_type' : 'bogus'})
+
+if __name__ == '__main__':
+	tl = unittest.TestLoader()
+	suite1 = tl.loadTestsFromTestCase(DictSerializationTestCases)
+
+	print 'Running dictionary serialization tests'
+	unittest.TextTestRunner().run(suite1)
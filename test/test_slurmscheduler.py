@@ -0,0 +1,172 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+import threading
+import slurmscheduler
+
+#
+# These tests put a stub sinfo in front of the real one. The stub prints
+# the contents of a state file, and logs each time it's run, so we can
+# check how often the scheduler asks SLURM about its nodes.
+#
+
+STUB_SINFO = """#!/bin/sh
+echo "$@" >> "$SINFO_LOG"
+cat "$SINFO_STATE"
+"""
+
+STUB_SQUEUE = """#!/bin/sh
+cat "$SQUEUE_JOBS"
+"""
+
+# Takes a while, so that allocations made together overlap. The job ids
+# are the stub's process ids.
+STUB_SALLOC = """#!/bin/sh
+sleep 0.2
+echo "salloc: Granted job allocation $$"
+"""
+
+class SLURMNodeStateTestCases(unittest.TestCase):
+	def setUp(self):
+		self.tmpDir = tempfile.mkdtemp()
+		for name, stub in [['sinfo', STUB_SINFO], ['squeue', STUB_SQUEUE], ['salloc', STUB_SALLOC]]:
+			stubPath = os.path.join(self.tmpDir, name)
+			f = open(stubPath, 'w')
+			f.write(stub)
+			f.close()
+			os.chmod(stubPath, 0755)
+		self.oldEnv = {}
+		for name in ['PATH', 'SINFO_LOG', 'SINFO_STATE', 'SQUEUE_JOBS']:
+			self.oldEnv[name] = os.environ.get(name)
+		os.environ['PATH'] = '%s:%s'%(self.tmpDir, os.environ['PATH'])
+		os.environ['SINFO_LOG'] = os.path.join(self.tmpDir, 'log')
+		os.environ['SINFO_STATE'] = os.path.join(self.tmpDir, 'state')
+		os.environ['SQUEUE_JOBS'] = os.path.join(self.tmpDir, 'jobs')
+		self.setNodeState("idle node[1-3]\n")
+
+	def tearDown(self):
+		for name in self.oldEnv:
+			if self.oldEnv[name] is None:
+				del os.environ[name]
+			else:
+				os.environ[name] = self.oldEnv[name]
+		# A refresh started by invalidateNodeState may still be writing here
+		shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+	def setNodeState(self, state):
+		f = open(os.environ['SINFO_STATE'], 'w')
+		f.write(state)
+		f.close()
+
+	def getSinfoRuns(self):
+		try:
+			return open(os.environ['SINFO_LOG']).read().rstrip('\n').split('\n')
+		except IOError:
+			return []
+
+	def test_00100_unknown_node(self):
+		self.assertRaises(ValueError, slurmscheduler.SLURMScheduler, ['node4'], "")
+		self.assertRaises(ValueError, slurmscheduler.SLURMScheduler, ['node1'], "viz cache_ttl=abc")
+		self.assertRaises(ValueError, slurmscheduler.SLURMScheduler, ['node1'], "viz cache_ttl=-1")
+		self.assertRaises(ValueError, slurmscheduler.SLURMScheduler, ['node1'], "viz bogus=1")
+
+	def test_00200_partition(self):
+		sched = slurmscheduler.SLURMScheduler(['node1'], "viz cache_ttl=5")
+		self.assertEqual(sched.cacheTTL, 5)
+		self.assertEqual(self.getSinfoRuns(), ['-h -p viz -o %T %N'])
+
+	def test_00300_cached(self):
+		sched = slurmscheduler.SLURMScheduler(['node1', 'node2', 'node3'], "cache_ttl=60")
+		self.setNodeState("idle node[1-2]\ndown* node3\n")
+		# The state seen at startup is used till the TTL runs out
+		for i in range(10):
+			self.assertEqual(sched.getUnusableNodes(), [])
+		self.assertEqual(len(self.getSinfoRuns()), 1)
+
+	def test_00400_refresh_after_ttl(self):
+		sched = slurmscheduler.SLURMScheduler(['node1', 'node2', 'node3'], "cache_ttl=0.5")
+		self.assertEqual(sched.getUnusableNodes(), [])
+		self.setNodeState("drained node1\nidle node[2-3]\n")
+		time.sleep(1.5)
+		self.assertEqual(sched.getUnusableNodes(), ['node1'])
+
+	def test_00500_invalidate(self):
+		sched = slurmscheduler.SLURMScheduler(['node1', 'node2', 'node3'], "cache_ttl=60")
+		self.setNodeState("idle node1\ndown node[2-3]\n")
+		sched.invalidateNodeState()
+		self.assertEqual(sched.getUnusableNodes(), ['node2', 'node3'])
+
+	def test_00600_no_cache(self):
+		sched = slurmscheduler.SLURMScheduler(['node1'], "cache_ttl=0")
+		for i in range(3):
+			sched.getUnusableNodes()
+		self.assertEqual(len(self.getSinfoRuns()), 4)
+
+	def test_00700_sinfo_failure(self):
+		sched = slurmscheduler.SLURMScheduler(['node1'], "cache_ttl=60")
+		os.remove(os.environ['SINFO_STATE'])
+		self.assertRaises(slurmscheduler.SLURMError, sched.refreshNodeState)
+		# The last good snapshot is still used
+		self.assertEqual(sched.getUnusableNodes(), [])
+
+	def test_00800_reclaim(self):
+		sched = slurmscheduler.SLURMScheduler(['node1', 'node2', 'node3'], "cache_ttl=60")
+		f = open(os.environ['SQUEUE_JOBS'], 'w')
+		f.write("101\n103\n")
+		f.close()
+		requests = [
+			[{ 'class' : 'SLURMReservation', 'schedId' : 101 }, ['node1', 'node2'], 500],
+			[{ 'class' : 'SLURMReservation', 'schedId' : 102 }, ['node3'], 500],
+			[{ 'class' : 'LocalReservation' }, ['node3'], 500]
+		]
+		launchers = sched.reclaim(requests)
+		self.assertEqual(launchers[0].getSchedId(), 101)
+		self.assertEqual(launchers[1:], [None, None])
+		self.assertEqual(sched.allocationInfo.keys(), [101])
+		# Detaching forgets the job, without cancelling it
+		launchers[0].detach()
+		self.assertEqual(sched.allocationInfo, {})
+		self.assertEqual(launchers[0].getSchedId(), 101)
+
+		os.remove(os.environ['SQUEUE_JOBS'])
+		self.assertRaises(slurmscheduler.SLURMError, sched.reclaim, requests)
+
+	def test_00900_command_timer(self):
+		commands = []
+		slurmscheduler.setCommandTimer(lambda command, seconds: commands.append([command, seconds]))
+		try:
+			sched = slurmscheduler.SLURMScheduler(['node1'], "cache_ttl=60")
+			open(os.environ['SQUEUE_JOBS'], 'w').close()
+			sched.reclaim([])
+		finally:
+			slurmscheduler.setCommandTimer(None)
+		self.assertEqual(map(lambda x: x[0], commands), ['sinfo', 'squeue'])
+		self.assert_(min(map(lambda x: x[1], commands)) >= 0)
+
+	def test_01000_concurrent_allocations(self):
+		sched = slurmscheduler.SLURMScheduler(['node1', 'node2', 'node3'], "cache_ttl=60")
+		launchers = [None]*3
+		def allocate(index):
+			launchers[index] = sched.allocate(500, 500, ['node%d'%(index+1)])
+		threads = map(lambda x: threading.Thread(target=allocate, args=(x,)), range(3))
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		# Each allocation gets the job made for it
+		schedIds = map(lambda x: x.getSchedId(), launchers)
+		self.assertEqual(len(dict.fromkeys(schedIds)), 3)
+		self.assertEqual(sorted(sched.allocationInfo.keys()), sorted(schedIds))
+		for index in range(3):
+			self.assert_(sched.allocationInfo[schedIds[index]] is launchers[index])
+			launchers[index].detach()
+		self.assertEqual(sched.allocationInfo, {})
+
+if __name__ == '__main__':
+	tl = unittest.TestLoader()
+	suite1 = tl.loadTestsFromTestCase(SLURMNodeStateTestCases)
+
+	print 'Running SLURM node state tests'
+	unittest.TextTestRunner().run(suite1)
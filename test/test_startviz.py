@@ -0,0 +1,127 @@
+import unittest
+import subprocess
+import threading
+import Queue
+import time
+import vsapi
+import localscheduler
+
+#
+# These tests check how Allocation.startViz starts X servers, and waits for
+# them. No SSM is needed : X servers "come up" when the fake SSM below is
+# told so by the fake launcher.
+#
+
+class FakeWatch:
+	def __init__(self, servers):
+		self.changes = Queue.Queue()
+		self.stopped = False
+		# The first change for each X server is its current state
+		for srv in servers:
+			self.changes.put([srv, 0])
+
+	def getNextChange(self, timeout=None):
+		try:
+			return self.changes.get(True, timeout)
+		except Queue.Empty:
+			return None
+
+	def stop(self):
+		self.stopped = True
+
+class FakeResourceAccess(vsapi.ResourceAccess):
+	def __init__(self):
+		self.watch = None
+		self.stopCount = 0
+
+	def watchXState(self, allocObj, serverList=None):
+		self.watch = FakeWatch(serverList)
+		return self.watch
+
+	def stopXServers(self, allocObj, serverList=None):
+		self.stopCount += 1
+
+	def waitXState(self, allocObj, state, timeout=vsapi.X_WAIT_TIMEOUT, serverList=None):
+		pass
+
+class FakeLauncher:
+	"""
+	Pretends that starting an X server takes launchTime seconds, and that
+	the X server comes up upDelay seconds after that. If upDelay is None,
+	then the X server never comes up.
+	"""
+	def __init__(self, ra, srv, launchTime, upDelay):
+		self.ra = ra
+		self.srv = srv
+		self.launchTime = launchTime
+		self.upDelay = upDelay
+
+	def __deepcopy__(self, memo):
+		# Server objects copy their screens, but all copies need to tell
+		# the same fake SSM
+		return self
+
+	def run(self, args, node, inFile=None, outFile=None, errFile=None, launcherEnv=None):
+		time.sleep(self.launchTime)
+		if self.upDelay is not None:
+			threading.Timer(self.upDelay, self.ra.watch.changes.put, [[self.srv, 1]]).start()
+		return localscheduler.VizProcess(subprocess.Popen(['true']))
+
+def createAllocation(ra, launchTime, upDelays):
+	servers = []
+	for index in range(len(upDelays)):
+		srv = vsapi.Server(index, 'node1')
+		gpu = vsapi.GPU(index, 'node1')
+		gpu.setSchedulable(vsapi.Schedulable(FakeLauncher(ra, srv, launchTime, upDelays[index]), 'node1'))
+		scr = vsapi.Screen(0)
+		scr.setGPU(gpu)
+		srv.addScreen(scr)
+		servers.append(srv)
+	return [vsapi.Allocation(1, [servers]), servers]
+
+class StartVizTestCases(unittest.TestCase):
+	def setUp(self):
+		self.ra = FakeResourceAccess()
+
+	def test_00100_ready_callback(self):
+		alloc, servers = createAllocation(self.ra, 0, [0.6, 0.2, 0.4])
+		readyList = []
+		alloc.startViz(self.ra, onServerReady=lambda srv, elapsed: readyList.append(srv.getIndex()))
+		# Each X server is reported as soon as it is up
+		self.assertEqual(readyList, [1, 2, 0])
+		startupTimes = alloc.getXStartupTimes()
+		self.assertEqual(map(lambda x:x[0].getIndex(), startupTimes), [1, 2, 0])
+		for srv, elapsed in startupTimes:
+			self.assert_(abs(elapsed-[0.6, 0.2, 0.4][srv.getIndex()])<0.15, "Took %.2f seconds"%(elapsed))
+		self.assert_(self.ra.watch.stopped)
+		self.assertEqual(self.ra.stopCount, 0)
+
+	def test_00200_concurrent_launch(self):
+		# Launches that take a while overlap
+		alloc, servers = createAllocation(self.ra, 0.5, [0]*4)
+		startTime = time.time()
+		alloc.startViz(self.ra)
+		elapsed = time.time()-startTime
+		self.assert_(elapsed<1.0, "Starting took %.2f seconds"%(elapsed))
+		self.assertEqual(len(alloc.getXStartupTimes()), 4)
+
+	def test_00300_timeout(self):
+		alloc, servers = createAllocation(self.ra, 0, [0.1, None])
+		startTime = time.time()
+		self.assertRaises(vsapi.VizError, alloc.startViz, self.ra, 1)
+		elapsed = time.time()-startTime
+		self.assert_((elapsed>0.9) and (elapsed<2), "Timeout took %.2f seconds"%(elapsed))
+		# The X servers are stopped on failure
+		self.assertEqual(self.ra.stopCount, 1)
+		self.assert_(self.ra.watch.stopped)
+
+	def test_00400_bad_timeout(self):
+		alloc, servers = createAllocation(self.ra, 0, [0])
+		self.assertRaises(ValueError, alloc.startViz, self.ra, vsapi.X_WAIT_MAX+1)
+
+if __name__ == '__main__':
+	tl = unittest.TestLoader()
+	suite1 = tl.loadTestsFromTestCase(StartVizTestCases)
+
+	print 'Running startViz tests'
+	unittest.TextTestRunner().run(suite1)
@@ -0,0 +1,85 @@
+import unittest
+import os
+import socket
+import signal
+import subprocess
+import time
+import vsapi
+
+#
+# These tests start X servers on this node using vs-X, the way the
+# schedulers do. They need to run as root, with an SSM that manages
+# this node, and an X server. Set VS_X to test a vs-X other than the
+# installed one.
+#
+
+VS_X = os.environ.get('VS_X', '/opt/vizstack/bin/vs-X')
+
+def restoreSignals():
+	# Python ignores SIGPIPE, and children inherit that. vs-X normally
+	# runs from a shell, which leaves SIGPIPE with its default action.
+	signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+def waitForExit(proc, timeout=5):
+	endTime = time.time() + timeout
+	while (proc.poll() is None) and (time.time() < endTime):
+		time.sleep(0.1)
+	return proc.poll()
+
+class VSXTestCases(unittest.TestCase):
+	def setUp(self):
+		self.ra = vsapi.ResourceAccess()
+		self.hostName = socket.gethostname()
+		self.procs = []
+
+	def tearDown(self):
+		for proc in self.procs:
+			if proc.poll() is None:
+				os.kill(proc.pid, signal.SIGKILL)
+				proc.wait()
+		self.ra.stop()
+
+	def startVSX(self, srv, allocId=None):
+		cmd = [VS_X, srv.getDISPLAY()]
+		if allocId is not None:
+			cmd = cmd + ['--allocId', '%d'%(allocId)]
+		proc = subprocess.Popen(cmd, preexec_fn=restoreSignals)
+		self.procs.append(proc)
+		return proc
+
+	def setupServer(self, alloc, srv, gpu):
+		scr = vsapi.Screen(0)
+		scr.setFBProperty('resolution', [1024, 768])
+		scr.setGPU(gpu)
+		srv.addScreen(scr)
+		alloc.setupViz(self.ra)
+
+	def test_00100_start_server(self):
+		alloc = self.ra.allocate([[vsapi.Server(None, self.hostName), vsapi.GPU(None, self.hostName)]])
+		srv, gpu = alloc.getResources()[0]
+		self.setupServer(alloc, srv, gpu)
+		proc = self.startVSX(srv)
+		self.ra.waitXState(alloc, 1, 30)
+		self.assertEqual(proc.poll(), None)
+		self.ra.deallocate(alloc)
+		self.assertEqual(waitForExit(proc), 0)
+
+	def test_00200_start_shared_server(self):
+		reqGPU = vsapi.GPU(None, self.hostName)
+		reqGPU.setShared(True)
+		alloc = self.ra.allocate([[reqGPU]])
+		gpu = alloc.getResources()[0][0]
+		srv = gpu.getSharedServer()
+		self.setupServer(alloc, srv, gpu)
+		proc = self.startVSX(srv, alloc.getId())
+		self.ra.waitXState(alloc, 1, 30, [srv])
+		self.assertEqual(proc.poll(), None)
+		self.ra.deallocate(alloc)
+		self.assertEqual(waitForExit(proc), 0)
+
+if __name__ == '__main__':
+	tl = unittest.TestLoader()
+	suite1 = tl.loadTestsFromTestCase(VSXTestCases)
+
+	print 'Running vs-X tests'
+	unittest.TextTestRunner().run(suite1)
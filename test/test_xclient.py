@@ -0,0 +1,221 @@
+import unittest
+import socket
+import select
+import time
+import threading
+import vsapi
+
+#
+# These tests connect to the SSM the way vs-X does, as X clients of
+# allocated X servers, and check that the SSM asks the right X clients
+# to exit. They need to run as root, or as a user allowed to use the
+# X servers.
+#
+
+def connectXClient(ra, srv, allocId):
+	payload = '<xclient>%s<allocId>%d</allocId></xclient>'%(srv.serializeToXML(), allocId)
+	if ra.masterHost == "localhost":
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.connect(vsapi.SSM_UNIX_SOCKET_ADDRESS)
+	else:
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.connect((ra.masterHost, int(ra.masterPort)))
+		payload = vsapi.encode_message_with_auth(ra.masterAuth, payload)
+	vsapi.sendMessageOnSocket(sock, payload)
+	return sock
+
+def askedToExit(sock, timeout=3):
+	# The SSM asks an X client to exit by closing its end of the socket
+	ready, w, e = select.select([sock], [], [], timeout)
+	return (len(ready)>0) and (sock.recv(1)=='')
+
+def setXState(sock, srv, newState):
+	# vs-X sends this when its X server starts or stops
+	vsapi.sendMessageOnSocket(sock, '<ssm><update_x_avail><newState>%d</newState>%s</update_x_avail></ssm>'%(newState, srv.serializeToXML()))
+
+def later(delay, func, *args):
+	t = threading.Timer(delay, func, args)
+	t.start()
+	return t
+
+class XClientTestCases(unittest.TestCase):
+	def setUp(self):
+		self.ra = vsapi.ResourceAccess()
+		self.xclients = []
+
+	def tearDown(self):
+		for sock in self.xclients:
+			sock.close()
+		self.ra.stop()
+
+	def connect(self, srv, alloc):
+		sock = connectXClient(self.ra, srv, alloc.getId())
+		self.xclients.append(sock)
+		return sock
+
+	def allocateServers(self, numServers):
+		alloc = self.ra.allocate([[vsapi.Server()]*numServers])
+		servers = alloc.getResources()[0]
+		sockets = map(lambda x: self.connect(x, alloc), servers)
+		# Wait for the SSM to register the X clients
+		time.sleep(0.5)
+		return [alloc, servers, sockets]
+
+	def test_00100_stop_one_server(self):
+		alloc, servers, sockets = self.allocateServers(2)
+		self.ra.stopXServers(alloc, [servers[1]])
+		self.assert_(askedToExit(sockets[1]))
+		self.failIf(askedToExit(sockets[0], 0.5))
+		self.ra.deallocate(alloc)
+
+	def test_00200_stop_all_servers(self):
+		alloc, servers, sockets = self.allocateServers(2)
+		self.ra.stopXServers(alloc)
+		for sock in sockets:
+			self.assert_(askedToExit(sock))
+		self.ra.deallocate(alloc)
+
+	def test_00300_deallocate(self):
+		alloc1, servers1, sockets1 = self.allocateServers(1)
+		alloc2, servers2, sockets2 = self.allocateServers(1)
+		self.ra.deallocate(alloc1)
+		self.assert_(askedToExit(sockets1[0]))
+		self.failIf(askedToExit(sockets2[0], 0.5))
+		self.ra.deallocate(alloc2)
+		self.assert_(askedToExit(sockets2[0]))
+
+	def test_00400_cleanup_on_disconnect(self):
+		alloc, servers, sockets = self.allocateServers(1)
+		self.ra.stop()
+		self.assert_(askedToExit(sockets[0]))
+		self.ra = vsapi.ResourceAccess()
+		self.assertEqual(self.ra.getAllocationList(), [])
+
+	def timedWait(self, alloc, newState, timeout, serverList=None):
+		startTime = time.time()
+		self.ra.waitXState(alloc, newState, timeout, serverList)
+		return time.time()-startTime
+
+	def test_00500_wait_for_start(self):
+		alloc, servers, sockets = self.allocateServers(2)
+		t1 = later(0.5, setXState, sockets[0], servers[0], 1)
+		t2 = later(1.0, setXState, sockets[1], servers[1], 1)
+		# The wait finishes when the last X server comes up
+		elapsed = self.timedWait(alloc, 1, 10)
+		self.assert_((elapsed>0.9) and (elapsed<3), "Wait took %.2f seconds"%(elapsed))
+		t1.join()
+		t2.join()
+		self.ra.deallocate(alloc)
+
+	def test_00600_wait_timeout(self):
+		alloc, servers, sockets = self.allocateServers(1)
+		startTime = time.time()
+		self.assertRaises(vsapi.VizError, self.ra.waitXState, alloc, 1, 1)
+		elapsed = time.time()-startTime
+		self.assert_((elapsed>0.9) and (elapsed<2.5), "Timeout took %.2f seconds"%(elapsed))
+		self.ra.deallocate(alloc)
+
+	def test_00700_wait_for_stop(self):
+		alloc, servers, sockets = self.allocateServers(1)
+		setXState(sockets[0], servers[0], 1)
+		self.timedWait(alloc, 1, 10)
+		# an X client going away means its X server stopped
+		t = later(0.5, sockets[0].close)
+		elapsed = self.timedWait(alloc, 0, 10)
+		self.assert_(elapsed<3, "Wait took %.2f seconds"%(elapsed))
+		t.join()
+		self.ra.deallocate(alloc)
+
+	def test_00800_deallocate_while_waiting(self):
+		alloc, servers, sockets = self.allocateServers(1)
+		ra2 = vsapi.ResourceAccess()
+		t = later(0.5, ra2.deallocate, alloc.getId())
+		startTime = time.time()
+		self.assertRaises(vsapi.VizError, self.ra.waitXState, alloc, 1, 10)
+		self.assert_(time.time()-startTime<3)
+		t.join()
+		ra2.stop()
+
+	def test_00900_wait_for_some_servers(self):
+		alloc, servers, sockets = self.allocateServers(2)
+		t = later(0.5, setXState, sockets[1], servers[1], 1)
+		# servers[0] staying down doesn't matter
+		elapsed = self.timedWait(alloc, 1, 10, [servers[1]])
+		self.assert_(elapsed<3, "Wait took %.2f seconds"%(elapsed))
+		t.join()
+		self.ra.deallocate(alloc)
+
+	def assertChange(self, watch, server, newState):
+		change = watch.getNextChange(3)
+		self.failIf(change is None, "No X server state change seen")
+		self.assertEqual(change[0].hashKey(), server.hashKey())
+		self.assertEqual(change[1], newState)
+
+	def test_01000_watch(self):
+		alloc, servers, sockets = self.allocateServers(2)
+		setXState(sockets[0], servers[0], 1)
+		watch = self.ra.watchXState(alloc)
+		# The current state of every X server comes first
+		changes = {}
+		for i in range(2):
+			srv, newState = watch.getNextChange(3)
+			changes[srv.hashKey()] = newState
+		self.assertEqual(changes, {servers[0].hashKey() : 1, servers[1].hashKey() : 0})
+		setXState(sockets[1], servers[1], 1)
+		self.assertChange(watch, servers[1], 1)
+		# Repeating the state isn't a change
+		setXState(sockets[1], servers[1], 1)
+		sockets[0].close()
+		self.assertChange(watch, servers[0], 0)
+		self.assertEqual(watch.getNextChange(0.5), None)
+		# The watch ends with the allocation
+		self.ra.deallocate(alloc)
+		self.assertRaises(vsapi.VizError, watch.getNextChange, 3)
+
+	def test_01100_watch_some_servers(self):
+		alloc, servers, sockets = self.allocateServers(2)
+		watch = self.ra.watchXState(alloc, [servers[1]])
+		self.assertChange(watch, servers[1], 0)
+		setXState(sockets[0], servers[0], 1)
+		setXState(sockets[1], servers[1], 1)
+		self.assertChange(watch, servers[1], 1)
+		watch.stop()
+		self.ra.deallocate(alloc)
+
+	def test_01200_query_while_waiting(self):
+		alloc, servers, sockets = self.allocateServers(1)
+		wait = self.ra.submit("waitXState", alloc, 1, 10)
+		# The wait doesn't hold up other requests on the same connection
+		startTime = time.time()
+		self.assertEqual(len(self.ra.getAllocationList()), 1)
+		self.assert_(time.time()-startTime<1)
+		self.failIf(wait.isDone())
+		setXState(sockets[0], servers[0], 1)
+		self.assertEqual(wait.getResult(3), None)
+		self.ra.deallocate(alloc)
+
+	def test_01300_many_waits(self):
+		alloc, servers, sockets = self.allocateServers(2)
+		wait0 = self.ra.submit("waitXState", alloc, 1, 10, [servers[0]])
+		wait1 = self.ra.submit("waitXState", alloc, 1, 10, [servers[1]])
+		# Responses come in the order the waits are done
+		setXState(sockets[1], servers[1], 1)
+		self.assert_(wait1.wait(3))
+		self.failIf(wait0.wait(0.5))
+		setXState(sockets[0], servers[0], 1)
+		self.assert_(wait0.wait(3))
+		self.ra.deallocate(alloc)
+
+	def test_01400_deallocate_while_waiting(self):
+		alloc, servers, sockets = self.allocateServers(1)
+		wait = self.ra.submit("waitXState", alloc, 1, None)
+		time.sleep(0.5)
+		self.ra.deallocate(alloc)
+		self.assertRaises(vsapi.VizError, wait.getResult, 3)
+
+if __name__ == '__main__':
+	tl = unittest.TestLoader()
+	suite1 = tl.loadTestsFromTestCase(XClientTestCases)
+
+	print 'Running X client tests'
+	unittest.TextTestRunner().run(suite1)
@@ -0,0 +1,160 @@
+import unittest
+import os
+import sys
+import time
+import tempfile
+import vsapi
+import vsutil
+
+edidBytes = [
+	"00 ff ff ff ff ff ff 00  22 f0 86 26 01 01 01 01",
+	"0c 12 01 03 80 40 28 78  ee 8e d5 a5 54 4b 9a 24",
+	"0f 50 54 a5 6b 80 81 40  81 80 a9 40 b3 00 01 01",
+	"01 01 01 01 01 01 bc 68  00 a0 a0 40 2e 60 30 20",
+	"36 00 81 90 21 00 00 1a  00 00 00 fd 00 30 55 1e",
+	"5e 15 00 0a 20 20 20 20  20 20 00 00 00 fc 00 48",
+	"50 20 4c 50 33 30 36 35  0a 20 20 20 00 00 00 ff",
+	"00 43 5a 4b 38 31 32 30  4c 38 37 0a 20 20 00 77",
+]
+
+def edidLines(prefix, gpu, name, port):
+	lines = []
+	def add(text):
+		lines.append("(--) %sNVIDIA(%d): %s\n"%(prefix, gpu, text))
+	add("--- EDID for %s (%s) ---"%(name, port))
+	add("32-bit Serial Number         : 16843009")
+	add("Serial Number String         : ")
+	add("Manufacture Date             : 2008, week 12")
+	add("Valid HSync Range            : 30.0 kHz - 99.0 kHz")
+	add("Valid VRefresh Range         : 48 Hz - 85 Hz")
+	add("Maximum Image Size           : 640mm x 400mm")
+	add("Prefer first detailed timing : Yes")
+	add("")
+	add("Supported Modes:")
+	add("  1280 x 800  @ 60 Hz")
+	add("  1920 x 1200 @ 60 Hz")
+	add("")
+	add("Detailed Timings:")
+	add("  2560 x 1600 @ 60 Hz")
+	add("    Pixel Clock      : 268.00 MHz")
+	add("")
+	add("Raw EDID bytes:")
+	add("")
+	for line in edidBytes:
+		add("  "+line)
+	add("")
+	add("--- End of EDID for %s (%s) ---"%(name, port))
+	return lines
+
+def noiseLines(count):
+	"""
+	Mode validation output, which is most of the log with -logverbose 6
+	"""
+	lines = []
+	for i in range(count):
+		width = 640+(i%20)*80
+		height = 480+(i%20)*60
+		for text in [
+			'  Validating Mode "%dx%d_85":'%(width, height),
+			'    Mode Source: X Server',
+			'    %d x %d @ 85 Hz'%(width, height),
+			'    Pixel Clock      : 229.50 MHz',
+			'    HRes, HSyncStart : %d, %d'%(width, width+64),
+			'    VRes, VSyncStart : %d, %d'%(height, height+1),
+			'    Sync Polarity    : +H +V',
+			'    Mode is rejected: PixelClock (229.5 MHz) too high for Display Device (Max: 165.0 MHz).']:
+			lines.append("(II) Mar 10 06:40:21 NVIDIA(0): %s\n"%(text))
+		lines.append("(II) Mar 10 06:40:21 Loading extension GLX\n")
+	return lines
+
+def sampleLog(noise=0):
+	lines = [
+		"X.Org X Server 1.6.5\n",
+		"(II) NVIDIA(0): Supported display device(s): CRT-0, CRT-1, DFP-0, DFP-1,\n",
+		"(II) NVIDIA(0):     DFP-2, DFP-3\n",
+		"(II) Mar 10 06:40:21 NVIDIA(1): Supported display device(s): DFP-0\n",
+	]
+	lines += noiseLines(noise)
+	lines += edidLines("", 0, "HP LP3065", "DFP-0")
+	lines += noiseLines(noise)
+	lines += edidLines("Mar 10 06:40:22 ", 1, "LPL", "CRT-1")
+	lines += noiseLines(noise)
+	return lines
+
+class XLogParseTestCases(unittest.TestCase):
+	def setUp(self):
+		fd, self.logFile = tempfile.mkstemp()
+		os.close(fd)
+
+	def tearDown(self):
+		os.unlink(self.logFile)
+
+	def parse(self, lines):
+		open(self.logFile, 'w').write("".join(lines))
+		return vsutil.parseXLogFile(fname=self.logFile)
+
+	def test_00100_scanouts(self):
+		info = self.parse(sampleLog())
+		self.assertEqual(info['possible_scanouts'], [
+			{ 'GPU' : 0, 'scanouts' : { 0 : ['CRT', 'DFP'], 1 : ['CRT', 'DFP'], 2 : ['DFP'], 3 : ['DFP'] } },
+			{ 'GPU' : 1, 'scanouts' : { 0 : ['DFP'] } } ])
+
+	def test_00200_displays(self):
+		info = self.parse(sampleLog(noise=10))
+		displays = info['connected_displays']
+		self.assertEqual(len(displays), 2)
+		disp = displays[0]
+		self.assertEqual([disp['GPU'], disp['display_device'], disp['output_type'], disp['port_index']], [0, 'HP LP3065', 'DFP', 0])
+		self.assertEqual(disp['edid_modes'], [[1280, 800, '60'], [1920, 1200, '60'], [2560, 1600, '60']])
+		self.assertEqual(disp['first_detailed_timing'], [2560, 1600, '60'])
+		self.assertEqual(disp['hsync_range'], ['30.0', '99.0'])
+		self.assertEqual(disp['vrefresh_range'], ['48', '85'])
+		self.assertEqual(disp['Manufacture Date'], '2008, week 12')
+		self.assertEqual(disp['Serial Number String'], None)
+		self.assertEqual("".join(disp['edid_bytes']), "".join(edidBytes).replace(" ", ""))
+		dd = disp['display_template']
+		self.assertEqual(dd.getInput(), 'digital')
+		self.assertEqual(dd.getDefaultMode()['alias'], '2560x1600_60')
+		self.assertEqual(dd.getDimensions(), [640, 400])
+		disp = displays[1]
+		self.assertEqual([disp['GPU'], disp['display_device'], disp['output_type'], disp['port_index']], [1, 'LPL', 'CRT', 1])
+		self.assertEqual(disp['display_template'].getInput(), 'analog')
+
+	def test_00300_bad_property(self):
+		lines = sampleLog()
+		lines.insert(lines.index("(--) NVIDIA(0): Maximum Image Size           : 640mm x 400mm\n"), "(II) Loading extension GLX\n")
+		self.assertRaises(ValueError, self.parse, lines)
+
+def benchmark(sizeMB):
+	"""
+	Time parsing a log of about sizeMB megabytes, most of which is the kind
+	of output the driver writes with -logverbose 6.
+	"""
+	fd, logFile = tempfile.mkstemp()
+	os.close(fd)
+	try:
+		lines = []
+		size = 0
+		while size < sizeMB*1024*1024:
+			block = sampleLog(noise=1000)
+			lines += block
+			size += sum(map(len, block))
+		open(logFile, 'w').write("".join(lines))
+		start = time.time()
+		info = vsutil.parseXLogFile(fname=logFile)
+		elapsed = time.time()-start
+		print "Parsed %.1f MB (%d lines, %d displays) in %.3f s"%(size/(1024.0*1024), len(lines), len(info['connected_displays']), elapsed)
+	finally:
+		os.unlink(logFile)
+
+if __name__ == '__main__':
+	if (len(sys.argv)>1) and (sys.argv[1]=='--benchmark'):
+		for sizeMB in sys.argv[2:] or [1, 4, 16]:
+			benchmark(float(sizeMB))
+		sys.exit(0)
+
+	tl = unittest.TestLoader()
+	suite1 = tl.loadTestsFromTestCase(XLogParseTestCases)
+
+	print 'Running X log parsing tests'
+	unittest.TextTestRunner().run(suite1)